@@ -0,0 +1,4 @@
+"""
+Benchmarks for the functions backend. Every module can be run on its own from
+the functions folder, for example `python -m benchmarks.observation`.
+"""
@@ -0,0 +1,103 @@
+"""
+End to end check of the asynchronous AI pipeline against the local emulators.
+A game is created and a turn is played through the callables, and the AI reply
+written by the worker is picked up with a snapshot listener, as the client
+does. Reports the request latency against the time until the reply arrives.
+
+Usage, with SHOGI_ASYNC_AI=true in functions/.env.local:
+    firebase emulators:start --only functions,firestore
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python -m benchmarks.async_e2e
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import firebase_admin
+
+from benchmarks.firestore_writes import EmulatorCredential
+from repository.dataclasses.game import AI_FAILED, AI_PENDING
+from repository.game_repository import GameRepository
+
+
+def call(functions_url: str, name: str, data: dict) -> any:
+    """Call a callable function with the callable protocol, and get its result"""
+    request = urllib.request.Request(
+        f"{functions_url}/{name}",
+        data=json.dumps({"data": data}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        body = json.load(response)
+    if "error" in body:
+        raise RuntimeError(f"{name} failed: {body['error']}")
+    return body["result"]
+
+
+def play_turn(repository: GameRepository, functions_url: str, timeout: float):
+    """
+    Play one turn of a new game, and wait for the AI reply through a snapshot
+    listener. Get the request and reply latencies in seconds.
+    """
+    uid = call(functions_url, "create_game", {})
+    replied = threading.Event()
+    snapshots = []
+
+    def on_snapshot(documents, _changes, _read_time):
+        game_dict = documents[0].to_dict()
+        snapshots.append(game_dict)
+        if game_dict.get("move_count") == 2 or game_dict.get("ai_status") == AI_FAILED:
+            replied.set()
+
+    game_ref = repository.db.collection(repository.collection).document(uid)
+    watch = game_ref.on_snapshot(on_snapshot)
+    try:
+        start = time.perf_counter()
+        result = call(
+            functions_url,
+            "play_turn",
+            {"uid": uid, "from_square": "7g", "to_square": "7f", "promotion": False},
+        )
+        request_seconds = time.perf_counter() - start
+        assert result["ai_status"] == AI_PENDING, "The functions do not run async AI"
+
+        if not replied.wait(timeout):
+            raise TimeoutError(f"No AI reply within {timeout}s")
+        reply_seconds = time.perf_counter() - start
+    finally:
+        watch.unsubscribe()
+
+    game_dict = snapshots[-1]
+    assert game_dict.get("ai_status") is None, game_dict.get("ai_status")
+    return request_seconds, reply_seconds
+
+
+def main():
+    """Play turns through the emulators and report the latencies"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument(
+        "--functions-url", default="http://127.0.0.1:5001/shogiai/europe-west1"
+    )
+    parser.add_argument("--project", default="shogiai")
+    parser.add_argument("--games", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    app = firebase_admin.initialize_app(
+        EmulatorCredential(), {"projectId": args.project}, name="e2e"
+    )
+    repository = GameRepository(app)
+    for game in range(1, args.games + 1):
+        request_seconds, reply_seconds = play_turn(
+            repository, args.functions_url, args.timeout
+        )
+        print(
+            f"game {game}: play_turn answered in {request_seconds * 1000:7.1f}ms, "
+            f"AI reply after {reply_seconds * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Accuracy and latency report of the inference backends against the eager
+float32 model.
+
+Usage:
+    python -m benchmarks.backends --model model/shogi-agent.pth
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import torch
+
+from benchmarks.models import latency_ms
+from benchmarks.positions import random_positions
+from services.ai import inference
+from services.ai.deep_q_network import ARCHITECTURES, build_network
+from services.ai.distill import legal_mask
+from services.ai.observation import ObservationEncoder
+
+
+def masked_moves(values: torch.Tensor, illegal: torch.Tensor) -> torch.Tensor:
+    """
+    Get the best legal move index of every position.
+    """
+    return values.masked_fill(illegal, -torch.inf).argmax(dim=1)
+
+
+def export_backend(
+    eager: torch.nn.Module, checkpoint: str, backend: str
+) -> (torch.nn.Module, dict):
+    """
+    Export the model to the backend and reload it from its sidecar, with timings.
+    """
+    start = time.perf_counter()
+    network = inference.prepare(eager, checkpoint, backend)
+    export_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sidecar_network = inference.load_sidecar(checkpoint, backend)
+    load_seconds = time.perf_counter() - start
+    if sidecar_network is not None:
+        network = sidecar_network
+
+    artifact = checkpoint
+    if backend != "eager":
+        artifact = inference.sidecar_path(checkpoint, backend)
+    return network, {
+        "size": os.path.getsize(artifact),
+        "export": export_seconds,
+        "load": load_seconds,
+    }
+
+
+def load_state_dict(path: str, architecture: str) -> dict:
+    """
+    Load the checkpoint, or get untrained weights when there is none.
+    """
+    if os.path.isfile(path):
+        return torch.load(path, map_location="cpu")
+    return build_network(architecture).state_dict()
+
+
+def main():
+    """Export the model to every backend and compare it against eager"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--model", default="model/shogi-agent.pth")
+    parser.add_argument("--architecture", default="dqn", choices=ARCHITECTURES)
+    parser.add_argument("--positions", type=int, default=64)
+    args = parser.parse_args()
+
+    eager = build_network(
+        args.architecture, load_state_dict(args.model, args.architecture)
+    )
+    eager.eval()
+
+    boards = random_positions(args.positions, plies=40)
+    observations = torch.from_numpy(ObservationEncoder().encode_batch(boards))
+    masks = torch.stack([torch.from_numpy(legal_mask(board)) for board in boards])
+    with torch.inference_mode():
+        reference = eager(observations)
+    reference_moves = masked_moves(reference, masks == 0)
+
+    directory = tempfile.mkdtemp()
+    try:
+        checkpoint = os.path.join(directory, "shogi-agent.pth")
+        # Unwrap the shim of an old checkpoint, to save it in its own format
+        torch.save(getattr(eager, "network", eager).state_dict(), checkpoint)
+        for backend in inference.BACKENDS:
+            network, stats = export_backend(eager, checkpoint, backend)
+            with torch.inference_mode():
+                values = network(observations)
+            moves = masked_moves(values, masks == 0)
+            print(
+                f"{backend:>12}: {stats['size'] / 2**20:8.1f} MiB, "
+                f"export {stats['export']:6.2f}s, load {stats['load']:6.3f}s, "
+                f"batch 1 {latency_ms(network, 1):7.2f}ms, "
+                f"max error {(values - reference).abs().max().item():.2e}, "
+                f"move agreement {(moves == reference_moves).float().mean():.1%}"
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Cold start import time per endpoint. Every endpoint is started in a fresh
+interpreter with python -X importtime, importing main and then the modules the
+endpoint loads on first use. The run fails when an endpoint without AI moves
+imports one of the heavy AI modules.
+
+Usage:
+    python -m benchmarks.cold_start --repeat 3
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Modules every endpoint loads after importing main
+ENDPOINTS = {
+    "create_game": [],
+    "make_move": [],
+    "read_legal_moves": [],
+    "ai_move": ["services.ai_service"],
+    "play_turn": ["services.ai_service"],
+    "ai_move_worker": ["services.ai_service"],
+}
+
+# Modules only endpoints with AI moves may load
+HEAVY_MODULES = ("torch", "gymnasium", "numpy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_endpoint(modules: list[str]) -> (float, dict[str, float], list[str]):
+    """
+    Import main and the modules in a fresh interpreter. Get the wall time, the
+    cumulative import time of every top level module, and the heavy modules
+    that were loaded.
+    """
+    imports = "; ".join(f"import {module}" for module in ["main", *modules])
+    check = f"import sys; print(*[m for m in {HEAVY_MODULES} if m in sys.modules])"
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{imports}; {check}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    seconds = time.perf_counter() - start
+
+    cumulative = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        # Top level imports are not indented
+        if not name.startswith("  ") and total.strip().isdigit():
+            cumulative[name.strip()] = int(total) / 1e6
+    return seconds, cumulative, process.stdout.split()
+
+
+def main():
+    """Start every endpoint and report its cold start time"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS))
+    args = parser.parse_args()
+
+    failures = []
+    for endpoint in args.endpoints:
+        runs = [start_endpoint(ENDPOINTS[endpoint]) for _ in range(args.repeat)]
+        seconds, cumulative, heavy = min(runs, key=lambda run: run[0])
+        slowest = sorted(cumulative.items(), key=lambda item: -item[1])[:3]
+        print(
+            f"{endpoint:>16}: {seconds * 1000:7.0f}ms wall, "
+            f"{sum(cumulative.values()) * 1000:7.0f}ms imports, slowest "
+            + ", ".join(f"{name} {total * 1000:.0f}ms" for name, total in slowest)
+        )
+        if heavy and not ENDPOINTS[endpoint]:
+            failures.append(f"{endpoint} imports {', '.join(heavy)}")
+
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
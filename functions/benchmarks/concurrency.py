@@ -0,0 +1,69 @@
+"""
+Load test of AiService with concurrent games, with and without micro-batching
+of the forward passes.
+
+Usage:
+    python -m benchmarks.concurrency --threads 16 --requests 128
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.positions import random_positions
+from repository.dataclasses.game import Game
+from services.ai.batching import get_scheduler
+from services.ai.registry import registry
+from services.ai_service import AiService
+
+
+def request_move(sfen: str, batched: bool) -> float:
+    """
+    Have the AI answer a single position, and get the request latency.
+    """
+    start = time.perf_counter()
+    game = Game(moves=[], board=[], pieces_in_hand=[])
+    game.sfen = sfen
+    service = AiService(batched=batched)
+    service.setup_game(game)
+    service.make_move()
+    return time.perf_counter() - start
+
+
+def run(sfens: list[str], threads: int, batched: bool) -> (float, np.array):
+    """
+    Send all positions through a thread pool, and get the wall time and latencies.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(lambda sfen: request_move(sfen, batched), sfens))
+    return time.perf_counter() - start, np.array(latencies)
+
+
+def main():
+    """Run the load test"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=128)
+    args = parser.parse_args()
+
+    sfens = [board.sfen() for board in random_positions(args.requests, plies=30)]
+    # Load the model and start the scheduler before timing
+    request_move(sfens[0], batched=True)
+
+    for batched in (False, True):
+        seconds, latencies = run(sfens, args.threads, batched)
+        print(
+            f"batched={batched!s:>5}: {len(sfens) / seconds:7.1f} moves/s, "
+            f"p50 {np.percentile(latencies, 50) * 1000:7.1f}ms, "
+            f"p95 {np.percentile(latencies, 95) * 1000:7.1f}ms"
+        )
+
+    scheduler = get_scheduler(id(registry.get()), None)
+    print(f"scheduler: {scheduler.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Check of the board deltas of the move endpoints, and their size against the
+whole game. Along random games the board and pieces in hand after applying the
+delta of every move must match ShogiBoard.get_board, and so must the deltas
+returned by the endpoints when applied as the client does. Reports the response
+size of a move with and without the client's version by game length.
+
+Usage:
+    python -m benchmarks.deltas --games 20
+"""
+
+import argparse
+import copy
+import json
+import random
+
+import shogi
+
+import main as endpoints
+from benchmarks.fixtures import (
+    InMemoryGameRepository,
+    call,
+    drop_heavy_game,
+    game_from_board,
+)
+from benchmarks.positions import random_game
+from repository.dataclasses.game import Game
+from services.board import NON_PROMOTION, ShogiBoard, move_origin
+from services.container import ServiceContainer
+from services.game import GameService
+
+
+def starting_game() -> Game:
+    """Get a game in the starting position"""
+    shogi_board = ShogiBoard()
+    board, pieces_in_hand = shogi_board.get_board()
+    return Game([], board, pieces_in_hand)
+
+
+def check_game(game: shogi.Board):
+    """
+    Replay the game applying the delta of every move, and the delta of all
+    moves at once to the starting position
+    """
+    applied, shogi_board = starting_game(), ShogiBoard()
+    for move in game.move_stack:
+        delta = shogi_board.push(move)
+        applied.moves.append(move.usi())
+        applied.apply_delta(delta)
+        board = shogi_board.get_board()
+        assert (applied.board, applied.pieces_in_hand) == board, move.usi()
+
+    merged = starting_game()
+    merged.apply_delta(applied.delta)
+    assert (merged.board, merged.pieces_in_hand) == shogi_board.get_board()
+    assert applied.delta["version"] == len(game.move_stack)
+    assert applied.delta["base_version"] == 0
+
+
+def check_games(count: int, plies: int, seed: int):
+    """Check the deltas along random games, half of them with many drops"""
+    rng = random.Random(seed)
+    for i in range(count):
+        game_seed = rng.randrange(1 << 30)
+        if i % 2:
+            check_game(drop_heavy_game(plies, game_seed))
+        else:
+            check_game(random_game(plies, game_seed))
+    print(f"board deltas ok along {count} random games")
+
+
+def apply_response(client: dict, response: dict) -> dict:
+    """Apply the response of a move endpoint as GameProvider does"""
+    if "board" in response:
+        return response
+    assert response["base_version"] == client["move_count"], response
+    game = Game.from_dict(client)
+    game.apply_delta(response)
+    return {
+        **client,
+        **{key: value for key, value in response.items() if key not in game.delta},
+        "board": [symbol for row in game.board for symbol in row],
+        "pieces_in_hand": game.pieces_in_hand,
+        "moves": client["moves"] + response["last_moves"],
+    }
+
+
+def check_endpoints():
+    """
+    Play moves through the endpoints with the client's version, and check the
+    board of the client against the stored game. A stale version gets the
+    whole game.
+    """
+    repository = InMemoryGameRepository()
+    endpoints.container = ServiceContainer(endpoints.app, repository)
+    uid = call(endpoints.create_game, {})
+    client = Game.from_dict(repository.documents[uid]).to_dict()
+
+    for _ in range(20):
+        game = Game.from_dict(repository.documents[uid])
+        shogi_board = ShogiBoard()
+        shogi_board.set_snapshot(game.sfen)
+        square, targets = next(iter(shogi_board.get_legal_move_map().items()))
+        to_square, flags = next(iter(targets.items()))
+        data = {
+            "uid": uid,
+            "from_square": square,
+            "to_square": to_square,
+            "promotion": not flags & NON_PROMOTION,
+            "version": client["move_count"],
+        }
+        client = apply_response(client, call(endpoints.play_turn, data))
+        stored = repository.documents[uid]
+        assert client["board"] == stored["board"], client["move_count"]
+        assert client["pieces_in_hand"] == stored["pieces_in_hand"]
+        assert client["move_count"] == stored["move_count"]
+
+    stale = call(endpoints.ai_move, {"uid": uid, "version": 0})
+    assert stale["board"] == repository.documents[uid]["board"]
+    print("endpoint deltas ok, stale versions get the whole game")
+
+
+def response_sizes(plies: int) -> (int, int, int):
+    """
+    Get the JSON size of the make_move response of a move after the plies,
+    without and with the client's version, and of the board delta in it
+    """
+    board = random_game(plies, seed=plies)
+    move = next(iter(board.legal_moves))
+    data = {
+        "from_square": move_origin(move),
+        "to_square": shogi.SQUARE_NAMES[move.to_square],
+        "promotion": move.promotion,
+    }
+    repository = InMemoryGameRepository()
+    stored = game_from_board(board)
+
+    sizes = []
+    for version in (None, len(board.move_stack)):
+        repository.create(copy.deepcopy(stored))
+        service = GameService(None, repository)
+        response = service.make_move(stored.uid, data, version=version)
+        sizes.append(len(json.dumps(response)))
+    delta_keys = ("version", "base_version", "squares", "hands")
+    board = len(json.dumps({key: response[key] for key in delta_keys}))
+    return sizes[0], sizes[1], board
+
+
+def main():
+    """Check the deltas, and report the response sizes"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--plies", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_games(args.games, args.plies, args.seed)
+    check_endpoints()
+    for plies in (10, 50, 100, 150):
+        full, delta, board = response_sizes(plies)
+        print(
+            f"{plies:>4} plies: whole game {full:>6}B, "
+            f"delta {delta:>6}B of which board {board:>3}B"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Write size and latency of storing a move by game length, rewriting the whole
+game document against the field updates of GameRepository.update, with and
+without the board delta of SHOGI_DELTA_WRITES. Latencies are
+measured against the Firestore emulator when FIRESTORE_EMULATOR_HOST is set, for
+example after firebase emulators:start --only firestore.
+
+Usage:
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.firestore_writes
+"""
+
+import argparse
+import os
+import time
+
+import firebase_admin
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+
+from benchmarks.fixtures import game_from_board, replay
+from benchmarks.positions import random_game
+from repository.dataclasses.game import Game
+from repository.game_repository import GameRepository
+
+# Ways to store a move, rewriting the document or updating its fields
+MODES = ("set", "update", "delta")
+
+
+class EmulatorCredential(credentials.Base):
+    """Credential for the emulator, which accepts any request"""
+
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+def fixture_game(plies: int) -> Game:
+    """
+    Get a game of random moves with its position fields, loaded from its stored
+    document, where the last move is not stored yet and is the delta of the game.
+    """
+    board = random_game(plies, seed=plies)
+    last_move = board.pop()
+    game = Game.from_dict(game_from_board(board).to_dict())
+    shogi_board = replay(board)
+    delta = shogi_board.push(last_move)
+    game.moves.append(
+        {
+            "from_square": last_move.usi()[:2],
+            "to_square": last_move.usi()[2:4],
+            "promotion": last_move.promotion,
+        }
+    )
+    game.apply_delta(delta)
+    game.sfen, game.move_number, game.turn = shogi_board.get_snapshot()
+    game.repetitions = shogi_board.get_repetitions()
+    return game
+
+
+def write_bytes(repository: GameRepository, game: Game, mode: str) -> int:
+    """
+    Get the size of the write request that stores the last move of the game.
+    """
+    batch = repository.db.batch()
+    game_ref = repository.db.collection(repository.collection).document(game.uid)
+    if mode == "set":
+        batch.set(game_ref, game.to_dict())
+    else:
+        batch.update(game_ref, GameRepository.update_fields(game, mode == "delta"))
+    # pylint: disable-next=protected-access
+    return sum(write._pb.ByteSize() for write in batch._write_pbs)
+
+
+def write_ms(repository: GameRepository, game: Game, mode: str, repeat: int) -> float:
+    """
+    Time storing one more move of the game in the emulator.
+    """
+    game_ref = repository.db.collection(repository.collection).document(game.uid)
+    repository.create(game)
+    repository.delta_writes = mode == "delta"
+    start = time.perf_counter()
+    for _ in range(repeat):
+        game.moves.append(dict(game.moves[-2]))
+        if mode == "set":
+            game_ref.set(game.to_dict())
+        else:
+            repository.update(game)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    """Report the write size and latency of every way to store a move"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--plies", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    emulator = "FIRESTORE_EMULATOR_HOST" in os.environ
+    app = firebase_admin.initialize_app(
+        EmulatorCredential(), {"projectId": "demo-shogi"}, name="benchmark"
+    )
+    repository = GameRepository(app)
+
+    for plies in args.plies:
+        game = fixture_game(plies)
+        sizes = [f"{mode} {write_bytes(repository, game, mode):>6}B" for mode in MODES]
+        line = f"{len(game.moves):>4} plies: " + ", ".join(sizes)
+        if emulator:
+            for mode in MODES:
+                milliseconds = write_ms(
+                    repository, fixture_game(plies), mode, args.repeat
+                )
+                line += f", {mode} {milliseconds:6.2f}ms"
+        print(line)
+
+    if not emulator:
+        print("Set FIRESTORE_EMULATOR_HOST to also measure write latencies")
+
+
+if __name__ == "__main__":
+    main()
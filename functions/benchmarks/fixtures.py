@@ -0,0 +1,148 @@
+"""
+Reproducible fixture games for the benchmark suite, and an in-memory stand-in
+for GameRepository so the game service can be benchmarked without Firestore.
+The tests share them.
+"""
+
+import copy
+import random
+
+import flask
+import shogi
+from google.cloud.firestore import DELETE_FIELD, ArrayUnion
+
+from benchmarks.positions import random_game
+from repository.dataclasses.game import Game
+from repository.game_repository import (
+    ConcurrentUpdateError,
+    GameRepository,
+    stored_after,
+)
+from services.board import ShogiBoard
+
+
+def drop_heavy_game(plies: int, seed: int) -> shogi.Board:
+    """
+    Play random legal moves that prefer captures, and drop pieces about a third
+    of the time when nothing can be captured, so hands stay large.
+    """
+    rng = random.Random(seed)
+    board = shogi.Board()
+    for _ in range(plies):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        captures = [move for move in legal_moves if board.piece_at(move.to_square)]
+        drops = [move for move in legal_moves if move.drop_piece_type]
+        if not captures and rng.random() < 0.3:
+            captures = drops
+        board.push(rng.choice(captures or legal_moves))
+    return board
+
+
+def replay(board: shogi.Board) -> ShogiBoard:
+    """Get a ShogiBoard that played the moves of the board, to track repetitions"""
+    shogi_board = ShogiBoard()
+    for move in board.move_stack:
+        shogi_board.push(move)
+    return shogi_board
+
+
+def game_from_board(board: shogi.Board) -> Game:
+    """Get the game that played the moves of the board, with its position fields"""
+    moves = [
+        {
+            "from_square": move.usi()[:2],
+            "to_square": move.usi()[2:4],
+            "promotion": move.promotion,
+        }
+        for move in board.move_stack
+    ]
+    game = Game(moves, [], [])
+    shogi_board = replay(board)
+    game.board, game.pieces_in_hand = shogi_board.get_board()
+    game.sfen, game.move_number, game.turn = shogi_board.get_snapshot()
+    game.repetitions = shogi_board.get_repetitions()
+    return game
+
+
+# Fixture games by name, built on first use by fixture_games
+FIXTURES = {
+    "short": lambda: random_game(20, seed=20),
+    "100-ply": lambda: random_game(100, seed=100),
+    "drop-heavy": lambda: drop_heavy_game(120, seed=1),
+}
+
+
+def fixture_games() -> dict[str, Game]:
+    """Get a fresh copy of every fixture game"""
+    return {name: game_from_board(build()) for name, build in FIXTURES.items()}
+
+
+def call(endpoint, data: dict) -> dict:
+    """Call a callable endpoint with a request as the client sends it"""
+    app = flask.Flask(__name__)
+    with app.test_request_context("/", method="POST", json={"data": data}):
+        response = endpoint(flask.request)
+    body = response.get_json()
+    assert response.status_code == 200, body
+    return body["result"]
+
+
+class InMemoryGameRepository:
+    """
+    Stand-in for GameRepository that keeps the stored documents in a dict. Games
+    go through the same to_dict, from_dict and field updates as with Firestore,
+    and updates are checked against the stored move count.
+    """
+
+    def __init__(self, record_format: int | None = None, delta_writes: bool = False):
+        self.documents: dict[str, dict] = {}
+        self.record_format = record_format
+        self.delta_writes = delta_writes
+
+    def get(self, uid: str) -> Game | None:
+        """Get the game from a copy of the stored document, as Firestore reads it"""
+        game_dict = self.documents.get(uid)
+        return Game.from_dict(copy.deepcopy(game_dict)) if game_dict else None
+
+    def create(self, game: Game) -> None:
+        """Store a new game"""
+        if self.record_format is not None:
+            game.record_format = self.record_format
+        self._number_moves(game, 0)
+        fields = game.to_dict()
+        self.documents[game.uid] = copy.deepcopy(fields)
+        game.stored_move_count = len(game.moves)
+        game.stored_fields = stored_after(fields, {})
+
+    def update(self, game: Game) -> None:
+        """
+        Apply the field updates of GameRepository.update to the stored document,
+        if nobody else stored moves since the game was loaded
+        """
+        stored = self.documents.get(game.uid)
+        if stored is None or stored["move_count"] != game.stored_move_count:
+            raise ConcurrentUpdateError(f"Game {game.uid} was changed")
+        fields = GameRepository.update_fields(game, self.delta_writes)
+        for name, value in copy.deepcopy(fields).items():
+            if value is DELETE_FIELD:
+                stored.pop(name, None)
+            elif isinstance(value, ArrayUnion):
+                stored[name] = stored.get(name, []) + value.values
+            else:
+                stored[name] = value
+        game.stored_move_count = len(game.moves)
+        game.stored_fields = stored_after(game.stored_fields, fields)
+
+    def set_ai_status(self, uid: str, ai_status: str | None) -> None:
+        """Set only the AI status of the game"""
+        self.documents[uid]["ai_status"] = ai_status
+
+    @staticmethod
+    def _number_moves(game: Game, stored_move_count: int):
+        """Number the new moves with their ply, as GameRepository does"""
+        for ply, move in enumerate(
+            game.moves[stored_move_count:], stored_move_count + 1
+        ):
+            move["ply"] = ply
@@ -0,0 +1,61 @@
+"""
+Stored size and parse time of the verbose and compact game record formats by
+game length, with a check that both formats round trip the game.
+
+Usage:
+    python -m benchmarks.game_records --plies 50 200 400
+"""
+
+import argparse
+import timeit
+
+from google.cloud.firestore_v1 import _helpers
+from google.cloud.firestore_v1.types import document
+
+from benchmarks.firestore_writes import fixture_game
+from repository.dataclasses.game import COMPACT_FORMAT, VERBOSE_FORMAT, Game
+
+
+def document_bytes(game_dict: dict) -> int:
+    """Get the encoded size of the document fields"""
+    fields = _helpers.encode_dict(game_dict)
+    return document.MapValue(fields=fields)._pb.ByteSize()
+
+
+def check_round_trip(game: Game, record_format: int):
+    """Storing and loading the game must give the same game"""
+    loaded = Game.from_dict(game.to_dict(record_format))
+    assert loaded.to_dict(VERBOSE_FORMAT) == game.to_dict(VERBOSE_FORMAT)
+
+
+def main():
+    """Compare both formats on random games"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--plies", type=int, nargs="+", default=[50, 200, 400])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    for plies in args.plies:
+        game = fixture_game(plies)
+        for i, move in enumerate(game.moves, 1):
+            move["ply"] = i
+        line = f"{len(game.moves):>4} plies:"
+        for name, record_format in (
+            ("verbose", VERBOSE_FORMAT),
+            ("compact", COMPACT_FORMAT),
+        ):
+            check_round_trip(game, record_format)
+            game_dict = game.to_dict(record_format)
+            seconds = timeit.timeit(
+                lambda game_dict=game_dict: Game.from_dict(game_dict),
+                number=args.number,
+            )
+            line += (
+                f" {name} {document_bytes(game_dict):>6}B, "
+                f"parse {seconds / args.number * 1e6:7.1f}us"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
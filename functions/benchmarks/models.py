@@ -0,0 +1,107 @@
+"""
+Compare model architectures on parameter count, load time, forward latency and
+move agreement with the reference DQN.
+
+Usage:
+    python -m benchmarks.models --teacher model/shogi-agent.pth \\
+        --student model/shogi-agent-compact.pth --architecture compact
+"""
+
+import argparse
+import io
+import os
+import time
+
+import torch
+
+from benchmarks.positions import random_positions
+from services.ai.deep_q_network import ARCHITECTURES, build_network
+from services.ai.distill import legal_mask
+from services.ai.observation import ObservationEncoder
+
+
+def load_model(architecture: str, path: str | None) -> (torch.nn.Module, bytes):
+    """
+    Load a model from disk, or create an untrained one, and get its serialized weights.
+    """
+    if path and os.path.isfile(path):
+        state_dict = torch.load(path, map_location="cpu")
+    else:
+        state_dict = build_network(architecture).state_dict()
+    model = build_network(architecture, state_dict)
+    model.eval()
+    buffer = io.BytesIO()
+    torch.save(state_dict, buffer)
+    return model, buffer.getvalue()
+
+
+def load_seconds(architecture: str, weights: bytes) -> float:
+    """
+    Time creating the model and loading its weights.
+    """
+    start = time.perf_counter()
+    build_network(architecture, torch.load(io.BytesIO(weights), map_location="cpu"))
+    return time.perf_counter() - start
+
+
+def latency_ms(model: torch.nn.Module, batch_size: int, repeat: int = 20) -> float:
+    """
+    Time a forward pass of the specified batch size.
+    """
+    observations = torch.zeros(batch_size, 42, 9, 9)
+    with torch.inference_mode():
+        model(observations)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model(observations)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def move_agreement(
+    teacher: torch.nn.Module, student: torch.nn.Module, positions: int
+) -> float:
+    """
+    Get the fraction of positions where both models pick the same legal move.
+    """
+    boards = random_positions(positions, plies=40)
+    observations = torch.from_numpy(ObservationEncoder().encode_batch(boards))
+    masks = torch.stack([torch.from_numpy(legal_mask(board)) for board in boards])
+    with torch.inference_mode():
+        teacher_moves = teacher(observations).masked_fill(masks == 0, -torch.inf)
+        student_moves = student(observations).masked_fill(masks == 0, -torch.inf)
+    agreeing = teacher_moves.argmax(dim=1) == student_moves.argmax(dim=1)
+    return agreeing.float().mean().item()
+
+
+def main():
+    """Run the comparison"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--teacher", default="model/shogi-agent.pth")
+    parser.add_argument("--student", default="model/shogi-agent-compact.pth")
+    parser.add_argument("--architecture", default="compact", choices=ARCHITECTURES)
+    parser.add_argument("--positions", type=int, default=64)
+    args = parser.parse_args()
+
+    teacher, teacher_weights = load_model("dqn", args.teacher)
+    student, student_weights = load_model(args.architecture, args.student)
+    models = [
+        ("dqn", teacher, teacher_weights),
+        (args.architecture, student, student_weights),
+    ]
+
+    for architecture, model, weights in models:
+        parameters = sum(parameter.numel() for parameter in model.parameters())
+        print(
+            f"{architecture:>10}: {parameters:>11,} params, "
+            f"{len(weights) / 2**20:8.1f} MiB, "
+            f"load {load_seconds(architecture, weights):6.3f}s, "
+            f"batch 1 {latency_ms(model, 1):7.2f}ms, "
+            f"batch 32 {latency_ms(model, 32):7.2f}ms"
+        )
+
+    agreement = move_agreement(teacher, student, args.positions)
+    print(f"move agreement with dqn: {agreement:.1%} on {args.positions} positions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark of the legal move mask and move decoding, against the original per
+move dict building implementation. The original 88 * 81 action space has one
+index for a move and its promotion, the moves it loses are reported.
+"""
+
+import timeit
+
+import numpy as np
+import shogi
+
+from benchmarks.positions import DROP_HEAVY, MIDGAME, OPENING
+from services.ai.agent import ShogiAgent
+from services.ai.move_table import LegalMoves, move_index
+
+
+def legacy_mask_and_valid_moves(moves: list[shogi.Move]) -> (np.array, dict):
+    """The original mask builder, with a dict from move index to move"""
+    mask = np.zeros((88, 81))
+    valid_moves_dict = {}
+    for move in moves:
+        from_square = ShogiAgent.get_from_square(move)
+        mask[from_square, move.to_square] = 1
+        valid_moves_dict[from_square * 81 + move.to_square] = move
+    return mask, valid_moves_dict
+
+
+def check_parity(moves: list[shogi.Move]) -> int:
+    """
+    The mask without its promotion plane must be the original mask, and every
+    legal move must decode to itself. Get the number of moves the original
+    dict could not decode.
+    """
+    expected_mask, expected_moves = legacy_mask_and_valid_moves(moves)
+    legal_moves = LegalMoves()
+    mask = legal_moves.update(moves)
+    assert np.array_equal(mask.max(axis=0), expected_mask)
+    assert mask.sum() == len(moves)
+    for move in moves:
+        assert legal_moves[move_index(move)] == move, move.usi()
+    return len(moves) - len(expected_moves)
+
+
+def time_builders(moves: list[shogi.Move], number: int = 200) -> list[float]:
+    """Time building the mask and decoding the last move, in microseconds"""
+    legal_moves = LegalMoves()
+    legacy_index = ShogiAgent.get_from_square(moves[-1]) * 81 + moves[-1].to_square
+    index = move_index(moves[-1])
+
+    def tables():
+        legal_moves.update(moves)
+        return legal_moves[index]
+
+    functions = (lambda: legacy_mask_and_valid_moves(moves)[1][legacy_index], tables)
+    return [
+        min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+        for function in functions
+    ]
+
+
+def main():
+    """Check parity and time both builders on each position"""
+    for name, sfen in (
+        ("opening", OPENING),
+        ("midgame", MIDGAME),
+        ("drop heavy", DROP_HEAVY),
+    ):
+        moves = list(shogi.Board(sfen).legal_moves)
+        lost = check_parity(moves)
+        legacy, tables = time_builders(moves)
+        print(
+            f"{name:>10} ({len(moves):>3} moves, {lost:>2} lost by legacy): "
+            f"legacy {legacy:7.1f}us, tables {tables:7.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of the observation encoder against the original per square
+implementation of ShogiEnv.get_observation, and of the packed position format.
+Their parity is tested in tests/test_observation.py.
+"""
+
+import timeit
+
+import numpy as np
+import shogi
+
+from benchmarks.positions import random_positions
+from services.ai.observation import (
+    PACKED_BYTES,
+    ObservationEncoder,
+    unpack_observations,
+)
+
+PIECE_SYMBOLS = [
+    "p",
+    "l",
+    "n",
+    "s",
+    "g",
+    "b",
+    "r",
+    "k",
+    "+p",
+    "+l",
+    "+n",
+    "+s",
+    "+b",
+    "+r",
+]
+
+
+def legacy_observation(board: shogi.Board) -> np.array:
+    """
+    The original string comparing encoder. Its hand planes are always empty,
+    as the hand lookup was done with the (index, symbol) tuple from enumerate.
+    """
+    pieces_in_board = [str(board.piece_at(i)) for i in range(81)]
+    indices = []
+    for piece in PIECE_SYMBOLS:
+        black_pieces = []
+        white_pieces = []
+        for symbol in pieces_in_board:
+            matches = symbol.lower() == piece
+            black_pieces.append(int(matches and symbol.isupper()))
+            white_pieces.append(int(matches and not symbol.isupper()))
+        indices.append(np.reshape(black_pieces, (9, 9)))
+        indices.append(np.reshape(white_pieces, (9, 9)))
+
+    for _ in range(14):
+        indices.append(np.zeros((9, 9)))
+    return np.array(indices)
+
+
+def main():
+    """Time the encoders"""
+    boards = random_positions(count=64, plies=60)
+    boards.append(shogi.Board())
+
+    encoder = ObservationEncoder()
+    packed = encoder.pack_batch(boards)
+    print(
+        f"packed {PACKED_BYTES}B/position, planes "
+        f"{encoder.observation.nbytes}B/position as float32"
+    )
+    number = 20
+    timings = {
+        "legacy": lambda: [legacy_observation(board) for board in boards],
+        "encode": lambda: [encoder.encode(board) for board in boards],
+        "encode_batch": lambda: encoder.encode_batch(boards),
+        "pack_batch": lambda: encoder.pack_batch(boards),
+        "unpack": lambda: unpack_observations(packed),
+    }
+    for name, function in timings.items():
+        seconds = min(timeit.repeat(function, number=number, repeat=3))
+        per_board = seconds / (number * len(boards)) * 1e6
+        print(f"{name:>14}: {per_board:8.1f} us/position")
+
+
+if __name__ == "__main__":
+    main()
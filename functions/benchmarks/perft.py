@@ -0,0 +1,126 @@
+"""
+Perft of the array backed Position against python-shogi. Node counts must
+match by depth, and along random games the legal moves, sfen, hash, check and
+move legality must match after every move, and unmaking every move must restore
+the starting position. Reports the nodes per second of both boards.
+
+Usage:
+    python -m benchmarks.perft --games 20
+"""
+
+import argparse
+import random
+import time
+
+import shogi
+
+from benchmarks.fixtures import drop_heavy_game
+from benchmarks.positions import DROP_HEAVY, MIDGAME, OPENING, random_game
+from services.position import Position
+
+# Perft of the starting position by depth, the known values
+STARTING_PERFT = [1, 30, 900, 25470, 719731]
+
+# Positions by name with their perft depth, python-shogi takes minutes deeper
+POSITIONS = {
+    "opening": (OPENING, 3),
+    "midgame": (MIDGAME, 2),
+    "drop-heavy": (DROP_HEAVY, 2),
+}
+
+
+def perft(board, depth: int) -> int:
+    """Count the leaf nodes of the legal move tree, the last ply by its length"""
+    if depth == 0:
+        return 1
+    moves = list(board.legal_moves)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def timed_perft(board, depth: int) -> (int, float):
+    """Get the perft and the nodes per second"""
+    start = time.perf_counter()
+    nodes = perft(board, depth)
+    return nodes, nodes / (time.perf_counter() - start)
+
+
+def check_perft(extra_depth: int):
+    """Both boards must count the same nodes, and the known ones when known"""
+    for name, (sfen, depth) in POSITIONS.items():
+        for ply in range(1, depth + extra_depth + 1):
+            nodes, position_speed = timed_perft(Position(sfen), ply)
+            expected, board_speed = timed_perft(shogi.Board(sfen), ply)
+            assert nodes == expected, (name, ply, nodes, expected)
+            if sfen == OPENING and ply < len(STARTING_PERFT):
+                assert nodes == STARTING_PERFT[ply], (ply, nodes)
+            print(
+                f"{name:<12} depth {ply}: {nodes:>9} nodes, "
+                f"{position_speed:9.0f} nodes/s Position, "
+                f"{board_speed:9.0f} nodes/s python-shogi, "
+                f"{position_speed / board_speed:5.1f}x"
+            )
+
+
+def check_game(game: shogi.Board, check_legality: int):
+    """
+    Replay the game on both boards and compare them after every move, and
+    the legality of every pseudo legal move every few moves.
+    """
+    board, position = shogi.Board(), Position()
+    for ply, move in enumerate([*game.move_stack, None]):
+        moves = list(board.legal_moves)
+        assert position.legal_moves == moves, (board.sfen(), ply)
+        assert position.sfen() == board.sfen(), (board.sfen(), ply)
+        assert position.zobrist_hash() == board.zobrist_hash(), (board.sfen(), ply)
+        assert position.is_check() == board.is_check(), (board.sfen(), ply)
+        if ply % check_legality == 0:
+            for pseudo_legal in board.pseudo_legal_moves:
+                legal = board.is_legal(pseudo_legal)
+                assert position.is_legal(pseudo_legal) == legal, pseudo_legal.usi()
+        if move is not None:
+            board.push(move)
+            position.push(move)
+    assert position.is_fourfold_repetition() == board.is_fourfold_repetition()
+    assert position.is_game_over() == board.is_game_over()
+
+    while position.move_stack:
+        position.pop()
+    assert position.sfen() == shogi.Board().sfen()
+    assert position.zobrist_hash() == shogi.Board().zobrist_hash()
+
+
+def check_games(count: int, plies: int, seed: int):
+    """Compare both boards along random games, half of them with many drops"""
+    rng = random.Random(seed)
+    for i in range(count):
+        game_seed = rng.randrange(1 << 30)
+        if i % 2:
+            game = drop_heavy_game(plies, game_seed)
+        else:
+            game = random_game(plies, game_seed)
+        check_game(game, check_legality=10)
+    print(f"legal moves, sfen, hash and legality ok along {count} random games")
+
+
+def main():
+    """Check Position against python-shogi and time both"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--extra-depth", type=int, default=0)
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--plies", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_perft(args.extra_depth)
+    check_games(args.games, args.plies, args.seed)
+
+
+if __name__ == "__main__":
+    main()
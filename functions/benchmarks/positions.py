@@ -0,0 +1,35 @@
+"""Reproducible positions to benchmark against"""
+
+import random
+
+import shogi
+
+# Fixed positions for move generation benchmarks
+OPENING = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+MIDGAME = (
+    "l2k1s1nl/3rg2b1/1p2s1p1p/p1pppp1p1/1n7/3P2PP1/PSP1P3P/1B2GGGR1/LN2K1SNL b 2p 41"
+)
+DROP_HEAVY = "b6n1/5k2l/2n1s1p1p/3pps1p1/9/L5P1P/2N6/2S2S3/2K4NL b 2R2GL5Pb2g6p 101"
+
+
+def random_game(plies: int, seed: int) -> shogi.Board:
+    """
+    Play random legal moves from the start position. Captures are preferred,
+    so longer games end up with pieces in hand.
+    """
+    rng = random.Random(seed)
+    board = shogi.Board()
+    for _ in range(plies):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        captures = [move for move in legal_moves if board.piece_at(move.to_square)]
+        board.push(rng.choice(captures or legal_moves))
+    return board
+
+
+def random_positions(count: int, plies: int, seed: int = 0) -> list[shogi.Board]:
+    """
+    Get a list of random positions, each reached after the specified number of plies.
+    """
+    return [random_game(plies, seed + i) for i in range(count)]
@@ -0,0 +1,160 @@
+"""
+Memory footprint and sampling throughput of the replay buffer, with a check
+that sampled positions unpack to the positions that were added.
+
+Usage:
+    python -m benchmarks.replay_buffer --capacity 100000 --batch-sizes 64 256
+"""
+
+import argparse
+import glob
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import shogi
+
+from services.ai.move_table import ACTIONS, move_indices
+from services.ai.observation import OBSERVATION_SHAPE, ObservationEncoder
+from services.ai.replay_buffer import ReplayBatch, ReplayBuffer, ReplayConfig
+
+
+def random_games(count: int, plies: int, seed: int = 0) -> list[dict]:
+    """
+    Play random games, recording their positions as self-play does, and their
+    observation planes to check the buffer against.
+    """
+    rng = np.random.default_rng(seed)
+    encoder = ObservationEncoder()
+    games = []
+    for _ in range(count):
+        board = shogi.Board()
+        observations, planes, masks, actions = [], [], [], []
+        for _ in range(plies):
+            legal_moves = list(board.legal_moves)
+            if not legal_moves:
+                break
+            move = legal_moves[rng.integers(len(legal_moves))]
+            observations.append(encoder.pack(board))
+            planes.append(encoder.encode(board).copy())
+            masks.append(move_indices(legal_moves))
+            actions.append(move_indices([move])[0])
+            board.push(move)
+        games.append(
+            {
+                "observations": np.stack(observations),
+                "planes": planes,
+                "masks": masks,
+                "actions": np.array(actions),
+                "outcomes": np.zeros(len(actions), dtype=np.int8),
+            }
+        )
+    return games
+
+
+def add_game(buffer: ReplayBuffer, game: dict):
+    """Add a random game to the buffer"""
+    buffer.add_game(
+        game["observations"], game["masks"], game["actions"], game["outcomes"]
+    )
+
+
+def check_samples(games: list[dict]):
+    """
+    Positions sampled from a reopened buffer, and their successors, must match
+    the added games.
+    """
+    positions = [
+        (observation, mask, i == len(game["masks"]) - 1)
+        for game in games
+        for i, (observation, mask) in enumerate(zip(game["planes"], game["masks"]))
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        buffer = ReplayBuffer(
+            directory, ReplayConfig(capacity=len(positions), shard_size=1000)
+        )
+        for game in games:
+            add_game(buffer, game)
+        buffer.flush()
+
+        batch = ReplayBuffer(directory, ReplayConfig(seed=1)).sample(
+            ReplayBatch.allocate(256)
+        )
+    for row, slot in enumerate(batch.indices):
+        observation, mask, last = positions[slot]
+        assert np.array_equal(batch.observations[row].numpy(), observation)
+        assert np.array_equal(np.flatnonzero(batch.masks[row].numpy()), np.sort(mask))
+        assert bool(batch.last[row]) == last
+        if not last:
+            next_observation = positions[slot + 1][0]
+            assert np.array_equal(
+                batch.next_observations[row].numpy(), next_observation
+            )
+
+
+def samples_per_second(
+    buffer: ReplayBuffer, batch: ReplayBatch, prioritized: bool, seconds: float
+) -> float:
+    """Sample batches for the specified time, updating priorities if prioritized"""
+    samples, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        buffer.sample(batch, prioritized)
+        if prioritized:
+            buffer.update_priorities(
+                batch.indices, np.random.random(len(batch.indices))
+            )
+        samples += len(batch.indices)
+    return samples / (time.perf_counter() - start)
+
+
+def fill(buffer: ReplayBuffer, games: list[dict]) -> float:
+    """Add the games until the buffer is full, get the time it took"""
+    start = time.perf_counter()
+    while len(buffer) < buffer.capacity:
+        for game in games:
+            add_game(buffer, game)
+    buffer.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    """Fill a buffer with random games and sample from it"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--capacity", type=int, default=100_000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    games = random_games(16, plies=150)
+    check_samples(games)
+    with tempfile.TemporaryDirectory() as directory:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        buffer = ReplayBuffer(
+            directory,
+            ReplayConfig(capacity=args.capacity, shard_size=1 << 14, seed=0),
+        )
+        fill_seconds = fill(buffer, games)
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+        disk = sum(os.path.getsize(path) for path in glob.glob(f"{directory}/*.npy"))
+        print(
+            f"{len(buffer)} positions added in {fill_seconds:.1f}s: "
+            f"{disk / buffer.capacity:.0f}B/position on disk, "
+            f"{4 * (np.prod(OBSERVATION_SHAPE) + ACTIONS)}B/position as float32 "
+            f"planes and mask, peak RSS growth {rss_growth / 1024:.0f}MB"
+        )
+
+        for batch_size in args.batch_sizes:
+            batch = ReplayBatch.allocate(batch_size)
+            uniform = samples_per_second(buffer, batch, False, args.seconds)
+            prioritized = samples_per_second(buffer, batch, True, args.seconds)
+            print(
+                f"batch {batch_size:>4}: {uniform:8.0f} samples/s uniform, "
+                f"{prioritized:8.0f} samples/s prioritized"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark of the alpha-beta search, reporting the reached depth and nodes per
+second for a range of time budgets.
+
+Usage:
+    python -m benchmarks.search --budgets 100 500 2000
+"""
+
+import argparse
+
+from benchmarks.positions import random_positions
+from services.ai.agent import ShogiAgent
+from services.ai.registry import registry
+from services.ai.search import SearchEngine
+
+
+def main():
+    """Search a set of positions with every time budget"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--budgets", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--positions", type=int, default=8)
+    parser.add_argument("--max-depth", type=int, default=4)
+    args = parser.parse_args()
+
+    agent = ShogiAgent(network=registry.get())
+    boards = random_positions(args.positions, plies=30)
+    for budget in args.budgets:
+        depths, nodes, seconds = [], 0, 0.0
+        for board in boards:
+            engine = SearchEngine(agent, budget / 1000, args.max_depth)
+            result = engine.search(board)
+            depths.append(result.depth)
+            nodes += result.nodes
+            seconds += result.seconds
+        print(
+            f"budget {budget:>6}ms: depth {min(depths)}-{max(depths)}, "
+            f"{nodes / len(boards):9.0f} nodes/move, {nodes / seconds:8.0f} nodes/s, "
+            f"{seconds / len(boards) * 1000:7.1f}ms/move"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Self-play throughput in games and positions per second, by number of worker
+processes and concurrent games per worker, with a check that the written
+shards hold legal moves and consistent outcomes.
+
+Usage:
+    python -m benchmarks.self_play --workers 1 4 --concurrent-games 1 32
+"""
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from config import MODEL_PATH
+from services.ai.self_play import SelfPlayConfig, load_shard, self_play
+
+
+def check_shards(output: str, positions: int):
+    """Every action must be one of the legal moves, and shards hold whole games"""
+    total = 0
+    for path in glob.glob(os.path.join(output, "*.npz")):
+        shard = load_shard(path)
+        masks = np.split(shard["mask_indices"], shard["mask_offsets"][1:-1])
+        for mask, action in zip(masks, shard["actions"]):
+            assert action in mask
+        assert set(np.unique(shard["outcomes"])) <= {-1, 0, 1}
+        assert shard["last"][-1], "Shards must end with the end of a game"
+        total += len(shard["actions"])
+    assert total == positions, (total, positions)
+
+
+def main():
+    """Play the same number of games with every setting"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--games", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--concurrent-games", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--max-plies", type=int, default=256)
+    args = parser.parse_args()
+
+    for workers in sorted(set(args.workers)):
+        for concurrent_games in args.concurrent_games:
+            with tempfile.TemporaryDirectory() as output:
+                config = SelfPlayConfig(
+                    model=args.model,
+                    output=output,
+                    games=args.games,
+                    concurrent_games=concurrent_games,
+                    max_plies=args.max_plies,
+                )
+                start = time.perf_counter()
+                games, positions = self_play(config, workers)
+                seconds = time.perf_counter() - start
+                check_shards(output, positions)
+                shard_bytes = sum(
+                    os.path.getsize(path) for path in glob.glob(f"{output}/*.npz")
+                )
+            print(
+                f"{workers:>2} workers x {concurrent_games:>3} games: "
+                f"{games / seconds:6.2f} games/s, {positions / seconds:7.0f} positions/s, "
+                f"{shard_bytes / positions:6.0f}B/position"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Offline benchmark suite of the hot paths of the functions backend. Runs on the
+fixture games with the in-memory repository, so it needs no network or
+emulator, and writes the results as JSON. The compare mode flags the cases that
+got slower between two result files, usually of two commits.
+
+Usage:
+    python -m benchmarks.suite run --output base.json
+    git checkout <other commit>
+    python -m benchmarks.suite run --output head.json
+    python -m benchmarks.suite compare base.json head.json --threshold 0.1
+
+Runs with SHOGI_BOARD_BACKEND set compare the board implementations.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from collections.abc import Callable
+
+import numpy as np
+import torch
+
+from benchmarks.fixtures import InMemoryGameRepository, fixture_games
+from config import BOARD_BACKEND
+from repository.dataclasses.game import Game
+from services.ai.agent import ShogiAgent
+from services.ai.deep_q_network import build_network
+from services.ai.environment import ShogiEnv
+from services.board import ShogiBoard
+from services.game import GameService
+
+Case = Callable[[], object]
+
+
+def game_service_cases(games: dict[str, Game]) -> dict[str, Case]:
+    """
+    Loading a game in a new GameService, as every request does, by replaying
+    its moves and from its snapshot.
+    """
+    repository = InMemoryGameRepository()
+    cases = {}
+    for name, game in games.items():
+        repository.create(game)
+        for mode, verify in (("replay", True), ("snapshot", False)):
+            cases[f"game_service/get_game_{mode}/{name}"] = (
+                # pylint: disable-next=protected-access
+                lambda uid=game.uid, verify=verify: GameService(
+                    None, repository
+                )._get_game(uid, verify)
+            )
+    return cases
+
+
+def board_cases(games: dict[str, Game]) -> dict[str, Case]:
+    """The board and legal move views sent to the client"""
+    cases = {}
+    for name, game in games.items():
+        shogi_board = ShogiBoard()
+        shogi_board.set_snapshot(game.sfen)
+        from_square = next(iter(shogi_board.get_legal_move_map()))
+        cases[f"board/get_board/{name}"] = shogi_board.get_board
+        cases[f"board/get_legal_move_map/{name}"] = shogi_board.get_legal_move_map
+        cases[f"board/get_legal_moves/{name}"] = (
+            lambda shogi_board=shogi_board, from_square=from_square: (
+                shogi_board.get_legal_moves(from_square)
+            )
+        )
+    return cases
+
+
+def ai_cases(games: dict[str, Game], network: torch.nn.Module) -> dict[str, Case]:
+    """Encoding a position for the network, and its legal move mask"""
+    agent = ShogiAgent(network=network)
+    cases = {}
+    for name, game in games.items():
+        env = ShogiEnv()
+        env.board.set_sfen(game.sfen)
+        cases[f"env/get_observation/{name}"] = env.get_observation
+        cases[f"agent/mask_and_valid_moves/{name}"] = (
+            lambda env=env: agent.mask_and_valid_moves(env)
+        )
+    return cases
+
+
+def network_cases(games: dict[str, Game], network: torch.nn.Module) -> dict[str, Case]:
+    """Forward passes of the DQN by batch size"""
+    env = ShogiEnv()
+    observations = []
+    for game in games.values():
+        env.board.set_sfen(game.sfen)
+        observations.append(env.get_observation().copy())
+
+    cases = {}
+    for batch_size in (1, 16):
+        rows = [observations[i % len(observations)] for i in range(batch_size)]
+        batch = torch.from_numpy(np.stack(rows))
+
+        def forward(batch=batch):
+            with torch.inference_mode():
+                return network(batch)
+
+        cases[f"dqn/forward/batch{batch_size}"] = forward
+    return cases
+
+
+def measure(case: Case, repeats: int, min_seconds: float) -> dict:
+    """Time the case, in microseconds per call"""
+    timer = timeit.Timer(case)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_seconds / 0.2))
+    times = [seconds / number * 1e6 for seconds in timer.repeat(repeats, number)]
+    return {
+        "median_us": statistics.median(times),
+        "min_us": min(times),
+        "number": number,
+        "repeats": repeats,
+    }
+
+
+def git_commit() -> str | None:
+    """Get the commit the suite runs on, marked when the tree has changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if status else commit
+
+
+def run(args: argparse.Namespace):
+    """Run the selected cases and write the results"""
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    network = build_network("dqn").eval()
+    games = fixture_games()
+    cases = {
+        **game_service_cases(games),
+        **board_cases(games),
+        **ai_cases(games, network),
+        **network_cases(games, network),
+    }
+
+    results = {}
+    for name, case in cases.items():
+        if args.filter and not any(part in name for part in args.filter):
+            continue
+        results[name] = measure(case, args.repeats, args.min_seconds)
+        print(f"{name:<48} {results[name]['median_us']:12.1f}us", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "threads": args.threads,
+        "board_backend": BOARD_BACKEND,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+def compare(args: argparse.Namespace):
+    """Compare two result files, failing when a case got slower"""
+    reports = []
+    for path in (args.base, args.head):
+        with open(path, encoding="utf-8") as file:
+            reports.append(json.load(file))
+    base, head = (report["results"] for report in reports)
+    print(f"{reports[0]['commit']} -> {reports[1]['commit']}, {args.metric}")
+
+    regressions = []
+    for name in sorted(base.keys() | head.keys()):
+        if name not in base or name not in head:
+            print(f"{name:<48} {'only in ' + ('head' if name in head else 'base'):>30}")
+            continue
+        before, after = base[name][args.metric], head[name][args.metric]
+        ratio = after / before
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + args.threshold):
+            flag = "faster"
+        print(f"{name:<48} {before:12.1f}us {after:12.1f}us {ratio:6.2f}x {flag}")
+
+    if regressions:
+        sys.exit(
+            f"{len(regressions)} cases regressed by more than {args.threshold:.0%}"
+        )
+
+
+def main():
+    """Run the suite, or compare two of its result files"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite")
+    run_parser.add_argument("--output", help="result file, stdout by default")
+    run_parser.add_argument("--filter", nargs="+", help="only run matching cases")
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--min-seconds", type=float, default=0.2)
+    run_parser.add_argument("--threads", type=int, default=1)
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument(
+        "--metric", default="median_us", choices=["median_us", "min_us"]
+    )
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
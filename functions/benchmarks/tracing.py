@@ -0,0 +1,28 @@
+"""
+Cost of a traced stage when tracing is off. The stage names and nesting of the
+endpoints are tested in tests/test_tracing.py.
+
+Usage:
+    python -m benchmarks.tracing
+"""
+
+import timeit
+
+from services.tracing import Tracer
+
+
+def main():
+    """Time a stage with tracing off"""
+    disabled = Tracer(enabled=False, opentelemetry=False)
+
+    def traced():
+        with disabled.stage("stage", ply=1):
+            pass
+
+    number = 200_000
+    seconds = min(timeit.repeat(traced, number=number, repeat=3))
+    print(f"disabled stage: {seconds / number * 1e9:.0f}ns per stage")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Runtime configuration, read from the environment"""
+
+import os
+
+
+def _flag(name: str, default: bool = False) -> bool:
+    """Read a boolean flag from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Network architecture of the model, see services.ai.deep_q_network.ARCHITECTURES
+MODEL_ARCHITECTURE = os.environ.get("SHOGI_MODEL_ARCHITECTURE", "dqn")
+
+# Location of the trained agent weights, by default the checkpoint of the
+# architecture
+MODEL_PATHS = {
+    "dqn": "model/shogi-agent.pth",
+    "compact": "model/shogi-agent-compact.pth",
+}
+MODEL_PATH = os.environ.get(
+    "SHOGI_MODEL_PATH", MODEL_PATHS.get(MODEL_ARCHITECTURE, MODEL_PATHS["dqn"])
+)
+
+# Load the model when the process starts, instead of on the first AI move
+PRELOAD_MODEL = _flag("SHOGI_PRELOAD_MODEL")
+
+# Replay every stored move when loading a game, and check the result against
+# the stored position snapshot
+VERIFY_REPLAY = _flag("SHOGI_VERIFY_REPLAY")
+
+# Fill the hand planes of the observations with the pieces in hand. The shipped
+# checkpoint was trained with empty hand planes, so they stay empty unless the
+# model was trained with them.
+HAND_PLANES = _flag("SHOGI_HAND_PLANES")
+
+# Inference backend of the model, see services.ai.inference.BACKENDS
+INFERENCE_BACKEND = os.environ.get("SHOGI_INFERENCE_BACKEND", "eager")
+
+# Coalesce concurrent AI moves into batched forward passes
+BATCH_INFERENCE = _flag("SHOGI_BATCH_INFERENCE")
+BATCH_MAX_SIZE = int(os.environ.get("SHOGI_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("SHOGI_BATCH_MAX_WAIT_MS", "5"))
+
+# Time budget of the alpha-beta search per AI move, 0 plays the network greedily
+SEARCH_TIME_MS = float(os.environ.get("SHOGI_SEARCH_TIME_MS", "0"))
+SEARCH_MAX_DEPTH = int(os.environ.get("SHOGI_SEARCH_MAX_DEPTH", "3"))
+
+# Opening book consulted before the network, and the number of recently
+# answered positions to remember, 0 disables the cache
+BOOK_PATH = os.environ.get("SHOGI_BOOK_PATH", "model/opening-book.npy")
+POSITION_CACHE_SIZE = int(os.environ.get("SHOGI_POSITION_CACHE_SIZE", "10000"))
+
+# Store new games in the compact record format, with the moves packed in 16 bit
+# codes and the board as sfen. Existing games keep their format.
+COMPACT_GAMES = _flag("SHOGI_COMPACT_GAMES")
+
+# Leave AI moves to the Firestore triggered worker instead of answering them in
+# the request, the client receives the reply through its snapshot listener
+ASYNC_AI = _flag("SHOGI_ASYNC_AI")
+
+# Time the stages of every request and log them as one structured entry, and
+# export them as OpenTelemetry spans when the opentelemetry package is installed
+TRACING = _flag("SHOGI_TRACING")
+OPENTELEMETRY = _flag("SHOGI_OPENTELEMETRY")
+
+# Board implementation of the game service and the AI environment, see
+# services.board.BOARD_BACKENDS
+BOARD_BACKEND = os.environ.get("SHOGI_BOARD_BACKEND", "python-shogi")
+
+# Store the changed squares and hand counts of the moves with every update,
+# instead of rewriting the board and the pieces in hand of verbose games
+DELTA_WRITES = _flag("SHOGI_DELTA_WRITES")
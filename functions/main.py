@@ -11,18 +11,28 @@ from firebase_functions.https_fn import (
     FunctionsErrorCode,
 )
 from firebase_functions import options
+from firebase_functions.firestore_fn import (
+    on_document_updated,
+    Change,
+    DocumentSnapshot,
+    Event,
+)
 from firebase_admin import initialize_app
-from services.game import GameService
+from config import ASYNC_AI
+from repository.dataclasses.game import AI_PENDING
+from services.container import ServiceContainer
 
 app = initialize_app()
 options.set_global_options(region=options.SupportedRegion.EUROPE_WEST1)
+# Dependencies shared by all requests handled by this process
+container = ServiceContainer(app)
 
 
 @on_call(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
 def create_game(_: CallableRequest):
     """Endpoint to create a game"""
-    game_manager = GameService(app)
-    return game_manager.create()
+    with container.game_service("create_game") as game_manager:
+        return game_manager.create()
 
 
 @on_call(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
@@ -32,6 +42,8 @@ def make_move(req: CallableRequest):
     to_square = req.data.get("to_square")
     uid = req.data.get("uid")
     promotion = req.data.get("promotion")
+    # Move count of the client's board, see GameService._position_update
+    version = req.data.get("version")
 
     if from_square is None:
         raise HttpsError(
@@ -51,13 +63,17 @@ def make_move(req: CallableRequest):
     if promotion is None:
         promotion = True
 
-    game_manager = GameService(app)
-    return game_manager.make_move(uid, from_square, to_square, promotion)
+    move = {"from_square": from_square, "to_square": to_square, "promotion": promotion}
+    with container.game_service("make_move") as game_manager:
+        return game_manager.make_move(uid, move, version)
 
 
 @on_call(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
 def read_legal_moves(req: CallableRequest):
-    """Endpoint to get the legal moves"""
+    """
+    Endpoint to get the legal moves of a piece, or the legal move map of the
+    whole position without from_square
+    """
     from_square = req.data.get("from_square")
     uid = req.data.get("uid")
 
@@ -67,14 +83,15 @@ def read_legal_moves(req: CallableRequest):
             message="Invalid game id",
         )
 
-    game_manager = GameService(app)
-    return game_manager.get_legal_moves(uid, from_square)
+    with container.game_service("read_legal_moves") as game_manager:
+        return game_manager.get_legal_moves(uid, from_square)
 
 
 @on_call(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
 def ai_move(req: CallableRequest):
     """Endpoint for when its the ais turn"""
     uid = req.data.get("uid")
+    version = req.data.get("version")
 
     if uid is None:
         raise HttpsError(
@@ -82,5 +99,59 @@ def ai_move(req: CallableRequest):
             message="Invalid game id",
         )
 
-    game_manager = GameService(app)
-    return game_manager.ai_move(uid)
+    with container.game_service("ai_move") as game_manager:
+        return game_manager.ai_move(uid, version)
+
+
+@on_call(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
+def play_turn(req: CallableRequest):
+    """Endpoint to make a move, and get the AI's reply in the same call"""
+    from_square = req.data.get("from_square")
+    to_square = req.data.get("to_square")
+    uid = req.data.get("uid")
+    promotion = req.data.get("promotion")
+    # Move count of the client's board, see GameService._position_update
+    version = req.data.get("version")
+
+    if from_square is None:
+        raise HttpsError(
+            code=FunctionsErrorCode.FAILED_PRECONDITION,
+            message="Invalid from_square",
+        )
+    if to_square is None:
+        raise HttpsError(
+            code=FunctionsErrorCode.FAILED_PRECONDITION,
+            message="Invalid to_square",
+        )
+    if uid is None:
+        raise HttpsError(
+            code=FunctionsErrorCode.FAILED_PRECONDITION,
+            message="Invalid game id",
+        )
+    if promotion is None:
+        promotion = True
+
+    move = {"from_square": from_square, "to_square": to_square, "promotion": promotion}
+    with container.game_service("play_turn") as game_manager:
+        return game_manager.play_turn(uid, move, version)
+
+
+def play_queued_ai_move(event: Event[Change[DocumentSnapshot]]):
+    """
+    Play the AI move queued by the endpoints in async mode, when the update of
+    the game is the one that queued it
+    """
+    before, after = event.data.before, event.data.after
+    if after is None or after.to_dict().get("ai_status") != AI_PENDING:
+        return
+    if before is not None and before.to_dict().get("ai_status") == AI_PENDING:
+        return
+
+    with container.game_service("ai_move_worker") as game_manager:
+        game_manager.complete_ai_move(event.params["gameId"])
+
+
+# The worker is only deployed in async mode, otherwise it would run on every
+# write of a game for nothing
+if ASYNC_AI:
+    ai_move_worker = on_document_updated(document="games/{gameId}")(play_queued_ai_move)
@@ -1,34 +1,276 @@
 """Object got the game"""
 
+import struct
 import uuid
 
+import shogi
+
+from services.move_codes import INDEX_MASK, PROMOTION_BIT
+
+# Versions of the stored game record. Version 1 stores the moves as maps and the
+# board as 81 squares, version 2 packs the moves in 16 bit codes and stores the
+# position as sfen only, from which the board, move number and side to move are
+# read when they are used.
+VERBOSE_FORMAT, COMPACT_FORMAT = 1, 2
+
+# AI status of a game, waiting for the worker to reply, or its last try failed
+AI_PENDING, AI_FAILED = "pending", "failed"
+
+# From square names of the move codes, drops come from a piece and *
+FROM_NAMES = shogi.SQUARE_NAMES + [f"{symbol}*" for symbol in "PLNSGBR"]
+FROM_INDICES = {name: index for index, name in enumerate(FROM_NAMES)}
+
+# Symbols of the pieces in hand in the order they are listed, by color and from
+# rook to pawn as in sfen
+HAND_SYMBOLS = "RBGSNLPrbgsnlp"
+
+
+def pack_moves(moves: list[dict]) -> bytes:
+    """Pack move maps in little endian 16 bit move codes, see services.move_codes"""
+    codes = []
+    for move in moves:
+        from_index = FROM_INDICES[move["from_square"]]
+        code = 81 * from_index + FROM_INDICES[move["to_square"]]
+        if move["promotion"] and from_index < 81:
+            code |= PROMOTION_BIT
+        codes.append(code)
+    return struct.pack(f"<{len(codes)}H", *codes)
+
+
+def unpack_moves(data: bytes) -> list[dict]:
+    """Unpack 16 bit move codes to move maps, numbered by their ply"""
+    moves = []
+    for ply, (code,) in enumerate(struct.iter_unpack("<H", data), 1):
+        from_index, to_square = divmod(code & INDEX_MASK, 81)
+        moves.append(
+            {
+                "from_square": FROM_NAMES[from_index],
+                "to_square": shogi.SQUARE_NAMES[to_square],
+                "promotion": bool(code & PROMOTION_BIT),
+                "ply": ply,
+            }
+        )
+    return moves
+
 
 class Game:
     """Object got the game"""
 
-    def __init__(self, moves: list[dict], board: list[list], pieces_in_hand: list[str]):
+    def __init__(
+        self,
+        moves: list[dict],
+        board: list[list] | None,
+        pieces_in_hand: list[str] | None,
+    ):
         self.uid = str(uuid.uuid4())
-        self.moves = moves
-        self.board = board
-        self.pieces_in_hand = pieces_in_hand
+        # Packed moves of a compact record, which are unpacked on first use
+        self._packed_moves = b""
+        self._moves: list[dict] | None = moves
+        # Position of a record without a board, None until it is parsed from
+        # the sfen on first use
+        self._board = board
+        self._pieces_in_hand = pieces_in_hand
+        # Snapshot of the position after the last move, so the board can be
+        # restored without replaying all moves. None for games stored before
+        # snapshots were introduced.
+        self.sfen: str | None = None
+        # Packed Zobrist hashes of the positions that can still repeat, so
+        # fourfold repetition is still detected after restoring the snapshot,
+        # see ShogiBoard.get_repetitions. None for games stored before they
+        # were introduced.
+        self.repetitions: bytes | None = None
+        self.move_number = len(moves) + 1
+        self.turn = len(moves) % 2
+        # Number of moves in the database, new moves are appended after them
+        self.stored_move_count = 0
+        # Fields of the document as it was last read or written, apart from its
+        # uid and moves, so updates only write the fields that changed
+        self.stored_fields: dict = {}
+        # Format the game is stored in, a game keeps the format it was created in
+        self.record_format = VERBOSE_FORMAT
+        # AI_PENDING while an AI move is queued for the worker, else None
+        self.ai_status: str | None = None
+        # Changes of the board since the game was loaded, see apply_delta
+        self.delta: dict | None = None
+
+    @property
+    def moves(self) -> list[dict]:
+        """
+        The moves of the game. Those of a compact record are unpacked on first
+        use, as most requests only need the position.
+        """
+        if self._moves is None:
+            self._moves = unpack_moves(self._packed_moves)
+        return self._moves
+
+    @moves.setter
+    def moves(self, moves: list[dict]):
+        self._moves = moves
+        self._packed_moves = b""
+
+    @property
+    def move_count(self) -> int:
+        """The number of moves, without unpacking those of a compact record"""
+        if self._moves is None:
+            return len(self._packed_moves) // 2
+        return len(self._moves)
+
+    @property
+    def board(self) -> list[list]:
+        """The board as 9 ranks of piece symbols or None"""
+        if self._board is None:
+            self._board, self._pieces_in_hand = self._position_from_sfen(self.sfen)
+        return self._board
+
+    @board.setter
+    def board(self, board: list[list]):
+        self._board = board
+
+    @property
+    def pieces_in_hand(self) -> list[str]:
+        """The symbols of the pieces in hand, see HAND_SYMBOLS"""
+        if self._pieces_in_hand is None:
+            self._board, self._pieces_in_hand = self._position_from_sfen(self.sfen)
+        return self._pieces_in_hand
+
+    @pieces_in_hand.setter
+    def pieces_in_hand(self, pieces_in_hand: list[str]):
+        self._pieces_in_hand = pieces_in_hand
+
+    def to_dict(self, record_format: int | None = None):
+        """
+        Get the game object as a dict, in the specified format or else in the
+        format of the game
+        """
+        if (record_format or self.record_format) == COMPACT_FORMAT:
+            # The board, move number and side to move are read from the sfen
+            return {
+                "format": COMPACT_FORMAT,
+                "uid": self.uid,
+                "moves": self._pack_moves(),
+                "move_count": self.move_count,
+                "sfen": self.sfen,
+                "repetitions": self.repetitions,
+                "ai_status": self.ai_status,
+            }
 
-    def to_dict(self):
-        """Get the game object as a dict"""
         board = [item for sublist in self.board for item in sublist]
         return {
+            "format": VERBOSE_FORMAT,
             "uid": self.uid,
             "moves": self.moves,
+            "move_count": self.move_count,
             "board": board,
             "pieces_in_hand": self.pieces_in_hand,
+            "sfen": self.sfen,
+            "repetitions": self.repetitions,
+            "move_number": self.move_number,
+            "turn": self.turn,
+            "ai_status": self.ai_status,
         }
 
+    def _pack_moves(self) -> bytes:
+        """
+        Pack the moves, reusing the packed moves the game was loaded with as
+        moves are only appended
+        """
+        if self._moves is None:
+            return self._packed_moves
+        packed_count = len(self._packed_moves) // 2
+        return self._packed_moves + pack_moves(self._moves[packed_count:])
+
+    def apply_delta(self, delta: dict):
+        """
+        Apply the changed squares and hand counts of a move, see
+        ShogiBoard.push, to the board and the pieces in hand. The changes are
+        added to the delta of the game, which goes from the version it was
+        loaded at, its stored move count, to the version of its current moves.
+        """
+        for square, symbol in delta["squares"].items():
+            index = FROM_INDICES[square]
+            self.board[index // 9][index % 9] = symbol
+
+        counts = {symbol: self.pieces_in_hand.count(symbol) for symbol in HAND_SYMBOLS}
+        for symbol, change in delta["hands"].items():
+            counts[symbol] += change
+        self.pieces_in_hand = [
+            symbol for symbol in HAND_SYMBOLS for _ in range(counts[symbol])
+        ]
+
+        if self.delta is None:
+            self.delta = {
+                "base_version": self.stored_move_count,
+                "squares": {},
+                "hands": {},
+            }
+        self.delta["version"] = self.move_count
+        self.delta["squares"].update(delta["squares"])
+        hands = self.delta["hands"]
+        for symbol, change in delta["hands"].items():
+            hands[symbol] = hands.get(symbol, 0) + change
+            if hands[symbol] == 0:
+                del hands[symbol]
+
     @classmethod
     def from_dict(cls, game_dict: dict):
-        """Turn a dict into the Game object"""
-
-        board = []
-        for i in range(0, 81, 9):
-            board.append(game_dict["board"][i : i + 9])
-        game = cls(game_dict["moves"], board, game_dict["pieces_in_hand"])
+        """Turn a dict in either format into the Game object"""
+        record_format = game_dict.get("format", VERBOSE_FORMAT)
+        if record_format == COMPACT_FORMAT:
+            game = cls([], None, None)
+            game._moves = None
+            game._packed_moves = game_dict["moves"]
+        elif "board" not in game_dict:
+            # Stored with delta writes, which keep the position as sfen only
+            game = cls(game_dict["moves"], None, None)
+        else:
+            board = []
+            for i in range(0, 81, 9):
+                board.append(game_dict["board"][i : i + 9])
+            game = cls(game_dict["moves"], board, game_dict["pieces_in_hand"])
+        game.record_format = record_format
         game.uid = game_dict["uid"]
+        game.sfen = game_dict.get("sfen")
+        game.repetitions = game_dict.get("repetitions")
+        if record_format == COMPACT_FORMAT:
+            _, side, _, move_number = game.sfen.split(" ")
+            game.turn = shogi.BLACK if side == "b" else shogi.WHITE
+            game.move_number = int(move_number)
+        else:
+            game.move_number = game_dict.get("move_number", game.move_number)
+            game.turn = game_dict.get("turn", game.turn)
+        game.ai_status = game_dict.get("ai_status")
+        game.stored_move_count = game.move_count
+        game.stored_fields = {
+            name: value
+            for name, value in game_dict.items()
+            if name not in ("uid", "moves")
+        }
         return game
+
+    @staticmethod
+    def _position_from_sfen(sfen: str) -> (list[list], list[str]):
+        """
+        Get the board and the pieces in hand of a sfen, in the format of
+        ShogiBoard.get_board
+        """
+        placement, _, hand = sfen.split(" ")[:3]
+        squares, prefix = [], ""
+        for char in placement.replace("/", ""):
+            if char.isdigit():
+                squares.extend([None] * int(char))
+            elif char == "+":
+                prefix = char
+            else:
+                squares.append(prefix + char)
+                prefix = ""
+
+        # The hands of sfen are listed by color and from rook to pawn, as the
+        # pieces in hand of ShogiBoard.get_board
+        pieces_in_hand, count = [], ""
+        for char in hand.strip("-"):
+            if char.isdigit():
+                count += char
+            else:
+                pieces_in_hand.extend([char] * int(count or 1))
+                count = ""
+        return [squares[i : i + 9] for i in range(0, 81, 9)], pieces_in_hand
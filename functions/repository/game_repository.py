@@ -1,16 +1,28 @@
 """Repository class to manage games in the database"""
 
 from firebase_admin.firestore import client
+from google.cloud.firestore import DELETE_FIELD, ArrayUnion, transactional
 
-from repository.dataclasses.game import Game
+from config import COMPACT_GAMES, DELTA_WRITES
+from repository.dataclasses.game import COMPACT_FORMAT, VERBOSE_FORMAT, Game
+
+
+class ConcurrentUpdateError(Exception):
+    """Raised when the moves of a game were changed since it was loaded"""
 
 
 class GameRepository:
     """Repository class to manage games in the database"""
 
-    def __init__(self, app: any):
+    def __init__(
+        self, app: any, compact: bool = COMPACT_GAMES, delta_writes: bool = DELTA_WRITES
+    ):
         self.db = client(app)
         self.collection = "games"
+        # Format of new games, see Game.to_dict
+        self.record_format = COMPACT_FORMAT if compact else VERBOSE_FORMAT
+        # Store the board changes of updates, see update_fields
+        self.delta_writes = delta_writes
 
     def get(self, uid: str) -> Game | None:
         """Get the game from the database as a Game object"""
@@ -23,8 +35,106 @@ class GameRepository:
 
     def create(self, game: Game) -> None:
         """Add a new game to the database"""
-        self.db.collection(self.collection).document(game.uid).set(game.to_dict())
+        game.record_format = self.record_format
+        game.stored_move_count = 0
+        self._number_moves(game)
+        fields = game.to_dict()
+        self.db.collection(self.collection).document(game.uid).set(fields)
+        game.stored_move_count = game.move_count
+        game.stored_fields = stored_after(fields, {})
 
     def update(self, game: Game) -> None:
-        """Update the state of the game"""
-        self.db.collection(self.collection).document(game.uid).set(game.to_dict())
+        """
+        Update the state of the game. Only the fields of the position are
+        rewritten and the new moves are appended, in a transaction that raises
+        ConcurrentUpdateError when another request has changed the moves since
+        the game was loaded.
+        """
+        game_ref = self.db.collection(self.collection).document(game.uid)
+        fields = self.update_fields(game, self.delta_writes)
+        _update_game(self.db.transaction(), game_ref, fields, game.stored_move_count)
+        game.stored_move_count = game.move_count
+        game.stored_fields = stored_after(game.stored_fields, fields)
+
+    def set_ai_status(self, uid: str, ai_status: str | None) -> None:
+        """Set only the AI status of the game"""
+        game_ref = self.db.collection(self.collection).document(uid)
+        game_ref.update({"ai_status": ai_status})
+
+    @classmethod
+    def update_fields(cls, game: Game, delta: bool = False) -> dict:
+        """
+        Get the field updates that store the game since it was loaded: the new
+        moves, the fields of the position that changed, and the deletion of
+        fields the game no longer has. Compact games rewrite their packed moves,
+        which take two bytes per move, as bytes can not be appended to. With
+        delta, the changes of the board since the game was loaded are stored
+        instead of its board and pieces in hand, which are read from the sfen.
+        """
+        new_moves = cls._number_moves(game)
+        fields = game.to_dict()
+        del fields["uid"]
+        moves = fields.pop("moves")
+        if delta and game.delta is not None:
+            fields["delta"] = game.delta
+            if game.record_format != COMPACT_FORMAT:
+                del fields["board"], fields["pieces_in_hand"]
+
+        stored = game.stored_fields
+        updates = {
+            name: value
+            for name, value in fields.items()
+            if name not in stored or stored[name] != value
+        }
+        # Fields of older versions of the game, or a board replaced by the delta
+        updates.update({name: DELETE_FIELD for name in stored if name not in fields})
+        if new_moves:
+            if game.record_format == COMPACT_FORMAT:
+                updates["moves"] = moves
+            else:
+                updates["moves"] = ArrayUnion(new_moves)
+        return updates
+
+    @staticmethod
+    def _number_moves(game: Game) -> list[dict]:
+        """
+        Number the moves that are not stored yet with their ply, which also
+        keeps ArrayUnion from dropping a move equal to an earlier one.
+        """
+        new_moves = game.moves[game.stored_move_count :]
+        for ply, move in enumerate(new_moves, game.stored_move_count + 1):
+            move["ply"] = ply
+        return new_moves
+
+
+def stored_after(stored_fields: dict, updates: dict) -> dict:
+    """
+    Get the stored fields of a game, see Game.stored_fields, after the field
+    updates are written
+    """
+    return {
+        name: value
+        for name, value in {**stored_fields, **updates}.items()
+        if name not in ("uid", "moves") and value is not DELETE_FIELD
+    }
+
+
+@transactional
+def _update_game(transaction, game_ref, fields: dict, expected_move_count: int):
+    """Apply the field updates, if the game still has the expected move count"""
+    snapshot = game_ref.get(field_paths=["move_count"], transaction=transaction)
+    if not snapshot.exists:
+        raise ConcurrentUpdateError(f"Game {game_ref.id} no longer exists")
+
+    move_count = snapshot.to_dict().get("move_count")
+    if move_count is None:
+        # Stored before move counts were introduced, count the moves instead
+        snapshot = game_ref.get(field_paths=["moves"], transaction=transaction)
+        move_count = len(snapshot.to_dict().get("moves", []))
+
+    if move_count != expected_move_count:
+        raise ConcurrentUpdateError(
+            f"Game {game_ref.id} has {move_count} moves, "
+            f"expected {expected_move_count}"
+        )
+    transaction.update(game_ref, fields)
@@ -8,9 +8,15 @@ import os
 import numpy as np
 from shogi import Move
 import torch
+from torch import nn
 
-from services.ai.deep_q_network import DQN
+from config import MODEL_ARCHITECTURE
+from services.ai.batching import BatchScheduler
+from services.ai.deep_q_network import build_network
 from services.ai.environment import ShogiEnv
+from services.ai.move_table import LegalMoves, move_index
+from services.ai.observation import is_packed, unpack_observations
+from services.tracing import tracer
 
 
 class ShogiAgent:
@@ -19,11 +25,26 @@ class ShogiAgent:
     action selection, memory management, and training using experience replay.
     """
 
-    def __init__(self, path: str | None = None):
+    def __init__(
+        self,
+        path: str | None = None,
+        network: nn.Module | None = None,
+        scheduler: BatchScheduler | None = None,
+        architecture: str = MODEL_ARCHITECTURE,
+    ):
         """
         Initializes the ShogiAgent with parameters, networks, loss function, and optimizer.
+        When a network is given it is used as is, so it can be shared between agents.
+        Otherwise a network of the architecture is created, see build_network.
         """
-        self.target_network = DQN()
+        self.scheduler = scheduler
+        self.architecture = architecture
+        self.valid_moves = LegalMoves()
+        if network is not None:
+            self.target_network = network
+            return
+
+        self.target_network = build_network(architecture)
         if path:
             print(path)
             self.get_model(path)
@@ -33,8 +54,7 @@ class ShogiAgent:
         """
         Converts a move to an index.
         """
-        index = 81 * ShogiAgent.get_from_square(move) + move.to_square
-        return index
+        return move_index(move)
 
     @staticmethod
     def get_from_square(move):
@@ -48,41 +68,64 @@ class ShogiAgent:
             # now from_square max = 88
         return move.from_square
 
-    def mask_and_valid_moves(self, env: ShogiEnv) -> (np.array, dict):
+    def mask_and_valid_moves(self, env: ShogiEnv) -> (np.array, LegalMoves):
         """
-        Get the mask and valid moves for the current player.
+        Get the mask and valid moves for the current player. The valid moves map
+        a legal move index to its move, and are reused by the next call.
         """
-        mask = np.zeros((88, 81))
-        valid_moves_dict = {}
-
-        legal_moves = env.get_legal_moves()
-
-        for move in legal_moves:
-            mask[self.get_from_square(move), move.to_square] = 1
-            valid_moves_dict[self.get_move_index(move)] = move
-
-        return mask, valid_moves_dict
+        mask = self.valid_moves.update(env.get_legal_moves())
+        return mask, self.valid_moves
 
     def select_action(self, env: ShogiEnv) -> (Move, int):
         """
-        Selects an action using an epsilon-greedy policy.
+        Selects an action using an epsilon-greedy policy. When the agent has a
+        scheduler, the evaluation is batched with other pending requests.
         """
-        valid_moves, valid_move_dict = self.mask_and_valid_moves(env)
-
-        current_state = env.get_observation()
-        valid_moves_tensor = torch.from_numpy(valid_moves).float().unsqueeze(0)
-        current_state_tensor = torch.from_numpy(current_state).float().unsqueeze(0)
-        valid_moves_tensor = valid_moves_tensor.view(current_state_tensor.size(0), -1)
-        policy_values = self.target_network(current_state_tensor, valid_moves_tensor)
-        chosen_move_index = int(policy_values.max(1)[1].view(1, 1))
+        with tracer.stage("agent.mask"):
+            valid_moves, valid_move_dict = self.mask_and_valid_moves(env)
+
+        with tracer.stage("agent.observation"):
+            current_state = env.get_observation()
+        with tracer.stage("agent.forward", batched=self.scheduler is not None):
+            if self.scheduler is not None:
+                chosen_move_index = self.scheduler.choose(current_state, valid_moves)
+            else:
+                chosen_move_index = int(
+                    self.evaluate_batch(current_state[None], valid_moves[None])[0]
+                )
         chosen_move = valid_move_dict[chosen_move_index]
 
         return chosen_move, chosen_move_index
 
+    def evaluate_batch(self, observations: np.array, masks: np.array) -> np.array:
+        """
+        Get the index of the best legal move for every position of the batch.
+        """
+        policy_values = torch.from_numpy(self.policy_values(observations))
+        valid_moves_tensor = torch.from_numpy(masks).float()
+        valid_moves_tensor = valid_moves_tensor.view(policy_values.size(0), -1)
+        # Rule out illegal moves, also when all legal moves have negative values
+        policy_values = policy_values.masked_fill(valid_moves_tensor == 0, -torch.inf)
+        return policy_values.max(1)[1].numpy()
+
+    def policy_values(self, observations: np.array) -> np.array:
+        """
+        Get the unmasked value of every move index for a batch of observations,
+        given as planes or as packed positions.
+        """
+        if is_packed(observations):
+            current_state_tensor = unpack_observations(observations)
+        else:
+            current_state_tensor = torch.from_numpy(observations).float()
+        with torch.inference_mode():
+            return self.target_network(current_state_tensor).numpy()
+
     def get_model(self, path: str):
         """
-        Get the model parameters from the specified path.
+        Get the model parameters from the specified path. Checkpoints without
+        promotion planes are adapted by a PromotionShim.
         """
         if os.path.isfile(path):
-            model_dict = torch.load(path)
-            self.target_network.load_state_dict(model_dict)
+            model_dict = torch.load(path, map_location="cpu")
+            self.target_network = build_network(self.architecture, model_dict)
+        self.target_network.eval()
@@ -0,0 +1,137 @@
+"""
+Micro-batching of move evaluations. Concurrent requests submit their
+observation and legal move mask, and are answered by one batched forward pass.
+"""
+
+import collections
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+
+# Evaluates a (N, 42, 9, 9) observation batch with its (N, ...) legal move masks,
+# and returns the chosen move index of every position
+Evaluator = Callable[[np.array, np.array], np.array]
+
+
+class BatchScheduler:
+    """
+    Collects pending evaluations for up to max_wait seconds or max_batch_size
+    requests, runs them as one batch on a worker thread, and hands every caller
+    its own result.
+    """
+
+    def __init__(
+        self,
+        evaluate: Evaluator,
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait: float = BATCH_MAX_WAIT_MS / 1000,
+    ):
+        self.evaluate = evaluate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # Recent batch sizes and queue latencies in seconds
+        self._batch_sizes: collections.deque = collections.deque(maxlen=1000)
+        self._queue_latencies: collections.deque = collections.deque(maxlen=1000)
+
+    def submit(self, observation: np.array, mask: np.array) -> Future:
+        """
+        Queue a position for evaluation, the future resolves to its move index.
+        """
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((observation.copy(), mask.copy(), future, time.perf_counter()))
+        return future
+
+    def choose(self, observation: np.array, mask: np.array) -> int:
+        """
+        Evaluate a single position, blocking until its batch has run.
+        """
+        return self.submit(observation, mask).result()
+
+    def metrics(self) -> dict:
+        """
+        Get the batch size and queue latency statistics of recent batches.
+        """
+        batch_sizes = list(self._batch_sizes)
+        latencies = list(self._queue_latencies)
+        return {
+            "batches": len(batch_sizes),
+            "mean_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+            "max_batch_size": max(batch_sizes, default=0),
+            "mean_queue_ms": float(np.mean(latencies)) * 1000 if latencies else 0.0,
+            "max_queue_ms": max(latencies, default=0.0) * 1000,
+        }
+
+    def _ensure_worker(self):
+        """
+        Start the worker thread on first use.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list[tuple]:
+        """
+        Wait for a request, then gather more until the batch is full or the
+        wait window of the first request has passed.
+        """
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """
+        Worker loop, evaluating one batch at a time.
+        """
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self._batch_sizes.append(len(batch))
+            self._queue_latencies.extend(started - item[3] for item in batch)
+
+            try:
+                observations = np.stack([item[0] for item in batch])
+                masks = np.stack([item[1] for item in batch])
+                indices = self.evaluate(observations, masks)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                for item in batch:
+                    item[2].set_exception(error)
+                continue
+
+            for item, index in zip(batch, indices):
+                item[2].set_result(int(index))
+
+
+_schedulers: dict[int, BatchScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(key: int, evaluate: Evaluator) -> BatchScheduler:
+    """
+    Get the process wide scheduler for the specified key, usually the id of the
+    shared network, creating it on first use.
+    """
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = BatchScheduler(evaluate)
+        return _schedulers[key]
@@ -0,0 +1,191 @@
+"""
+Position keyed move cache in front of the network. An opening book with the
+agent's moves for common early positions is built offline, and a bounded LRU
+cache keeps the moves of recently answered positions. Both are keyed by the
+Zobrist hash of the position.
+
+Usage:
+    python -m services.ai.book --plies 8 --width 4 --output model/opening-book.npy
+"""
+
+import argparse
+import collections
+import logging
+import os
+import threading
+
+import numpy as np
+import shogi
+
+from config import BOOK_PATH, POSITION_CACHE_SIZE
+from services.ai.agent import ShogiAgent
+from services.ai.move_table import move_indices
+from services.ai.observation import ObservationEncoder
+from services.ai.registry import registry
+from services.move_codes import decode_move, encode_move
+
+logger = logging.getLogger(__name__)
+
+# Book entries, sorted by key
+BOOK_DTYPE = np.dtype([("key", "<u8"), ("move", "<u2")])
+
+
+class OpeningBook:
+    """
+    Sorted table from position hash to move code. Large books are memory mapped
+    instead of read into memory.
+    """
+
+    def __init__(self, entries: np.array):
+        self.entries = entries
+        self.keys = entries["key"]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "OpeningBook":
+        """Load a book saved with save"""
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    def save(self, path: str):
+        """Save the book as a .npy file"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.save(path, np.asarray(self.entries))
+
+    def lookup(self, key: int) -> shogi.Move | None:
+        """Get the book move of the position, if it is in the book"""
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index < len(self.keys) and int(self.keys[index]) == key:
+            return decode_move(int(self.entries["move"][index]))
+        return None
+
+    @classmethod
+    def build(cls, agent: ShogiAgent, plies: int, width: int) -> "OpeningBook":
+        """
+        Build a book by playing the agent over the first plies of the game.
+        Every position gets the agent's move, and the width best moves of each
+        position are expanded to reach the next ply.
+        """
+        encoder = ObservationEncoder()
+        book: dict[int, int] = {}
+        level = [shogi.Board()]
+        for _ in range(plies + 1):
+            level = [board for board in level if board.zobrist_hash() not in book]
+            if not level:
+                break
+
+            values = agent.policy_values(encoder.encode_batch(level))
+            next_level = {}
+            for board, board_values in zip(level, values):
+                legal = list(board.legal_moves)
+                if not legal:
+                    continue
+                ranked = cls._rank_moves(legal, board_values)
+                book[board.zobrist_hash()] = encode_move(ranked[0])
+                for move in ranked[:width]:
+                    child = shogi.Board(board.sfen())
+                    child.push(move)
+                    next_level.setdefault(child.zobrist_hash(), child)
+            level = list(next_level.values())
+
+        return cls(np.array(sorted(book.items()), dtype=BOOK_DTYPE))
+
+    @staticmethod
+    def _rank_moves(legal: list[shogi.Move], values: np.array) -> list[shogi.Move]:
+        """Order the legal moves by their network value, best first"""
+        ranked = np.argsort(-values[move_indices(legal)], kind="stable")
+        return [legal[i] for i in ranked]
+
+
+class PositionCache:
+    """
+    Thread safe LRU cache from position hash to move code, with hit counters
+    for both the cache and the opening book in front of it.
+    """
+
+    def __init__(self, max_size: int, book: OpeningBook | None = None):
+        self.max_size = max_size
+        self.book = book
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def get(self, board: shogi.Board) -> (int, shogi.Move | None):
+        """
+        Get the hash of the position and its known move, first from the book
+        and then from the cache. Moves that are not legal, after a hash
+        collision, are ignored.
+        """
+        key = board.zobrist_hash()
+        move = self.book.lookup(key) if self.book is not None else None
+        source = "book"
+        if move is None:
+            with self._lock:
+                code = self._entries.get(key)
+                if code is not None:
+                    self._entries.move_to_end(key)
+            move = decode_move(code) if code is not None else None
+            source = "cache"
+
+        if move is not None and not board.is_legal(move):
+            move = None
+        with self._lock:
+            self.counters[f"{source}_hits" if move is not None else "misses"] += 1
+        return key, move
+
+    def put(self, key: int, move: shogi.Move):
+        """Remember the move of a position"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = encode_move(move)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def metrics(self) -> dict:
+        """Get the hit counters and hit rate"""
+        lookups = sum(self.counters.values())
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "cached": len(self._entries),
+            "book_size": len(self.book) if self.book is not None else 0,
+        }
+
+
+_caches: dict[str, PositionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_position_cache(book_path: str = BOOK_PATH) -> PositionCache:
+    """
+    Get the process wide position cache, loading the opening book on first use.
+    """
+    with _caches_lock:
+        if book_path not in _caches:
+            book = None
+            if os.path.isfile(book_path):
+                book = OpeningBook.load(book_path)
+                logger.info("Loaded opening book with %d positions", len(book))
+            _caches[book_path] = PositionCache(POSITION_CACHE_SIZE, book)
+        return _caches[book_path]
+
+
+def main():
+    """Build an opening book with the configured model"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--plies", type=int, default=8)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--output", default=BOOK_PATH)
+    args = parser.parse_args()
+
+    book = OpeningBook.build(ShogiAgent(network=registry.get()), args.plies, args.width)
+    book.save(args.output)
+    print(f"Saved {len(book)} positions to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
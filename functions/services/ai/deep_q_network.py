@@ -15,12 +15,19 @@ class DQN(nn.Module):
     and fully connected layers, with an optional masking layer.
     """
 
-    def __init__(self):
+    # Output layer, and its size per promotion plane
+    OUTPUT_LAYER = "fc2.bias"
+    PLANE_SIZE = 81 * 88
+
+    def __init__(self, promotions: bool = False):
         """
         Initializes the DQN model with four convolutional layers, batch
         normalization, two fully connected layers, and an optional MaskLayer.
+        With promotions, the output has a second plane of 81 * 88 values for the
+        promoting moves.
         """
         super(DQN, self).__init__()
+        self.promotions = promotions
 
         self.conv1 = nn.Conv2d(42, 16, kernel_size=3, stride=1, padding=1)
         self.bn1 = nn.BatchNorm2d(16)
@@ -35,7 +42,7 @@ class DQN(nn.Module):
         self.bn4 = nn.BatchNorm2d(128)
 
         self.fc1 = nn.Linear(128 * 9 * 9, 128 * 81)
-        self.fc2 = nn.Linear(128 * 81, 81 * 88)
+        self.fc2 = nn.Linear(128 * 81, self.PLANE_SIZE * (2 if promotions else 1))
 
     def forward(self, x, mask=None):
         """
@@ -53,3 +60,120 @@ class DQN(nn.Module):
             x = torch.mul(x, mask)
 
         return x
+
+
+class CompactDQN(nn.Module):
+    """
+    Compact variant of the DQN. It shares the convolutional layers of the DQN,
+    but replaces the fully connected layers by a convolutional policy head. The
+    head emits one channel per from square or drop piece, so its (88, 9, 9)
+    output flattens to the same 81 * from + to move index as the DQN.
+    """
+
+    OUTPUT_LAYER = "policy.bias"
+    PLANE_SIZE = 88
+
+    def __init__(self, promotions: bool = False):
+        """
+        Initializes the compact model with the four DQN convolutional layers,
+        one extra convolutional layer, and a 1x1 convolutional policy head.
+        With promotions, the head has 88 more channels for the promoting moves.
+        """
+        super(CompactDQN, self).__init__()
+        self.promotions = promotions
+
+        self.conv1 = nn.Conv2d(42, 16, kernel_size=3, stride=1, padding=1)
+        self.bn1 = nn.BatchNorm2d(16)
+
+        self.conv2 = nn.Conv2d(16, 32, kernel_size=3, stride=1, padding=1)
+        self.bn2 = nn.BatchNorm2d(32)
+
+        self.conv3 = nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=1)
+        self.bn3 = nn.BatchNorm2d(64)
+
+        self.conv4 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
+        self.bn4 = nn.BatchNorm2d(128)
+
+        self.conv5 = nn.Conv2d(128, 128, kernel_size=3, stride=1, padding=1)
+        self.bn5 = nn.BatchNorm2d(128)
+
+        self.policy = nn.Conv2d(
+            128, self.PLANE_SIZE * (2 if promotions else 1), kernel_size=1
+        )
+
+    def forward(self, x, mask=None):
+        """
+        Defines the forward pass of the compact model.
+        """
+        x = nn.functional.relu(self.bn1(self.conv1(x)))
+        x = nn.functional.relu(self.bn2(self.conv2(x)))
+        x = nn.functional.relu(self.bn3(self.conv3(x)))
+        x = nn.functional.relu(self.bn4(self.conv4(x)))
+        x = nn.functional.relu(self.bn5(self.conv5(x)))
+        x = nn.Flatten()(self.policy(x))
+
+        if mask is not None:
+            x = torch.mul(x, mask)
+
+        return x
+
+
+class PromotionShim(nn.Module):
+    """
+    Adapter for checkpoints trained before promotions had their own action
+    indices. The network values a move and its promotion as one, so the shim
+    repeats its output for the promotion plane, one float step higher so the
+    promotion still wins ties as it did before.
+    """
+
+    def __init__(self, network: nn.Module):
+        super(PromotionShim, self).__init__()
+        self.network = network
+
+    def forward(self, x, mask=None):
+        """
+        Defines the forward pass of the adapted model.
+        """
+        x = self.network(x)
+        x = torch.cat([x, torch.nextafter(x, torch.full_like(x, torch.inf))], dim=1)
+
+        if mask is not None:
+            x = torch.mul(x, mask)
+
+        return x
+
+
+# Model architectures that can be selected by name
+ARCHITECTURES = {
+    "dqn": DQN,
+    "compact": CompactDQN,
+}
+
+
+def build_network(architecture: str, state_dict: dict | None = None) -> nn.Module:
+    """
+    Create a model of the architecture and load the state dict into it. New
+    models have promotion planes, checkpoints without them are wrapped in a
+    PromotionShim. Raises ValueError when the state dict is a checkpoint of
+    another architecture.
+    """
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown model architecture {architecture}")
+    model_class = ARCHITECTURES[architecture]
+    if state_dict is None:
+        return model_class(promotions=True)
+
+    if model_class.OUTPUT_LAYER not in state_dict:
+        matching = [
+            name
+            for name, other_class in ARCHITECTURES.items()
+            if other_class.OUTPUT_LAYER in state_dict
+        ]
+        raise ValueError(
+            f"Checkpoint does not match the {architecture} architecture, "
+            f"it is a checkpoint of {' or '.join(matching) or 'an unknown model'}"
+        )
+    planes = state_dict[model_class.OUTPUT_LAYER].shape[0] // model_class.PLANE_SIZE
+    network = model_class(promotions=planes == 2)
+    network.load_state_dict(state_dict)
+    return network if network.promotions else PromotionShim(network)
@@ -0,0 +1,146 @@
+"""
+Distill a trained DQN checkpoint into a compact model. The convolutional layers
+are copied from the teacher, the policy head is trained to reproduce the
+teacher's move preferences on randomly played positions.
+
+Usage:
+    python -m services.ai.distill --teacher model/shogi-agent.pth \\
+        --output model/shogi-agent-compact.pth
+"""
+
+import argparse
+import os
+import random
+
+import numpy as np
+import shogi
+import torch
+from torch import nn
+
+from services.ai.deep_q_network import ARCHITECTURES, build_network
+from services.ai.move_table import ACTIONS, move_indices
+from services.ai.observation import ObservationEncoder
+
+
+def random_position(rng: random.Random, max_plies: int) -> shogi.Board:
+    """
+    Play a random number of random legal moves from the start position.
+    """
+    board = shogi.Board()
+    for _ in range(rng.randrange(max_plies + 1)):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        board.push(rng.choice(legal_moves))
+    return board
+
+
+def legal_mask(board: shogi.Board) -> np.array:
+    """
+    Get the flattened (2 * 88 * 81) legal move mask of the board.
+    """
+    mask = np.zeros(ACTIONS, dtype=np.float32)
+    mask[move_indices(board.legal_moves)] = 1
+    return mask
+
+
+def sample_batch(
+    rng: random.Random, encoder: ObservationEncoder, size: int, max_plies: int
+) -> (torch.Tensor, torch.Tensor):
+    """
+    Get the observations and legal move masks of a batch of random positions.
+    """
+    boards = [random_position(rng, max_plies) for _ in range(size)]
+    observations = torch.from_numpy(encoder.encode_batch(boards))
+    masks = torch.from_numpy(np.stack([legal_mask(board) for board in boards]))
+    return observations, masks
+
+
+def distillation_loss(
+    student_values: torch.Tensor,
+    teacher_values: torch.Tensor,
+    masks: torch.Tensor,
+    temperature: float,
+) -> torch.Tensor:
+    """
+    KL divergence between the teacher and student move distributions over the
+    legal moves only.
+    """
+    illegal = masks == 0
+    teacher = (teacher_values / temperature).masked_fill(illegal, -torch.inf)
+    student = (student_values / temperature).masked_fill(illegal, -torch.inf)
+    teacher_probs = torch.softmax(teacher, dim=1)
+    student_log_probs = torch.log_softmax(student, dim=1)
+    # Illegal moves have zero teacher probability, so they do not contribute
+    products = torch.xlogy(teacher_probs, teacher_probs)
+    products = products - teacher_probs * student_log_probs
+    return products.masked_fill(illegal, 0).sum(dim=1).mean()
+
+
+def distill(args: argparse.Namespace):
+    """
+    Train the student model on the outputs of the teacher.
+    """
+    torch.manual_seed(args.seed)
+    rng = random.Random(args.seed)
+    encoder = ObservationEncoder()
+
+    teacher_state = torch.load(args.teacher, map_location="cpu")
+    teacher = build_network("dqn", teacher_state)
+    teacher.eval()
+
+    student = build_network(args.architecture)
+    # Start from the teacher's convolutional layers where the shapes allow
+    student_state = student.state_dict()
+    shared = {
+        key: value
+        for key, value in teacher_state.items()
+        if key in student_state and student_state[key].shape == value.shape
+    }
+    student.load_state_dict(shared, strict=False)
+    print(f"Copied {len(shared)} tensors from the teacher")
+
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.learning_rate)
+    for step in range(1, args.steps + 1):
+        observations, masks = sample_batch(
+            rng, encoder, args.batch_size, args.max_plies
+        )
+        with torch.no_grad():
+            teacher_values = teacher(observations)
+
+        student.train()
+        loss = distillation_loss(
+            student(observations), teacher_values, masks, args.temperature
+        )
+        optimizer.zero_grad()
+        loss.backward()
+        nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+        optimizer.step()
+
+        if step % args.log_every == 0:
+            print(f"step {step}: loss {loss.item():.4f}")
+
+    student.eval()
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    torch.save(student.state_dict(), args.output)
+    print(f"Saved {args.architecture} model to {args.output}")
+
+
+def main():
+    """Parse the arguments and run the distillation"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--teacher", default="model/shogi-agent.pth")
+    parser.add_argument("--output", default="model/shogi-agent-compact.pth")
+    parser.add_argument("--architecture", default="compact", choices=ARCHITECTURES)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-plies", type=int, default=120)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--log-every", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    distill(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 """Shogi environment for reinforcement learning."""
 
 import random
-import shogi
 
 import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 from shogi import Move
 
+from services.ai.observation import ObservationEncoder
+from services.board import new_board
+
+# Plies after which an episode is cut off
+MAX_PLIES = 512
+
 
 class ShogiEnv(gym.Env):
     """
@@ -18,14 +23,17 @@ class ShogiEnv(gym.Env):
     The game continues until a player wins, the game reaches a stalemate, or a specified number of moves is reached.
     """
 
-    def __init__(self):
+    def __init__(self, max_plies: int = MAX_PLIES):
         """
         Initialize the Shogi environment.
 
         Initializes the Shogi board, action space, and observation space.
+        Episodes are truncated after max_plies moves.
         """
         super(ShogiEnv, self).__init__()
-        self.board = shogi.Board()
+        self.board = new_board()
+        self.max_plies = max_plies
+        self.encoder = ObservationEncoder()
 
         # Action space represents all possible moves in Shogi
         self.action_space = spaces.MultiDiscrete(
@@ -43,14 +51,41 @@ class ShogiEnv(gym.Env):
         *,
         seed: int | None = None,
         options: dict[str, any] | None = None,
-    ) -> np.array:
+    ) -> (np.array, dict):
         """
         Reset the environment to its initial state.
         """
-        self.board = shogi.Board()
+        super().reset(seed=seed)
+        self.board = new_board()
+        return self.get_observation(), {"legal_moves": self.get_legal_moves()}
 
     def step(self, action: Move) -> (np.array, float, bool, bool, dict):
-        pass
+        """
+        Play the move of the side to move.
+
+        Returns:
+            The observation after the move, the reward of the player that moved,
+            whether the game ended, whether it was cut off at max_plies, and an
+            info dict with the legal moves of the next player and the winner.
+            The reward is 1 when the move wins the game, and 0 otherwise.
+            Repeating a position for the fourth time (sennichite) is a draw.
+        """
+        if not self.board.is_legal(action):
+            raise ValueError(f"Illegal move {action.usi()}")
+        mover = self.board.turn
+        self.board.push(action)
+
+        legal_moves = self.get_legal_moves()
+        info = {"legal_moves": legal_moves, "winner": None}
+        reward, terminated = 0.0, False
+        if not legal_moves:
+            # Checkmate, shogi has no stalemate draws
+            reward, terminated = 1.0, True
+            info["winner"] = mover
+        elif self.board.is_fourfold_repetition():
+            terminated = True
+        truncated = not terminated and len(self.board.move_stack) >= self.max_plies
+        return self.get_observation(), reward, terminated, truncated, info
 
     def sample_action(self) -> Move:
         """
@@ -59,77 +94,16 @@ class ShogiEnv(gym.Env):
         legal_moves = self.get_legal_moves()
         return random.choice(legal_moves)
 
-    def get_observation(self) -> np.array:
+    def get_observation(self, out: np.ndarray | None = None) -> np.array:
         """
         Get the current bitboard of the Shogi board.
 
         Returns:
-            list: List representing the current bitboard of the Shogi board.
+            np.array: (42, 9, 9) float32 planes, one per piece type and color on the
+            board followed by one per piece type and color in hand. The array is
+            reused by the next call, unless out is given.
         """
-        piece_symbols = [
-            "",
-            "p",
-            "l",
-            "n",
-            "s",
-            "g",
-            "b",
-            "r",
-            "k",
-            "+p",
-            "+l",
-            "+n",
-            "+s",
-            "+b",
-            "+r",
-        ]
-        pieces_in_board = [self.board.piece_at(i) for i in range(81)]
-        pieces_in_hand = self.board.pieces_in_hand
-        indices = []
-
-        def print_bitboard(piece, pieces_in_board):
-            white_pieces = []
-            black_pieces = []
-            for _, x in enumerate(pieces_in_board):
-                if str(x).lower() == piece:
-                    if str(x).isupper():
-                        white_pieces.append(1)
-                        black_pieces.append(0)
-                    else:
-                        black_pieces.append(1)
-                        white_pieces.append(0)
-                else:
-                    white_pieces.append(0)
-                    black_pieces.append(0)
-            return np.reshape(white_pieces, (9, 9)), np.reshape(black_pieces, (9, 9))
-
-        def create_hand_bitboard(pieces_in_hand, index, is_black):
-            hand_indices = []
-            # Check for white pieces in hand
-            if pieces_in_hand[is_black][index] == 0:
-                hand_indices.append(np.zeros(81))
-            else:
-                for _ in range(pieces_in_hand[0][index]):
-                    hand_indices.append(1)
-                hand_indices.append(np.zeros(81 - len(pieces_in_hand)))
-
-            return np.reshape(hand_indices, (9, 9))
-
-        for piece in piece_symbols:
-            if piece == "":
-                continue
-            white_indices, black_indices = print_bitboard(piece, pieces_in_board)
-            indices.append(white_indices)
-            indices.append(black_indices)
-
-        # Add hand bitboards
-        for i in enumerate(piece_symbols[1:8]):
-            white_indices = create_hand_bitboard(pieces_in_hand, i, False)
-            black_indices = create_hand_bitboard(pieces_in_hand, i, True)
-            indices.append(white_indices)
-            indices.append(black_indices)
-
-        return np.array(indices)
+        return self.encoder.encode(self.board, out)
 
     def render(self):
         pass
@@ -0,0 +1,115 @@
+"""
+Inference backends for trained models. A backend is exported once to a sidecar
+file next to the checkpoint, for example model/shogi-agent.int8.v2.pt, and
+loaded from there on later runs.
+
+Usage:
+    python -m services.ai.inference --backend torchscript
+"""
+
+import argparse
+import logging
+import os
+
+import torch
+from torch import nn
+
+from config import INFERENCE_BACKEND, MODEL_ARCHITECTURE, MODEL_PATH
+from services.ai.deep_q_network import ARCHITECTURES, build_network
+from services.ai.observation import OBSERVATION_SHAPE
+
+logger = logging.getLogger(__name__)
+
+# Eager float32 model, frozen TorchScript with conv and batch norm folded, and
+# TorchScript with the Linear layers dynamically quantized to int8
+BACKENDS = ("eager", "torchscript", "int8")
+
+# Version of the exported outputs, part of the sidecar name so artifacts of an
+# older action space are never loaded. Version 2 added the promotion plane.
+SIDECAR_VERSION = 2
+
+
+def sidecar_path(path: str, backend: str) -> str:
+    """
+    Get the path of the exported artifact of the checkpoint for the backend.
+    """
+    root, _ = os.path.splitext(path)
+    return f"{root}.{backend}.v{SIDECAR_VERSION}.pt"
+
+
+def export(network: nn.Module, backend: str) -> nn.Module:
+    """
+    Convert an eager network to the specified backend.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}")
+
+    network.eval()
+    if backend == "eager":
+        return network
+    if backend == "int8":
+        network = torch.ao.quantization.quantize_dynamic(
+            network, {nn.Linear}, dtype=torch.qint8
+        )
+
+    example = torch.zeros((1,) + OBSERVATION_SHAPE)
+    with torch.no_grad():
+        traced = torch.jit.trace(network, (example,))
+    # Freezing inlines the weights, and folds the batch norms into the convolutions
+    return torch.jit.freeze(traced)
+
+
+def load_sidecar(path: str, backend: str) -> nn.Module | None:
+    """
+    Load the exported artifact of the checkpoint for the backend, if there is one
+    that is newer than the checkpoint.
+    """
+    sidecar = sidecar_path(path, backend)
+    if backend == "eager" or not os.path.isfile(sidecar):
+        return None
+    if os.path.isfile(path) and os.path.getmtime(sidecar) < os.path.getmtime(path):
+        logger.warning("Ignoring %s, it is older than %s", sidecar, path)
+        return None
+    return torch.jit.load(sidecar, map_location="cpu")
+
+
+def prepare(network: nn.Module, path: str, backend: str) -> nn.Module:
+    """
+    Export the eager network loaded from the checkpoint to the backend, and save
+    the result as sidecar artifact for later runs.
+    """
+    exported = export(network, backend)
+    if backend == "eager" or not os.path.isfile(path):
+        # Untrained weights are not worth saving
+        return exported
+
+    sidecar = sidecar_path(path, backend)
+    try:
+        torch.jit.save(exported, sidecar)
+    except OSError:
+        # The deployed file system is read only, keep the export in memory
+        logger.warning("Could not save %s, exported in memory only", sidecar)
+    return exported
+
+
+def main():
+    """Export the configured checkpoint to the specified backend"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument(
+        "--architecture", default=MODEL_ARCHITECTURE, choices=ARCHITECTURES
+    )
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=BACKENDS)
+    args = parser.parse_args()
+
+    network = build_network(
+        args.architecture, torch.load(args.model, map_location="cpu")
+    )
+    exported = export(network, args.backend)
+    if args.backend != "eager":
+        torch.jit.save(exported, sidecar_path(args.model, args.backend))
+        print(f"Saved {sidecar_path(args.model, args.backend)}")
+
+
+if __name__ == "__main__":
+    main()
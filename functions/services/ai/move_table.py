@@ -0,0 +1,82 @@
+"""
+Precomputed tables between moves and action indices. The action index of a move
+is 7128 * promotion + 81 * from + to, where from is the from square, or 81 +
+piece type - 1 for drops. Promoting and non promoting versions of a move get
+their own index, and non promoting indices are the same as in the original
+88 * 81 action space. Masks are built with one scatter into a reused buffer, and
+chosen indices are decoded back to moves through the tables.
+"""
+
+from collections.abc import Iterable
+
+import numpy as np
+import shogi
+
+FROM_INDICES = 88
+# Action indices of one promotion plane, the size of the original action space
+PLANE_ACTIONS = FROM_INDICES * 81
+ACTIONS = 2 * PLANE_ACTIONS
+
+
+def _build_moves(promotion: bool) -> list[shogi.Move | None]:
+    """
+    Get the move of every action index, None where the move cannot exist.
+    """
+    moves = []
+    for from_index in range(FROM_INDICES):
+        for to_square in range(81):
+            if from_index < 81:
+                moves.append(shogi.Move(from_index, to_square, promotion))
+            elif promotion:
+                # Dropped pieces can not promote
+                moves.append(None)
+            else:
+                drop_piece_type = from_index - 81 + 1
+                moves.append(
+                    shogi.Move(None, to_square, drop_piece_type=drop_piece_type)
+                )
+    return moves
+
+
+# MOVES[index] is the move of the action index
+MOVES = _build_moves(False) + _build_moves(True)
+
+
+def move_index(move: shogi.Move) -> int:
+    """Get the action index of a move"""
+    if move.from_square is None:
+        return 81 * (80 + move.drop_piece_type) + move.to_square
+    return PLANE_ACTIONS * move.promotion + 81 * move.from_square + move.to_square
+
+
+def move_indices(moves: Iterable[shogi.Move]) -> np.array:
+    """Get the action indices of the moves"""
+    return np.fromiter((move_index(move) for move in moves), dtype=np.intp)
+
+
+# pylint: disable-next=too-few-public-methods
+class LegalMoves:
+    """
+    Legal moves of a position as a reused (2, 88, 81) action mask. Indexing it
+    with a legal action index gives the move.
+    """
+
+    def __init__(self):
+        self.mask = np.zeros((2, FROM_INDICES, 81), dtype=np.float32)
+        self._flat_mask = self.mask.reshape(-1)
+        # Indices set by the last update, cleared by the next one instead of
+        # filling the whole mask
+        self._indices = np.empty(0, dtype=np.intp)
+
+    def update(self, moves: list[shogi.Move]) -> np.array:
+        """Set the mask to the specified legal moves"""
+        self._flat_mask[self._indices] = 0
+        # A list is built faster than np.fromiter consumes a generator
+        self._indices = np.array([move_index(move) for move in moves], dtype=np.intp)
+        self._flat_mask[self._indices] = 1
+        return self.mask
+
+    def __getitem__(self, index: int) -> shogi.Move:
+        if not self.mask.flat[index]:
+            raise KeyError(index)
+        return MOVES[index]
@@ -0,0 +1,184 @@
+"""
+Observation encoder for the Shogi environment. Turns python-shogi boards into
+the (42, 9, 9) planes the DQN expects, straight from the board bitboards.
+
+For training and caching, positions can also be packed into 322 bytes: the 28
+board planes as 81-bit masks of 11 bytes each, followed by the 14 hand counts.
+unpack_observations turns a batch of packed positions back into planes.
+
+The hand planes are only filled with hand_planes set, see config.HAND_PLANES.
+Models trained on the original encoder, whose hand planes were always empty,
+need them empty.
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import shogi
+import torch
+
+from config import HAND_PLANES
+
+# One plane per piece type and color, followed by one plane per hand piece
+# type and color. Black (uppercase) planes come before white (lowercase) ones.
+BOARD_PIECE_TYPES = range(shogi.PAWN, shogi.PROM_ROOK + 1)
+HAND_PIECE_TYPES = range(shogi.PAWN, shogi.ROOK + 1)
+BOARD_PLANES = 2 * len(BOARD_PIECE_TYPES)
+PLANES = BOARD_PLANES + 2 * len(HAND_PIECE_TYPES)
+OBSERVATION_SHAPE = (PLANES, 9, 9)
+
+# Bitboards are unpacked byte wise, 81 bits fit in 11 bytes
+BITBOARD_BYTES = 11
+BITBOARD_BITS = BITBOARD_BYTES * 8
+
+# Packed positions hold the board bitboards, then one byte per hand plane
+PACKED_BOARD_BYTES = BOARD_PLANES * BITBOARD_BYTES
+PACKED_BYTES = PACKED_BOARD_BYTES + PLANES - BOARD_PLANES
+
+# Lookup table from a byte to its 8 bits, least significant bit first
+BYTE_BITS = np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, None], axis=1, bitorder="little"
+).astype(np.float32)
+
+
+def board_bitboards(board: shogi.Board) -> list[int]:
+    """
+    Get the 42 bitboards of the specified board, one per observation plane.
+    Hand planes have their first n squares set, for n pieces in hand.
+    """
+    black, white = board.occupied[shogi.BLACK], board.occupied[shogi.WHITE]
+    bitboards = []
+    for piece_type in BOARD_PIECE_TYPES:
+        piece_bb = board.piece_bb[piece_type]
+        bitboards.append(piece_bb & black)
+        bitboards.append(piece_bb & white)
+
+    black_hand, white_hand = board.pieces_in_hand
+    for piece_type in HAND_PIECE_TYPES:
+        bitboards.append((1 << black_hand[piece_type]) - 1)
+        bitboards.append((1 << white_hand[piece_type]) - 1)
+    return bitboards
+
+
+def hand_counts(board: shogi.Board) -> list[int]:
+    """
+    Get the number of pieces in hand of every hand plane.
+    """
+    black_hand, white_hand = board.pieces_in_hand
+    return [
+        hand[piece_type]
+        for piece_type in HAND_PIECE_TYPES
+        for hand in (black_hand, white_hand)
+    ]
+
+
+def is_packed(observations: np.array) -> bool:
+    """
+    Whether the observations are packed positions rather than planes.
+    """
+    return observations.dtype == np.uint8 and observations.shape[-1] == PACKED_BYTES
+
+
+def unpack_observations(
+    packed: np.array, out: torch.Tensor | None = None, hand_planes: bool = HAND_PLANES
+) -> torch.Tensor:
+    """
+    Unpack (N, 322) packed positions into a (N, 42, 9, 9) float32 tensor. The
+    hand planes are left empty without hand_planes.
+    """
+    if out is None:
+        out = torch.empty((len(packed),) + OBSERVATION_SHAPE)
+
+    planes = out.numpy().reshape((len(packed), PLANES, 81))
+    board = packed[:, :PACKED_BOARD_BYTES].reshape(
+        (len(packed), BOARD_PLANES, BITBOARD_BYTES)
+    )
+    planes[:, :BOARD_PLANES] = np.unpackbits(board, axis=2, count=81, bitorder="little")
+    if not hand_planes:
+        planes[:, BOARD_PLANES:] = 0
+        return out
+
+    # Hand planes have their first n squares set, for n pieces in hand
+    counts = packed[:, PACKED_BOARD_BYTES:]
+    planes[:, BOARD_PLANES:] = np.arange(81) < counts[:, :, None]
+    return out
+
+
+class ObservationEncoder:
+    """
+    Encodes boards into float32 observation planes. The buffers are allocated
+    once, so the array returned by encode is overwritten by the next call.
+    Without hand_planes the hand planes are left empty, as the original encoder
+    did. Packed positions always keep the pieces in hand.
+    """
+
+    def __init__(self, hand_planes: bool = HAND_PLANES):
+        self.hand_planes = hand_planes
+        self.observation = np.zeros(OBSERVATION_SHAPE, dtype=np.float32)
+        self._bits = np.zeros((PLANES, BITBOARD_BYTES, 8), dtype=np.float32)
+
+    def encode(self, board: shogi.Board, out: np.ndarray | None = None) -> np.array:
+        """
+        Encode a single board into a (42, 9, 9) array.
+        """
+        if out is None:
+            out = self.observation
+
+        packed = self._pack([board])
+        np.take(BYTE_BITS, packed[0], axis=0, out=self._bits)
+        out.reshape((PLANES, 81))[:] = self._bits.reshape((PLANES, BITBOARD_BITS))[
+            :, :81
+        ]
+        if not self.hand_planes:
+            out[BOARD_PLANES:] = 0
+        return out
+
+    def encode_batch(
+        self, boards: Sequence[shogi.Board], out: np.ndarray | None = None
+    ) -> np.array:
+        """
+        Encode many boards into a (N, 42, 9, 9) array.
+        """
+        if out is None:
+            out = np.empty((len(boards),) + OBSERVATION_SHAPE, dtype=np.float32)
+
+        bits = np.unpackbits(self._pack(boards), axis=2, bitorder="little")
+        bits = bits.reshape((len(boards), PLANES, BITBOARD_BITS))
+        out.reshape((len(boards), PLANES, 81))[:] = bits[:, :, :81]
+        if not self.hand_planes:
+            out[:, BOARD_PLANES:] = 0
+        return out
+
+    @staticmethod
+    def pack(board: shogi.Board) -> np.array:
+        """
+        Pack a single board into 322 bytes, see unpack_observations.
+        """
+        data = b"".join(
+            bitboard.to_bytes(BITBOARD_BYTES, "little")
+            for bitboard in board_bitboards(board)[:BOARD_PLANES]
+        )
+        return np.frombuffer(data + bytes(hand_counts(board)), dtype=np.uint8)
+
+    def pack_batch(self, boards: Sequence[shogi.Board]) -> np.array:
+        """
+        Pack many boards into a (N, 322) byte array.
+        """
+        packed = np.empty((len(boards), PACKED_BYTES), dtype=np.uint8)
+        for row, board in enumerate(boards):
+            packed[row] = self.pack(board)
+        return packed
+
+    @staticmethod
+    def _pack(boards: Sequence[shogi.Board]) -> np.array:
+        """
+        Get the bitboards of all boards as a (N, 42, 11) byte array.
+        """
+        data = b"".join(
+            bitboard.to_bytes(BITBOARD_BYTES, "little")
+            for board in boards
+            for bitboard in board_bitboards(board)
+        )
+        return np.frombuffer(data, dtype=np.uint8).reshape(
+            len(boards), PLANES, BITBOARD_BYTES
+        )
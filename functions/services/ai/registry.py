@@ -0,0 +1,126 @@
+"""
+Process wide registry of loaded models. Every network is loaded and put in
+evaluation mode once per process, and then shared by all agents.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import torch
+from torch import nn
+
+from config import INFERENCE_BACKEND, MODEL_ARCHITECTURE, MODEL_PATH, PRELOAD_MODEL
+from services.ai import inference
+from services.ai.deep_q_network import build_network
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Process wide registry of loaded models. Every network is loaded and put in
+    evaluation mode once per process, and then shared by all agents.
+    """
+
+    def __init__(self):
+        self._models: dict[str, nn.Module] = {}
+        self._load_times: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        path: str = MODEL_PATH,
+        architecture: str = MODEL_ARCHITECTURE,
+        backend: str = INFERENCE_BACKEND,
+    ) -> nn.Module:
+        """
+        Get the network stored at the specified path, loading it on first use.
+        """
+        key = self._key(path, architecture, backend)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            # Another thread might have loaded it while we were waiting
+            if key not in self._models:
+                self._models[key] = self._load(path, architecture, backend)
+        return self._models[key]
+
+    def load_time(
+        self,
+        path: str = MODEL_PATH,
+        architecture: str = MODEL_ARCHITECTURE,
+        backend: str = INFERENCE_BACKEND,
+    ) -> float | None:
+        """
+        Get the time in seconds it took to load the specified model.
+        """
+        return self._load_times.get(self._key(path, architecture, backend))
+
+    def metrics(self) -> dict:
+        """
+        Get the load metrics of all models loaded in this process.
+        """
+        return {
+            "models_loaded": len(self._models),
+            "load_seconds": dict(self._load_times),
+        }
+
+    def clear(self):
+        """
+        Drop all loaded models, so they are loaded again on next use.
+        """
+        with self._lock:
+            self._models.clear()
+            self._load_times.clear()
+
+    @staticmethod
+    def _key(path: str, architecture: str, backend: str) -> str:
+        """
+        Get the key a model is stored under.
+        """
+        return f"{architecture}/{backend}:{path}"
+
+    def _load(self, path: str, architecture: str, backend: str) -> nn.Module:
+        """
+        Load the network, and freeze it for shared read only use.
+        """
+        start = time.perf_counter()
+
+        network = inference.load_sidecar(path, backend)
+        if network is None:
+            network = inference.prepare(
+                self._load_eager(path, architecture), path, backend
+            )
+        network.eval()
+
+        load_time = time.perf_counter() - start
+        self._load_times[self._key(path, architecture, backend)] = load_time
+        logger.info(
+            "Loaded %s model %s for %s in %.3fs", architecture, path, backend, load_time
+        )
+        return network
+
+    @staticmethod
+    def _load_eager(path: str, architecture: str) -> nn.Module:
+        """
+        Load the checkpoint in the eager model of the architecture.
+        """
+        state_dict = None
+        if os.path.isfile(path):
+            state_dict = torch.load(path, map_location="cpu")
+        else:
+            logger.warning("No model found at %s, using untrained weights", path)
+        network = build_network(architecture, state_dict)
+        network.eval()
+        network.requires_grad_(False)
+        return network
+
+
+registry = ModelRegistry()
+
+if PRELOAD_MODEL:
+    registry.get()
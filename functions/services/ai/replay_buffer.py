@@ -0,0 +1,339 @@
+"""
+Experience replay buffer for training the DQN. Positions are kept in a fixed
+size ring that is split over memory-mapped .npy shards, so the buffer can be
+far larger than the RAM of the training machine and is reopened where it was
+left.
+
+Per position the ring stores:
+    observations   the packed position, 322 bytes, see observation.py
+    mask_indices   move indices of the legal moves, padded with -1
+    actions        move index of the move played
+    outcomes       1 when the side to move won the game, -1 lost, 0 drawn
+    last           whether it is the last position of its game
+    priorities     sampling priority, for prioritized replay
+
+Games are added whole, so the position after a position that is not the last
+of its game is always the next slot of the ring.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+
+from services.ai.move_table import ACTIONS
+from services.ai.observation import (
+    OBSERVATION_SHAPE,
+    PACKED_BYTES,
+    unpack_observations,
+)
+
+# Most legal moves any shogi position has
+MAX_LEGAL_MOVES = 593
+
+# Shape and type of every stored field, per position
+FIELDS = {
+    "observations": ((PACKED_BYTES,), np.uint8),
+    "mask_indices": ((MAX_LEGAL_MOVES,), np.int16),
+    "actions": ((), np.int16),
+    "outcomes": ((), np.int8),
+    "last": ((), np.bool_),
+    "priorities": ((), np.float32),
+}
+
+
+def pad_masks(masks: list[np.array]) -> np.array:
+    """Get the legal move indices of every position as (N, 593) padded rows"""
+    padded = np.full((len(masks), MAX_LEGAL_MOVES), -1, dtype=np.int16)
+    for row, mask in enumerate(masks):
+        padded[row, : len(mask)] = mask
+    return padded
+
+
+@dataclass
+class ReplayConfig:
+    """
+    Settings of a replay buffer. A reopened buffer keeps the capacity and shard
+    size it was created with.
+    """
+
+    capacity: int = 1 << 20
+    shard_size: int = 1 << 16
+    # Priority exponent of prioritized replay, 0 samples uniformly
+    alpha: float = 0.6
+    seed: int | None = None
+
+
+@dataclass
+class ReplayBatch:
+    """
+    Preallocated tensors a batch is sampled into. The next observation and mask
+    of a last position are left empty.
+    """
+
+    observations: torch.Tensor
+    masks: torch.Tensor
+    actions: torch.Tensor
+    outcomes: torch.Tensor
+    last: torch.Tensor
+    next_observations: torch.Tensor
+    next_masks: torch.Tensor
+    weights: torch.Tensor
+    indices: np.array
+
+    @classmethod
+    def allocate(cls, batch_size: int) -> "ReplayBatch":
+        """Allocate the tensors of a batch"""
+        return cls(
+            observations=torch.zeros((batch_size,) + OBSERVATION_SHAPE),
+            masks=torch.zeros((batch_size, ACTIONS), dtype=torch.bool),
+            actions=torch.zeros(batch_size, dtype=torch.int64),
+            outcomes=torch.zeros(batch_size),
+            last=torch.zeros(batch_size, dtype=torch.bool),
+            next_observations=torch.zeros((batch_size,) + OBSERVATION_SHAPE),
+            next_masks=torch.zeros((batch_size, ACTIONS), dtype=torch.bool),
+            weights=torch.ones(batch_size),
+            indices=np.zeros(batch_size, dtype=np.int64),
+        )
+
+
+class SumTree:
+    """
+    Binary tree of priority sums, to sample slots in proportion to their
+    priority. All operations work on whole batches of slots at once.
+    """
+
+    def __init__(self, capacity: int):
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.leaves)
+
+    @property
+    def total(self) -> float:
+        """Sum of all priorities"""
+        return self.tree[1]
+
+    def get(self, slots: np.array) -> np.array:
+        """Get the priorities of the slots"""
+        return self.tree[self.leaves + slots]
+
+    def update(self, slots: np.array, priorities: np.array):
+        """Set the priorities of the slots, and update their ancestors"""
+        nodes = self.leaves + np.asarray(slots)
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, prefix_sums: np.array) -> np.array:
+        """Get the slots the prefix sums of the priorities fall into"""
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        prefix_sums = prefix_sums.copy()
+        while nodes[0] < self.leaves:
+            left = self.tree[2 * nodes]
+            right = prefix_sums >= left
+            prefix_sums -= np.where(right, left, 0)
+            nodes = 2 * nodes + right
+        return nodes - self.leaves
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of self-play positions in memory-mapped shards. New positions
+    overwrite the oldest ones once the buffer is full.
+    """
+
+    def __init__(self, directory: str, config: ReplayConfig | None = None):
+        config = config or ReplayConfig()
+        self.directory = directory
+        self.alpha = config.alpha
+        self.rng = np.random.default_rng(config.seed)
+        self.head = 0
+        self.size = 0
+        capacity, shard_size = config.capacity, config.shard_size
+
+        state_path = os.path.join(directory, "state.json")
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as file:
+                state = json.load(file)
+            capacity, shard_size = state["capacity"], state["shard_size"]
+            self.head, self.size = state["head"], state["size"]
+        os.makedirs(directory, exist_ok=True)
+        self.capacity = capacity
+        self.shard_size = shard_size
+
+        shards = -(-capacity // shard_size)
+        self.shards = {
+            name: [self._open(name, shard) for shard in range(shards)]
+            for name in FIELDS
+        }
+        self.tree = SumTree(capacity)
+        priorities = np.concatenate(self.shards["priorities"])[: self.size]
+        if self.size:
+            self.tree.update(np.arange(self.size), priorities**self.alpha)
+        self.max_priority = float(priorities.max(initial=1.0))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add_game(
+        self,
+        observations: np.array,
+        masks: list[np.array],
+        actions: np.array,
+        outcomes: np.array,
+    ):
+        """
+        Add the positions of one game, given as packed positions, legal move
+        indices, the move indices played and the outcomes for the side to move.
+        """
+        last = np.zeros(len(actions), dtype=np.bool_)
+        last[-1] = True
+        self.add(
+            {
+                "observations": observations,
+                "mask_indices": pad_masks(masks),
+                "actions": actions,
+                "outcomes": outcomes,
+                "last": last,
+            }
+        )
+
+    def add_shard(self, shard: dict[str, np.array]):
+        """Add the positions of a self-play shard, see self_play.load_shard"""
+        offsets = shard["mask_offsets"]
+        masks = np.split(shard["mask_indices"], offsets[1:-1])
+        self.add(
+            {
+                "observations": shard["observations"],
+                "mask_indices": pad_masks(masks),
+                "actions": shard["actions"],
+                "outcomes": shard["outcomes"],
+                "last": shard["last"],
+            }
+        )
+
+    def add(self, positions: dict[str, np.array]):
+        """
+        Append packed positions to the ring, given by the stored fields other
+        than their priorities, overwriting the oldest positions when it is
+        full. New positions get the highest priority seen so far.
+        """
+        actions = positions["actions"]
+        values = {
+            **positions,
+            "priorities": np.full(len(actions), self.max_priority),
+        }
+        start = 0
+        while start < len(actions):
+            shard, offset = divmod(self.head, self.shard_size)
+            count = min(
+                len(actions) - start,
+                self.shard_size - offset,
+                self.capacity - self.head,
+            )
+            for name, value in values.items():
+                self.shards[name][shard][offset : offset + count] = value[
+                    start : start + count
+                ]
+            self.tree.update(
+                np.arange(self.head, self.head + count),
+                values["priorities"][start : start + count] ** self.alpha,
+            )
+            start += count
+            self.head = (self.head + count) % self.capacity
+            self.size = min(self.size + count, self.capacity)
+
+    def sample(
+        self, batch: ReplayBatch, prioritized: bool = False, beta: float = 0.4
+    ) -> ReplayBatch:
+        """
+        Sample positions into the batch, uniformly or in proportion to their
+        priority. Prioritized samples get importance sampling weights.
+        """
+        batch_size = len(batch.indices)
+        if prioritized:
+            segment = self.tree.total / batch_size
+            prefix_sums = (
+                np.arange(batch_size) + self.rng.random(batch_size)
+            ) * segment
+            slots = np.minimum(self.tree.find(prefix_sums), self.size - 1)
+            probabilities = self.tree.get(slots) / self.tree.total
+            weights = (self.size * probabilities) ** -beta
+            batch.weights.numpy()[:] = weights / weights.max()
+        else:
+            slots = self.rng.integers(0, self.size, batch_size)
+            batch.weights.fill_(1)
+        batch.indices[:] = slots
+
+        batch.actions.numpy()[:] = self._gather("actions", slots)
+        batch.outcomes.numpy()[:] = self._gather("outcomes", slots)
+        last = self._gather("last", slots)
+        batch.last.numpy()[:] = last
+        self._unpack(slots, batch.observations, batch.masks)
+
+        next_slots = (slots + 1) % self.capacity
+        self._unpack(next_slots, batch.next_observations, batch.next_masks)
+        batch.next_observations[torch.from_numpy(last)] = 0
+        batch.next_masks[torch.from_numpy(last)] = False
+        return batch
+
+    def update_priorities(self, slots: np.array, priorities: np.array):
+        """Set the priorities of sampled slots, usually to their TD errors"""
+        priorities = np.abs(priorities) + 1e-6
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        for shard in np.unique(slots // self.shard_size):
+            selected = slots // self.shard_size == shard
+            self.shards["priorities"][shard][slots[selected] % self.shard_size] = (
+                priorities[selected]
+            )
+        self.tree.update(slots, priorities**self.alpha)
+
+    def flush(self):
+        """Write the shards and the ring position to disk"""
+        for shards in self.shards.values():
+            for shard in shards:
+                shard.flush()
+        state = {
+            "capacity": self.capacity,
+            "shard_size": self.shard_size,
+            "head": self.head,
+            "size": self.size,
+        }
+        with open(
+            os.path.join(self.directory, "state.json"), "w", encoding="utf-8"
+        ) as file:
+            json.dump(state, file)
+
+    def _open(self, name: str, shard: int) -> np.memmap:
+        """Open a shard of a field, creating it when it does not exist"""
+        path = os.path.join(self.directory, f"{name}-{shard:04d}.npy")
+        if os.path.exists(path):
+            return np.lib.format.open_memmap(path, mode="r+")
+        shape, dtype = FIELDS[name]
+        return np.lib.format.open_memmap(
+            path, mode="w+", dtype=dtype, shape=(self.shard_size,) + shape
+        )
+
+    def _gather(self, name: str, slots: np.array) -> np.array:
+        """Read the field of the slots, one shard at a time"""
+        shape, dtype = FIELDS[name]
+        values = np.empty((len(slots),) + shape, dtype=dtype)
+        shard_ids = slots // self.shard_size
+        for shard in np.unique(shard_ids):
+            selected = shard_ids == shard
+            values[selected] = self.shards[name][shard][
+                slots[selected] % self.shard_size
+            ]
+        return values
+
+    def _unpack(self, slots: np.array, observations: torch.Tensor, masks: torch.Tensor):
+        """Unpack the observations and legal move masks of the slots"""
+        unpack_observations(self._gather("observations", slots), out=observations)
+
+        mask_indices = self._gather("mask_indices", slots)
+        rows, columns = np.nonzero(mask_indices >= 0)
+        masks.fill_(False)
+        masks.numpy()[rows, mask_indices[rows, columns]] = True
@@ -0,0 +1,310 @@
+"""
+Iterative deepening alpha-beta search over the DQN. The network values of a
+position order its moves, and the best legal value of a position is used as its
+evaluation. Leaf positions are evaluated in one batch per parent, and the
+search stops at a hard wall clock budget. Forward passes are timed, and a pass
+is only started when its measured cost still fits in the budget. Only the pass
+over the root position is always made, as the search has no move without it.
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import shogi
+
+from config import SEARCH_MAX_DEPTH, SEARCH_TIME_MS
+from services.ai.agent import ShogiAgent
+from services.ai.move_table import move_indices
+from services.ai.observation import OBSERVATION_SHAPE, ObservationEncoder
+
+# Score of a position where the side to move has no legal moves left
+MATE_SCORE = 1e6
+
+# Transposition table entry bounds
+EXACT, LOWER, UPPER = range(3)
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget is used up"""
+
+
+class TableEntry:
+    """Transposition table entry of a position"""
+
+    __slots__ = ("moves", "priors", "value", "depth", "score", "bound", "best", "exact")
+
+    def __init__(self, moves: list[shogi.Move], priors: np.array, exact: bool = True):
+        # Leaf positions are scored over their pseudo legal moves, which is much
+        # cheaper. Their moves are made exact when the position is expanded.
+        self.exact = exact
+        # Legal moves ordered by their network value, best first
+        order = np.argsort(-priors, kind="stable")
+        self.moves = [moves[i] for i in order]
+        self.priors = priors[order]
+        self.value = float(self.priors[0]) if moves else -MATE_SCORE
+        self.depth = -1
+        self.score = self.value
+        self.bound = EXACT
+        self.best: shogi.Move | None = self.moves[0] if moves else None
+
+    def probe(self, depth: int, alpha: float, beta: float) -> float | None:
+        """
+        Get the stored score, if it was searched deep enough to be used within
+        the alpha beta window.
+        """
+        if self.depth < depth:
+            return None
+        if self.bound == EXACT:
+            return self.score
+        if self.bound == LOWER and self.score >= beta:
+            return self.score
+        if self.bound == UPPER and self.score <= alpha:
+            return self.score
+        return None
+
+    def record(
+        self, depth: int, score: float, best: shogi.Move, window: tuple[float, float]
+    ):
+        """
+        Store a search result, with the bound it has given the original alpha
+        beta window.
+        """
+        self.depth, self.score, self.best = depth, score, best
+        alpha, beta = window
+        if score <= alpha:
+            self.bound = UPPER
+        elif score >= beta:
+            self.bound = LOWER
+        else:
+            self.bound = EXACT
+
+    def ordered_moves(self) -> list[shogi.Move]:
+        """
+        Get the moves in search order, the best move of earlier searches first.
+        """
+        if self.best is None or self.best == self.moves[0]:
+            return self.moves
+        return [self.best] + [move for move in self.moves if move != self.best]
+
+
+@dataclass
+class SearchResult:
+    """Outcome of a search"""
+
+    move: shogi.Move
+    score: float
+    depth: int
+    nodes: int
+    seconds: float = 0.0
+
+    @property
+    def nodes_per_second(self) -> float:
+        """Searched positions per second"""
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+
+class SearchEngine:
+    """
+    Iterative deepening alpha-beta search over the DQN, with a transposition
+    table keyed by the Zobrist hash of the position.
+    """
+
+    def __init__(
+        self,
+        agent: ShogiAgent,
+        time_budget: float = SEARCH_TIME_MS / 1000,
+        max_depth: int = SEARCH_MAX_DEPTH,
+        table_size: int = 200_000,
+    ):
+        self.agent = agent
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.table: dict[int, TableEntry] = {}
+        self.encoder = ObservationEncoder()
+        self.nodes = 0
+        self._deadline = 0.0
+        # Measured seconds of a forward pass over one position, and of every
+        # further position of a batch
+        self.pass_seconds = 0.0
+        self.row_seconds: float | None = None
+
+    def search(self, board: shogi.Board) -> SearchResult:
+        """
+        Search the position until the time budget or the maximum depth is
+        reached, and get the best move of the deepest completed iteration.
+        """
+        start = time.perf_counter()
+        self._deadline = start + self.time_budget
+        self.nodes = 0
+        if len(self.table) >= self.table_size:
+            self.clear()
+        # Search a copy, so a timeout never leaves the caller's board half updated
+        board = shogi.Board(board.sfen())
+
+        root = self._entry(board)
+        if root.best is None:
+            raise ValueError("The position has no legal moves")
+        result = SearchResult(root.best, root.value, 0, self.nodes)
+
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score = self._negamax(board, depth, -np.inf, np.inf)
+            except SearchTimeout:
+                break
+            result = SearchResult(root.best, score, depth, self.nodes)
+            if abs(score) >= MATE_SCORE:
+                break
+
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def clear(self):
+        """
+        Empty the transposition table.
+        """
+        self.table.clear()
+
+    def _negamax(self, board: shogi.Board, depth: int, alpha: float, beta: float):
+        """
+        Score the position from the side to move, within the alpha beta window.
+        """
+        # Keep the time of a forward pass in reserve, for the position itself or
+        # its children
+        if not self._max_rows():
+            raise SearchTimeout()
+        self.nodes += 1
+
+        entry = self._entry(board)
+        if not entry.moves or depth == 0:
+            return entry.value
+        score = entry.probe(depth, alpha, beta)
+        if score is not None:
+            return score
+
+        moves = entry.ordered_moves()
+        scores = None
+        if depth == 1:
+            scores = [-child.value for child in self._children(board, moves)]
+
+        original_alpha = alpha
+        best_score, best_move = -np.inf, moves[0]
+        for i, move in enumerate(moves):
+            if scores is not None:
+                score = scores[i]
+            else:
+                board.push(move)
+                try:
+                    score = -self._negamax(board, depth - 1, -beta, -alpha)
+                finally:
+                    board.pop()
+
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        entry.record(depth, best_score, best_move, (original_alpha, beta))
+        return best_score
+
+    def _entry(self, board: shogi.Board) -> TableEntry:
+        """
+        Get the table entry of the position, evaluating it when it is new.
+        """
+        key = board.zobrist_hash()
+        entry = self.table.get(key)
+        if entry is None or not entry.exact:
+            moves = list(board.legal_moves)
+            observations = self.encoder.encode(board)[None]
+            values = self._forward(observations)[0]
+            entry = self._store(key, moves, values)
+        return entry
+
+    def _children(
+        self, board: shogi.Board, moves: list[shogi.Move]
+    ) -> list[TableEntry]:
+        """
+        Get the table entries of the positions after each move, evaluating all
+        new positions with one forward pass, or with several when one pass over
+        all of them would not fit in the time left.
+        """
+        entries, pending = [], []
+        observations = np.empty((len(moves),) + OBSERVATION_SHAPE, dtype=np.float32)
+        for i, move in enumerate(moves):
+            while len(pending) >= self._max_rows():
+                if not pending:
+                    raise SearchTimeout()
+                self._evaluate(entries, pending, observations)
+                pending = []
+            board.push(move)
+            try:
+                key = board.zobrist_hash()
+                entries.append(self.table.get(key))
+                if entries[-1] is None:
+                    self.encoder.encode(board, out=observations[len(pending)])
+                    # Only a position in check can be mate, it needs exact moves
+                    exact = board.is_check()
+                    if exact:
+                        child_moves = list(board.legal_moves)
+                    else:
+                        child_moves = list(board.generate_pseudo_legal_moves())
+                    pending.append((i, key, child_moves, exact))
+            finally:
+                board.pop()
+
+        if pending:
+            self._evaluate(entries, pending, observations)
+
+        self.nodes += len(moves)
+        return entries
+
+    def _evaluate(self, entries: list, pending: list[tuple], observations: np.array):
+        """
+        Evaluate the pending children, whose observations are at the start of
+        the buffer, and add them to the table and their entries.
+        """
+        values = self._forward(observations[: len(pending)])
+        for (i, key, child_moves, exact), child_values in zip(pending, values):
+            entries[i] = self._store(key, child_moves, child_values, exact)
+
+    def _forward(self, observations: np.array) -> np.array:
+        """
+        Get the network values of a batch of observations, timing the forward
+        pass to estimate the cost of the next ones.
+        """
+        start = time.perf_counter()
+        values = self.agent.policy_values(observations)
+        seconds = time.perf_counter() - start
+        if len(observations) == 1:
+            self.pass_seconds = seconds
+        else:
+            extra_seconds = max(seconds - self.pass_seconds, 0.0)
+            self.row_seconds = extra_seconds / (len(observations) - 1)
+        return values
+
+    def _max_rows(self) -> int:
+        """
+        Get how many positions a forward pass can evaluate in the time left,
+        zero when not even one fits. Until a batch is timed, every position is
+        assumed to cost as much as a pass over one.
+        """
+        time_left = self._deadline - time.perf_counter() - self.pass_seconds
+        if time_left < 0:
+            return 0
+        row_seconds = (
+            self.pass_seconds if self.row_seconds is None else self.row_seconds
+        )
+        return 1 + int(time_left / max(row_seconds, 1e-6))
+
+    def _store(
+        self, key: int, moves: list[shogi.Move], values: np.array, exact: bool = True
+    ):
+        """
+        Add a position to the table.
+        """
+        entry = TableEntry(moves, values[move_indices(moves)], exact)
+        self.table[key] = entry
+        return entry
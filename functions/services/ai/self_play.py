@@ -0,0 +1,258 @@
+"""
+Self-play data generation. Worker processes each play a number of games at
+once with ShogiAgent, evaluating the positions of all their in-flight games in
+one batch per ply, and stream the positions of finished games to compressed
+shards.
+
+A shard is a .npz file with, per position:
+    observations   (N, 322) uint8 packed positions, see observation.py
+    mask_offsets   (N + 1,) int64 offsets into mask_indices
+    mask_indices   int16 move indices of the legal moves, see move_table
+    actions        (N,) int16 move index of the move played
+    outcomes       (N,) int8 1 when the side to move won, -1 lost, 0 drawn
+    last           (N,) bool whether it is the last position of its game
+
+Shards only hold whole games, so they can hold somewhat more than shard_size
+positions.
+
+Usage:
+    python -m services.ai.self_play --model model/shogi-agent.pth \\
+        --output local/self-play --games 64 --workers 4
+"""
+
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+
+import numpy as np
+import shogi
+import torch
+
+from config import MODEL_ARCHITECTURE, MODEL_PATH
+from services.ai.agent import ShogiAgent
+from services.ai.deep_q_network import ARCHITECTURES
+from services.ai.environment import MAX_PLIES, ShogiEnv
+from services.ai.move_table import ACTIONS, MOVES, move_indices
+from services.ai.observation import ObservationEncoder
+
+
+@dataclass
+class SelfPlayConfig:
+    """Settings of one self-play worker"""
+
+    model: str | None
+    output: str
+    games: int
+    architecture: str = MODEL_ARCHITECTURE
+    concurrent_games: int = 32
+    epsilon: float = 0.1
+    max_plies: int = MAX_PLIES
+    shard_size: int = 4096
+    seed: int = 0
+
+
+@dataclass
+class GameRecord:
+    """Positions of a game in progress"""
+
+    env: ShogiEnv
+    legal_moves: list[shogi.Move]
+    observations: list[np.array] = field(default_factory=list)
+    masks: list[np.array] = field(default_factory=list)
+    actions: list[int] = field(default_factory=list)
+    turns: list[int] = field(default_factory=list)
+
+
+class ShardWriter:
+    """Buffers positions and writes them to numbered compressed shards"""
+
+    def __init__(self, output: str, prefix: str, shard_size: int):
+        self.output = output
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shards = 0
+        self.positions = 0
+        self._observations: list[np.array] = []
+        self._masks: list[np.array] = []
+        self._actions: list[int] = []
+        self._outcomes: list[int] = []
+        self._last: list[bool] = []
+        os.makedirs(output, exist_ok=True)
+
+    def add_game(self, record: GameRecord, winner: int | None):
+        """Add the positions of a finished game, writing full shards"""
+        for observation, mask, action, turn in zip(
+            record.observations, record.masks, record.actions, record.turns
+        ):
+            self._observations.append(observation)
+            self._masks.append(mask)
+            self._actions.append(action)
+            self._outcomes.append(0 if winner is None else 1 if turn == winner else -1)
+            self._last.append(False)
+        self._last[-1] = True
+        if len(self._actions) >= self.shard_size:
+            self._write()
+
+    def close(self):
+        """Write the remaining positions"""
+        if self._actions:
+            self._write()
+
+    def _write(self):
+        """Write the buffered positions as the next shard"""
+        offsets = np.zeros(len(self._masks) + 1, dtype=np.int64)
+        np.cumsum([len(mask) for mask in self._masks], out=offsets[1:])
+        path = os.path.join(self.output, f"{self.prefix}-{self.shards:05d}.npz")
+        np.savez_compressed(
+            path,
+            observations=np.stack(self._observations),
+            mask_offsets=offsets,
+            mask_indices=np.concatenate(self._masks).astype(np.int16),
+            actions=np.array(self._actions, dtype=np.int16),
+            outcomes=np.array(self._outcomes, dtype=np.int8),
+            last=np.array(self._last),
+        )
+        self.shards += 1
+        self.positions += len(self._actions)
+        for buffer in (
+            self._observations,
+            self._masks,
+            self._actions,
+            self._outcomes,
+            self._last,
+        ):
+            buffer.clear()
+
+
+def load_shard(path: str) -> dict[str, np.array]:
+    """Load the arrays of a shard"""
+    with np.load(path) as shard:
+        return dict(shard)
+
+
+def choose_actions(
+    agent: ShogiAgent, games: list[GameRecord], epsilon: float, rng: random.Random
+) -> list[int]:
+    """
+    Get the move index of every game, from one batched forward pass. With
+    probability epsilon a random legal move is played instead.
+    """
+    observations = np.stack([game.observations[-1] for game in games])
+    masks = np.zeros((len(games), ACTIONS), dtype=np.float32)
+    for row, game in enumerate(games):
+        masks[row, game.masks[-1]] = 1
+    chosen = agent.evaluate_batch(observations, masks)
+    return [
+        int(rng.choice(game.masks[-1])) if rng.random() < epsilon else int(index)
+        for game, index in zip(games, chosen)
+    ]
+
+
+def new_game(config: SelfPlayConfig) -> GameRecord:
+    """Start a game and record its first position"""
+    env = ShogiEnv(config.max_plies)
+    _, info = env.reset()
+    game = GameRecord(env, info["legal_moves"])
+    record_position(game)
+    return game
+
+
+def record_position(game: GameRecord):
+    """Record the position to move in"""
+    game.observations.append(ObservationEncoder.pack(game.env.board))
+    game.masks.append(move_indices(game.legal_moves))
+    game.turns.append(game.env.board.turn)
+
+
+def run_worker(worker: int, config: SelfPlayConfig) -> (int, int):
+    """
+    Play config.games games, config.concurrent_games at a time, and write their
+    positions to shards. Get the number of games and positions played.
+    """
+    torch.set_num_threads(1)
+    rng = random.Random(config.seed * 1000 + worker)
+    agent = ShogiAgent(config.model, architecture=config.architecture)
+    writer = ShardWriter(config.output, f"worker-{worker:03d}", config.shard_size)
+
+    started = 0
+    in_flight: list[GameRecord] = []
+    while in_flight or started < config.games:
+        while len(in_flight) < config.concurrent_games and started < config.games:
+            in_flight.append(new_game(config))
+            started += 1
+
+        actions = choose_actions(agent, in_flight, config.epsilon, rng)
+        still_playing = []
+        for game, action in zip(in_flight, actions):
+            game.actions.append(action)
+            _, _, terminated, truncated, info = game.env.step(MOVES[action])
+            if terminated or truncated:
+                writer.add_game(game, info["winner"])
+                continue
+            game.legal_moves = info["legal_moves"]
+            record_position(game)
+            still_playing.append(game)
+        in_flight = still_playing
+
+    writer.close()
+    return started, writer.positions
+
+
+def self_play(config: SelfPlayConfig, workers: int) -> (int, int):
+    """
+    Split the games over worker processes. Get the total number of games and
+    positions played.
+    """
+    games = [
+        config.games // workers + (i < config.games % workers) for i in range(workers)
+    ]
+    configs = [SelfPlayConfig(**{**config.__dict__, "games": count}) for count in games]
+    # Spawned workers do not inherit the torch thread pools of the parent
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as pool:
+        results = list(pool.map(run_worker, range(workers), configs))
+    return sum(result[0] for result in results), sum(result[1] for result in results)
+
+
+def main():
+    """Generate self-play shards"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument(
+        "--architecture", default=MODEL_ARCHITECTURE, choices=ARCHITECTURES
+    )
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--games", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--concurrent-games", type=int, default=32)
+    parser.add_argument("--epsilon", type=float, default=0.1)
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES)
+    parser.add_argument("--shard-size", type=int, default=4096)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = SelfPlayConfig(
+        model=args.model,
+        architecture=args.architecture,
+        output=args.output,
+        games=args.games,
+        concurrent_games=args.concurrent_games,
+        epsilon=args.epsilon,
+        max_plies=args.max_plies,
+        shard_size=args.shard_size,
+        seed=args.seed,
+    )
+    start = time.perf_counter()
+    games, positions = self_play(config, args.workers)
+    seconds = time.perf_counter() - start
+    print(
+        f"{games} games, {positions} positions in {seconds:.1f}s: "
+        f"{games / seconds:.2f} games/s, {positions / seconds:.0f} positions/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
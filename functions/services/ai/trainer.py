@@ -0,0 +1,229 @@
+"""
+Train the DQN on replay data. Batches are sampled from a replay buffer by
+DataLoader worker processes, the loss is the Huber loss between the Q value of
+the move played and its one step target from a periodically synced target
+network. As the players alternate, the target of a move is the negated best
+value of the opponent in the next position, or the game outcome after the last
+move.
+
+The model is checkpointed atomically as a plain state dict, so checkpoints load
+with ShogiAgent.get_model. The optimizer state and step count are kept in
+local/training/{checkpoint name}.train.pt, to resume training. It is several
+times the size of the model, so it is kept out of model/, which is deployed
+with the functions. Trained models are copied to model/ by hand to serve them.
+
+Usage:
+    python -m services.ai.trainer --replay local/replay \\
+        --shards "local/self-play/*.npz" --checkpoint local/models/shogi-agent.pth
+"""
+
+import argparse
+import copy
+import glob
+import os
+import time
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from services.ai.deep_q_network import ARCHITECTURES
+from services.ai.replay_buffer import ReplayBatch, ReplayBuffer, ReplayConfig
+from services.ai.self_play import load_shard
+
+# Directory of the optimizer states, outside the deployed model directory
+TRAINING_DIRECTORY = "local/training"
+
+
+# pylint: disable-next=abstract-method,too-few-public-methods
+class ReplayDataset(IterableDataset):
+    """
+    Endless stream of uniformly sampled batches. Every DataLoader worker opens
+    the buffer itself and samples with its own seed.
+    """
+
+    def __init__(self, directory: str, batch_size: int, seed: int):
+        super().__init__()
+        self.directory = directory
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def __iter__(self):
+        worker = get_worker_info()
+        seed = self.seed if worker is None else self.seed + 1 + worker.id
+        buffer = ReplayBuffer(self.directory, ReplayConfig(seed=seed))
+        while True:
+            # Batches in flight between processes can not share their memory
+            yield buffer.sample(ReplayBatch.allocate(self.batch_size))
+
+
+def training_state_path(checkpoint: str) -> str:
+    """Get the path of the optimizer state of a checkpoint"""
+    root, _ = os.path.splitext(os.path.basename(checkpoint))
+    return os.path.join(TRAINING_DIRECTORY, f"{root}.train.pt")
+
+
+def save_atomic(state: dict, path: str):
+    """Save to a temporary file and rename it, so readers never see half a file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = f"{path}.tmp"
+    torch.save(state, temporary)
+    os.replace(temporary, path)
+
+
+def save_checkpoint(
+    path: str, network: nn.Module, optimizer: torch.optim.Optimizer, step: int
+):
+    """Save the model, then the optimizer state it belongs to"""
+    save_atomic(network.state_dict(), path)
+    save_atomic(
+        {"optimizer": optimizer.state_dict(), "step": step},
+        training_state_path(path),
+    )
+
+
+def trainable_network(architecture: str, state_dict: dict | None) -> nn.Module:
+    """
+    Create a model with promotion planes from the checkpoint. The output layer
+    of a checkpoint without promotion planes is repeated for the promotion
+    plane, as the PromotionShim does at inference.
+    """
+    model_class = ARCHITECTURES[architecture]
+    network = model_class(promotions=True)
+    if state_dict is None:
+        return network
+
+    state_dict = dict(state_dict)
+    output_layer = model_class.OUTPUT_LAYER.rsplit(".", 1)[0]
+    for key in (f"{output_layer}.weight", f"{output_layer}.bias"):
+        if state_dict[key].shape[0] == model_class.PLANE_SIZE:
+            state_dict[key] = torch.cat([state_dict[key], state_dict[key]])
+    network.load_state_dict(state_dict)
+    return network
+
+
+def td_loss(
+    network: nn.Module,
+    target_network: nn.Module,
+    batch: ReplayBatch,
+    discount: float,
+    memory_format: torch.memory_format,
+) -> torch.Tensor:
+    """
+    Huber loss between the values of the moves played and their targets,
+    weighted by the importance sampling weights of the batch.
+    """
+    observations = batch.observations.to(memory_format=memory_format)
+    values = network(observations).gather(1, batch.actions[:, None])[:, 0]
+    with torch.no_grad():
+        next_observations = batch.next_observations.to(memory_format=memory_format)
+        next_values = target_network(next_observations)
+        next_values = next_values.masked_fill(~batch.next_masks, -torch.inf)
+        best_next = next_values.max(1)[0]
+        targets = torch.where(batch.last, batch.outcomes, -discount * best_next)
+    losses = nn.functional.smooth_l1_loss(values, targets, reduction="none")
+    return (losses * batch.weights).mean()
+
+
+def prepare_buffer(args: argparse.Namespace):
+    """Create the replay buffer if needed, and add the self-play shards to it"""
+    buffer = ReplayBuffer(args.replay, ReplayConfig(capacity=args.capacity))
+    paths = sorted(glob.glob(args.shards)) if args.shards else []
+    for path in paths:
+        buffer.add_shard(load_shard(path))
+    buffer.flush()
+    print(f"Replay buffer holds {len(buffer)} positions, added {len(paths)} shards")
+    if len(buffer) == 0:
+        raise SystemExit("The replay buffer is empty")
+
+
+def train(args: argparse.Namespace):
+    """
+    Train the network, resuming from the checkpoint and its training state
+    when they exist.
+    """
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    memory_format = (
+        torch.channels_last if args.channels_last else torch.contiguous_format
+    )
+    prepare_buffer(args)
+
+    state_dict = None
+    if os.path.isfile(args.checkpoint):
+        state_dict = torch.load(args.checkpoint, map_location="cpu")
+    network = trainable_network(args.architecture, state_dict)
+    network = network.to(memory_format=memory_format)
+    target_network = copy.deepcopy(network).eval()
+    optimizer = torch.optim.Adam(network.parameters(), lr=args.learning_rate)
+
+    step = 0
+    if state_dict is not None and os.path.isfile(training_state_path(args.checkpoint)):
+        training_state = torch.load(training_state_path(args.checkpoint))
+        optimizer.load_state_dict(training_state["optimizer"])
+        step = training_state["step"]
+        print(f"Resuming from step {step}")
+
+    loader = DataLoader(
+        ReplayDataset(args.replay, args.batch_size, args.seed + step),
+        batch_size=None,
+        num_workers=args.workers,
+        persistent_workers=args.workers > 0,
+    )
+    network.train()
+    last_log, last_step = time.perf_counter(), step
+    for batch in loader:
+        if step >= args.steps:
+            break
+        loss = td_loss(network, target_network, batch, args.discount, memory_format)
+        optimizer.zero_grad()
+        loss.backward()
+        nn.utils.clip_grad_norm_(network.parameters(), args.max_grad_norm)
+        optimizer.step()
+        step += 1
+
+        if step % args.target_sync == 0:
+            target_network.load_state_dict(network.state_dict())
+        if step % args.checkpoint_every == 0 or step == args.steps:
+            save_checkpoint(args.checkpoint, network, optimizer, step)
+        if step % args.log_every == 0:
+            now = time.perf_counter()
+            steps_per_second = (step - last_step) / (now - last_log)
+            print(
+                f"step {step}: loss {loss.item():.4f}, {steps_per_second:.2f} steps/s, "
+                f"{steps_per_second * args.batch_size:.0f} samples/s"
+            )
+            last_log, last_step = now, step
+    print(f"Saved {args.architecture} model to {args.checkpoint}")
+
+
+def main():
+    """Parse the arguments and run the training"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--replay", required=True)
+    parser.add_argument("--shards", help="glob of self-play shards to add first")
+    parser.add_argument("--capacity", type=int, default=1 << 20)
+    parser.add_argument(
+        "--checkpoint",
+        required=True,
+        help="model to resume and save, copy it to model/ to serve it",
+    )
+    parser.add_argument("--architecture", default="dqn", choices=ARCHITECTURES)
+    parser.add_argument("--steps", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--learning-rate", type=float, default=1e-4)
+    parser.add_argument("--discount", type=float, default=0.99)
+    parser.add_argument("--max-grad-norm", type=float, default=1.0)
+    parser.add_argument("--target-sync", type=int, default=500)
+    parser.add_argument("--checkpoint-every", type=int, default=1000)
+    parser.add_argument("--log-every", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    train(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
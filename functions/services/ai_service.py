@@ -1,35 +1,108 @@
 """Management class for the AI related functionalities"""
 
+import logging
+
 import gymnasium as gym
 import shogi
 
+from config import (
+    BATCH_INFERENCE,
+    INFERENCE_BACKEND,
+    MODEL_ARCHITECTURE,
+    MODEL_PATH,
+    SEARCH_TIME_MS,
+)
 from repository.dataclasses.game import Game
 from services.ai.agent import ShogiAgent
+from services.ai.batching import get_scheduler
+from services.ai.book import get_position_cache
 from services.ai.environment import ShogiEnv
+from services.ai.registry import registry
+from services.ai.search import SearchEngine
+from services.board import restore_snapshot
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ENV_ID = "Shogi-v0"
+
+if ENV_ID not in gym.registry:
+    gym.register(id=ENV_ID, entry_point="services.ai.environment:ShogiEnv")
 
 
 class AiService:
     """Management class for the AI related functionalities"""
 
-    def __init__(self):
-        gym.register(id="Shogi-v0", entry_point="services.ai.environment:ShogiEnv")
-        self.env: ShogiEnv = gym.make("Shogi-v0")
+    def __init__(
+        self, batched: bool = BATCH_INFERENCE, search_time: float = SEARCH_TIME_MS
+    ):
+        self.env: ShogiEnv = gym.make(ENV_ID)
         self.env.reset()
-        self.agent = ShogiAgent(path="model/shogi-agent.pth")
+        # The network is loaded once per process and shared between requests
+        network = registry.get(MODEL_PATH, MODEL_ARCHITECTURE, INFERENCE_BACKEND)
+        self.agent = ShogiAgent(network=network)
+        if batched:
+            # Concurrent requests on the same network share forward passes
+            self.agent.scheduler = get_scheduler(id(network), self.agent.evaluate_batch)
+        # Opening book and recently answered positions, shared by the process
+        self.position_cache = get_position_cache()
+        # Search ahead within the time budget in milliseconds, instead of playing
+        # the network greedily
+        self.search_engine = None
+        if search_time > 0:
+            self.search_engine = SearchEngine(
+                self.agent, time_budget=search_time / 1000
+            )
 
     def setup_game(self, game: Game):
-        """Update the env based on the game settings"""
-        for move in game.moves:
-            move = self.dict_to_move(
-                self.env.board,
-                move["from_square"],
-                move["to_square"],
-                move["promotion"],
-            )
-            self.env.board.push(move)
+        """
+        Update the env based on the game settings. The stored snapshot is used
+        when there is one, otherwise all moves are replayed.
+        """
+        with tracer.stage("ai.setup", ply=game.move_count) as stage:
+            if game.sfen is not None:
+                stage.set(mode="snapshot")
+                restore_snapshot(self.env.unwrapped.board, game.sfen, game.repetitions)
+                return
+
+            stage.set(mode="replay")
+            for move in game.moves:
+                move = self.dict_to_move(
+                    self.env.board,
+                    move["from_square"],
+                    move["to_square"],
+                    move["promotion"],
+                )
+                self.env.board.push(move)
 
     def make_move(self) -> shogi.Move:
-        """Have the AI make a move"""
+        """
+        Have the AI make a move. Positions from the opening book or answered
+        recently are played from the cache, without running the network.
+        """
+        with tracer.stage("ai.choose") as stage:
+            key, move = self.position_cache.get(self.env.unwrapped.board)
+            stage.set(cached=move is not None)
+            if move is None:
+                move = self._choose_move()
+                self.position_cache.put(key, move)
+            return move
+
+    def _choose_move(self) -> shogi.Move:
+        """Have the network, or the search over it, choose a move"""
+        if self.search_engine is not None:
+            with tracer.stage("ai.search") as stage:
+                result = self.search_engine.search(self.env.unwrapped.board)
+                stage.set(depth=result.depth, nodes=result.nodes)
+            logger.info(
+                "Searched depth %d, %d nodes in %.3fs (%.0f nodes/s)",
+                result.depth,
+                result.nodes,
+                result.seconds,
+                result.nodes_per_second,
+            )
+            return result.move
+
         action, _ = self.agent.select_action(self.env)
         return action
 
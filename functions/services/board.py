@@ -1,15 +1,89 @@
 """Class to manage the Shogi board"""
 
+import collections
+import struct
+
 import shogi
-from shogi import Piece
+from shogi import PIECE_SYMBOLS, Piece
+from config import BOARD_BACKEND
 from services.board_info import SQUARES, SQUARE_NAMES, COLORS
 
+# Flags of a to square in the legal move map
+NON_PROMOTION, PROMOTION = 1, 2
+
+# From squares of drops, the piece and *
+DROP_ORIGINS = tuple(f"{symbol}*" for symbol in "PLNSGBR")
+
+# Board implementations that can be selected by name, "position" is the array
+# backed move generator of services.position
+BOARD_BACKENDS = ("python-shogi", "position")
+
+# Piece types in hand from rook to pawn, as listed in sfen
+HAND_PIECE_TYPES = (
+    shogi.ROOK,
+    shogi.BISHOP,
+    shogi.GOLD,
+    shogi.SILVER,
+    shogi.KNIGHT,
+    shogi.LANCE,
+    shogi.PAWN,
+)
+
+
+def new_board(backend: str = BOARD_BACKEND) -> shogi.Board:
+    """Create a board in the starting position with the selected implementation"""
+    if backend not in BOARD_BACKENDS:
+        raise ValueError(f"Unknown board backend {backend}")
+    if backend == "position":
+        # Its move tables take tens of milliseconds to build, so endpoints only
+        # pay for them when the backend is selected
+        # pylint: disable-next=import-outside-toplevel
+        from services.position import Position
+
+        return Position()
+    return shogi.Board()
+
+
+def move_origin(move: shogi.Move) -> str:
+    """Get the from square of a move, or the piece and * of a drop"""
+    if move.from_square is None:
+        return PIECE_SYMBOLS[move.drop_piece_type].upper() + "*"
+    return SQUARE_NAMES[move.from_square]
+
+
+def is_irreversible(board: shogi.Board, move: shogi.Move) -> bool:
+    """
+    Whether the move is a capture, a drop or a pawn move, after which no earlier
+    position of the game can occur again
+    """
+    return (
+        move.from_square is None
+        or board.piece_at(move.to_square) is not None
+        or board.piece_type_at(move.from_square) == shogi.PAWN
+    )
+
+
+def restore_snapshot(board: shogi.Board, sfen: str, repetitions: bytes | None = None):
+    """
+    Restore a board from a sfen snapshot, and the positions that can still
+    repeat when they are known, see ShogiBoard.get_repetitions. Without them,
+    repetitions are only counted from the snapshot on.
+    """
+    board.set_sfen(sfen)
+    if repetitions:
+        board.transpositions = collections.Counter(
+            zobrist_hash for (zobrist_hash,) in struct.iter_unpack("<Q", repetitions)
+        )
+
 
 class ShogiBoard:
     """Class to manage the Shogi board"""
 
     def __init__(self):
-        self.board = shogi.Board()
+        self.board = new_board()
+        # Zobrist hashes of the positions since the last capture, drop or pawn
+        # move, the only ones that can occur again
+        self.repetitions = collections.Counter(self.board.transpositions)
 
     def get_board(self):
         """Get board in format that front end can use"""
@@ -25,14 +99,34 @@ class ShogiBoard:
 
         bitboard = [bitboard[i : i + 9] for i in range(0, len(bitboard), 9)]
 
+        # Hands are listed from rook to pawn, as in sfen
         for color in COLORS:
-            for piece_type, piece_count in self.board.pieces_in_hand[color].items():
-                for i in range(piece_count):
-                    piece = Piece(piece_type, color)
-                    pieces_in_hand.append(piece.symbol())
+            hand = self.board.pieces_in_hand[color]
+            for piece_type in HAND_PIECE_TYPES:
+                symbol = Piece(piece_type, color).symbol()
+                pieces_in_hand.extend([symbol] * hand[piece_type])
 
         return (bitboard, pieces_in_hand)
 
+    def get_snapshot(self) -> (str, int, int):
+        """Get the sfen, move number and side to move of the current position"""
+        return (self.board.sfen(), self.board.move_number, self.board.turn)
+
+    def get_repetitions(self) -> bytes:
+        """
+        Get the Zobrist hashes of the positions since the last capture, drop or
+        pawn move, packed in little endian 64 bit words, once per occurrence.
+        They are stored with the snapshot, as the sfen has no history to detect
+        fourfold repetition with.
+        """
+        hashes = list(self.repetitions.elements())
+        return struct.pack(f"<{len(hashes)}Q", *hashes)
+
+    def set_snapshot(self, sfen: str, repetitions: bytes | None = None):
+        """Restore the board from a sfen snapshot, see restore_snapshot"""
+        restore_snapshot(self.board, sfen, repetitions)
+        self.repetitions = collections.Counter(self.board.transpositions)
+
     @staticmethod
     def _square_to_index(square):
         """Get the index of the specified square"""
@@ -42,33 +136,85 @@ class ShogiBoard:
         rank = ranks.index(square[1])  # Convert rank to index
         return rank * 9 + file
 
-    def make_move(self, from_square: str, to_square: str, promote: bool):
-        """Make a new move in a game"""
+    def get_move(self, from_square: str, to_square: str, promote: bool) -> shogi.Move:
+        """
+        Get the move between the squares, promoting when it is asked and allowed.
+        Drops come from the piece and *, as in the legal move map. Raises
+        ValueError when a square does not exist or there is no piece to move.
+        """
+        if to_square not in SQUARE_NAMES or (
+            from_square not in SQUARE_NAMES and from_square not in DROP_ORIGINS
+        ):
+            raise ValueError(f"Invalid move from {from_square!r} to {to_square!r}")
         move = from_square + to_square
-        piece_type = self.board.piece_at(self._square_to_index(from_square)).piece_type
+        if from_square in DROP_ORIGINS:
+            return shogi.Move.from_usi(move)
+        piece = self.board.piece_at(self._square_to_index(from_square))
+        if piece is None:
+            raise ValueError(f"No piece on {from_square}")
+        piece_type = piece.piece_type
         can_promote = shogi.can_promote(
             self._square_to_index(to_square), piece_type, self.board.turn
         )
         if promote and can_promote:
             move += "+"
 
-        self.board.push(shogi.Move.from_usi(move))
-        return self.get_board()
-
-    def get_legal_moves(self, from_square):
-        """Get all the legal moves"""
-        piece_legal_moves = []
-
+        return shogi.Move.from_usi(move)
+
+    def push(self, move: shogi.Move) -> dict:
+        """
+        Make the move, and get the squares and pieces in hand it changed. The
+        squares map to their new piece symbol or None, the hand pieces to the
+        change of their count.
+        """
+        color = self.board.turn
+        captured = self.board.piece_at(move.to_square)
+        if is_irreversible(self.board, move):
+            self.repetitions.clear()
+        self.board.push(move)
+        self.repetitions[self.board.zobrist_hash()] += 1
+
+        to_square = SQUARE_NAMES[move.to_square]
+        squares = {to_square: self.board.piece_at(move.to_square).symbol()}
+        hands = {}
+        if move.from_square is None:
+            hands[Piece(move.drop_piece_type, color).symbol()] = -1
+        else:
+            squares[SQUARE_NAMES[move.from_square]] = None
+        if captured:
+            # The captured piece goes to the hand of the mover, unpromoted
+            hands[captured.symbol().lstrip("+").swapcase()] = 1
+        return {"squares": squares, "hands": hands}
+
+    def make_move(self, from_square: str, to_square: str, promote: bool) -> dict:
+        """Make a new move in a game, and get the changes of the board"""
+        return self.push(self.get_move(from_square, to_square, promote))
+
+    def get_legal_move_map(self) -> dict[str, dict[str, int]]:
+        """
+        Get the legal moves of the whole position, keyed by from square, or by
+        piece and * for drops, and then by to square. The value of a to square
+        has the NON_PROMOTION and PROMOTION flags of the moves that reach it.
+        """
+        legal_move_map = {}
         for move in self.board.legal_moves:
-            if from_square == move.usi()[:2]:
-                piece_legal_moves.append(move.usi()[2:])
-
-        board_builder = []
-
-        for square in SQUARE_NAMES:
-            if square in piece_legal_moves:
-                board_builder.append(square)
-            else:
-                board_builder.append(None)
+            targets = legal_move_map.setdefault(move_origin(move), {})
+            to_square = SQUARE_NAMES[move.to_square]
+            flag = PROMOTION if move.promotion else NON_PROMOTION
+            targets[to_square] = targets.get(to_square, 0) | flag
+        return legal_move_map
+
+    def get_legal_moves(self, from_square, legal_move_map=None):
+        """
+        Get all the legal moves, from the legal move map of the position when
+        it is known
+        """
+        if legal_move_map is None:
+            legal_move_map = self.get_legal_move_map()
+        targets = legal_move_map.get(from_square, {})
+
+        board_builder = [
+            square if square in targets else None for square in SQUARE_NAMES
+        ]
 
         return [board_builder[i : i + 9] for i in range(0, len(board_builder), 9)]
@@ -0,0 +1,59 @@
+"""Per process container of the long lived dependencies of the endpoints"""
+
+import contextlib
+import logging
+import threading
+import time
+from collections.abc import Iterator
+
+from repository.game_repository import GameRepository
+from services.game import GameService
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """
+    Per process container of the long lived dependencies of the endpoints. The
+    Firestore client, and with it its gRPC channel, is created once and shared
+    by all requests, while every request gets its own GameService with its own
+    board state.
+    """
+
+    def __init__(self, app: any, game_repository: GameRepository | None = None):
+        self.app: any = app
+        self._game_repository: GameRepository | None = game_repository
+        self._lock = threading.Lock()
+
+    @property
+    def game_repository(self) -> GameRepository:
+        """The shared game repository, created on first use"""
+        if self._game_repository is None:
+            with self._lock:
+                if self._game_repository is None:
+                    self._game_repository = GameRepository(self.app)
+        return self._game_repository
+
+    @contextlib.contextmanager
+    def game_service(self, endpoint: str) -> Iterator[GameService]:
+        """
+        Get a GameService for one request, and log how much of the request went
+        to setting up its dependencies and how much to the actual work. The
+        request is the outermost traced stage, named after the endpoint.
+        """
+        start = time.perf_counter()
+        service = GameService(self.app, self.game_repository)
+        service.setup_seconds += time.perf_counter() - start
+        try:
+            with tracer.stage(endpoint):
+                yield service
+        finally:
+            total = time.perf_counter() - start
+            logger.info(
+                "%s took %.1fms: setup %.1fms, work %.1fms",
+                endpoint,
+                total * 1000,
+                service.setup_seconds * 1000,
+                (total - service.setup_seconds) * 1000,
+            )
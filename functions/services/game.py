@@ -1,92 +1,351 @@
 """Service to manage the game state"""
 
+import logging
+import time
+from typing import TYPE_CHECKING
+
+import shogi
 from firebase_functions.https_fn import FunctionsErrorCode, HttpsError
 
-from repository.dataclasses.game import Game
-from repository.game_repository import GameRepository
-from services.ai_service import AiService
-from services.board import ShogiBoard
+from config import ASYNC_AI, VERIFY_REPLAY
+from repository.dataclasses.game import AI_FAILED, AI_PENDING, VERBOSE_FORMAT, Game
+from repository.game_repository import ConcurrentUpdateError, GameRepository
+from services.board import ShogiBoard, move_origin
+from services.tracing import payload_size, tracer
+
+if TYPE_CHECKING:
+    # Imported on first use, so endpoints without AI moves never load torch
+    from services.ai_service import AiService
+
+logger = logging.getLogger(__name__)
+
+# The player plays black, and the AI replies with white
+AI_COLOR = shogi.WHITE
 
 
 class GameService:
     """Service to manage the game state"""
 
-    def __init__(self, app: any):
+    def __init__(
+        self,
+        app: any,
+        game_repository: GameRepository | None = None,
+        async_ai: bool = ASYNC_AI,
+    ):
         self.app: any = app
         self.shogi_board = ShogiBoard()
-        self.game_repository = GameRepository(self.app)
-        self.ai_service = AiService()
+        self.game_repository = game_repository or GameRepository(self.app)
+        # Queue AI moves for the worker, see complete_ai_move
+        self.async_ai = async_ai
+        self._ai_service: "AiService | None" = None
+        # Time spent creating dependencies, rather than handling the request
+        self.setup_seconds = 0.0
+
+    @property
+    def ai_service(self) -> "AiService":
+        """
+        The AI service, created on first use as most requests do not need it.
+        Its module imports torch and gymnasium, which takes seconds on a cold
+        start, so it is imported here as well.
+        """
+        if self._ai_service is None:
+            start = time.perf_counter()
+            with tracer.stage("ai.load"):
+                # pylint: disable-next=import-outside-toplevel
+                from services.ai_service import AiService
+
+                self._ai_service = AiService()
+            self.setup_seconds += time.perf_counter() - start
+        return self._ai_service
 
     def create(self) -> str:
         """Initialize new game"""
-        bitboard, pieces_in_hand = self.shogi_board.get_board()
-        game = Game(moves=[], board=bitboard, pieces_in_hand=pieces_in_hand)
-        self.game_repository.create(game)
+        game = Game(moves=[], board=[], pieces_in_hand=[])
+        self._update_game(game)
+        with tracer.stage("firestore.set") as stage:
+            self.game_repository.create(game)
+            self._trace_document(stage, game)
         return game.uid
 
-    def ai_move(self, uid: str):
-        """Add a new move to the game"""
+    def ai_move(self, uid: str, version: int | None = None) -> dict:
+        """
+        Add a new move to the game, or queue it for the worker. Get the changes
+        of the position since the client's version, see _position_update.
+        """
         game = self._get_game(uid)
+        if self.shogi_board.board.is_game_over():
+            raise HttpsError(
+                code=FunctionsErrorCode.FAILED_PRECONDITION,
+                message="The game is over",
+            )
+        last_moves = []
+        if self.async_ai:
+            # The worker can only play the AI's side, the sync AI move can also
+            # play for the player
+            self._check_not_pending(game)
+            if self.shogi_board.board.turn != AI_COLOR:
+                raise HttpsError(
+                    code=FunctionsErrorCode.FAILED_PRECONDITION,
+                    message="It is not the AI's turn",
+                )
+            game.ai_status = AI_PENDING
+        else:
+            last_moves.append(self._play_ai_move(game))
+            game.ai_status = None
 
-        # Have ai make a move
-        self.ai_service.setup_game(game)
-        new_move = self.ai_service.make_move()
+        # Save new game state to database
+        self._save_game(game)
+        return self._position_update(game, version, last_moves)
 
-        # Update ShogiBoard instance
-        self.shogi_board.board.push(new_move)
+    def complete_ai_move(self, uid: str):
+        """
+        Play the queued AI move of the game, if it is still pending. Duplicate
+        deliveries of the trigger lose the move count check and are ignored.
+        """
+        game = self._get_game(uid)
+        if game.ai_status != AI_PENDING:
+            return
 
-        from_square = self._index_to_square(new_move.from_square)
-        to_square = self._index_to_square(new_move.to_square)
+        try:
+            self._play_ai_move(game)
+            game.ai_status = None
+            self._update_stored(game)
+        except ConcurrentUpdateError:
+            logger.info("AI move of game %s was already played", uid)
+        except Exception:
+            # Let the client ask again, instead of waiting for the move forever
+            with tracer.stage("firestore.update_status"):
+                self.game_repository.set_ai_status(uid, AI_FAILED)
+            raise
 
-        # Update game object
-        game.moves.append(
-            {
-                "from_square": from_square,
-                "to_square": to_square,
-                "promotion": new_move.promotion,
-            }
-        )
-        game.board, game.pieces_in_hand = self.shogi_board.get_board()
+    def play_turn(self, uid: str, move: dict, version: int | None = None) -> dict:
+        """
+        Play a full turn with one load and one write: the player's move, and
+        the AI's reply unless the game is over. The move has the from_square,
+        to_square and promotion of a stored move. Get the changes of the
+        position since the client's version, with the moves of this turn, see
+        _position_update. With async AI the reply is queued for the worker
+        instead.
+        """
+        game = self._get_game(uid)
+        self._check_player_to_move(game)
 
-        # Save new game state to database
-        self.game_repository.update(game)
+        last_moves = [self._play_player_move(game, move)]
+        if not self.shogi_board.board.is_game_over():
+            if self.async_ai:
+                game.ai_status = AI_PENDING
+            else:
+                last_moves.append(self._play_ai_move(game))
+
+        self._save_game(game)
+        return self._position_update(game, version, last_moves)
 
-    def make_move(self, uid: str, from_square: str, to_square: str, promotion: bool):
-        """Add a new move to the game"""
+    def make_move(self, uid: str, move: dict, version: int | None = None) -> dict:
+        """
+        Add a new move to the game, with the from_square, to_square and
+        promotion of a stored move. Get the changes of the position since the
+        client's version, see _position_update.
+        """
         # Get game, and the board
         game = self._get_game(uid)
+        self._check_player_to_move(game)
 
-        # Make new move
-        self.shogi_board.make_move(from_square, to_square, promotion)
+        move = self._play_player_move(game, move)
+        self._save_game(game)
+        return self._position_update(game, version, [move])
 
-        # Update game object
-        game.moves.append(
-            {"from_square": from_square, "to_square": to_square, "promotion": promotion}
-        )
-        game.board, game.pieces_in_hand = self.shogi_board.get_board()
-        self.game_repository.update(game)
-
-    def get_legal_moves(self, uid: str, from_square: str):
-        """Get all legal moves for the specified fame, and piece"""
+    def get_legal_moves(self, uid: str, from_square: str | None = None):
+        """
+        Get all legal moves for the specified game, and piece. Without a piece,
+        get the legal move map of the whole position with the move count it is
+        for, which the client fetches once per position as the move endpoints
+        do not send it.
+        """
         # Get game, and the board
-        _ = self._get_game(uid)
-        # Get the legal moves
+        game = self._get_game(uid)
+        if from_square is None:
+            return {
+                "move_count": game.move_count,
+                "legal_moves": self.shogi_board.get_legal_move_map(),
+            }
         return self.shogi_board.get_legal_moves(from_square)
 
-    def _get_game(self, uid: str) -> Game:
-        """Get the selected game and update the board accordingly"""
-        game = self.game_repository.get(uid)
-        if game is None:
+    def _get_game(self, uid: str, verify: bool = VERIFY_REPLAY) -> Game:
+        """
+        Get the selected game and update the board accordingly. The board is
+        restored from the stored snapshot and the positions that can repeat,
+        unless the game has none or verify is set, in which case all moves are
+        replayed.
+        """
+        with tracer.stage("game.load") as stage:
+            with tracer.stage("firestore.get") as get_stage:
+                game = self.game_repository.get(uid)
+                if game is not None:
+                    self._trace_document(get_stage, game)
+            if game is None:
+                raise HttpsError(
+                    code=FunctionsErrorCode.NOT_FOUND,
+                    message="Invalid game id",
+                )
+
+            stage.set(ply=game.move_count)
+            if game.sfen is not None and not verify:
+                stage.set(mode="snapshot")
+                self.shogi_board.set_snapshot(game.sfen, game.repetitions)
+                return game
+
+            stage.set(mode="replay")
+            for move in game.moves:
+                self.shogi_board.make_move(
+                    move["from_square"], move["to_square"], move["promotion"]
+                )
+
+            sfen, _, _ = self.shogi_board.get_snapshot()
+            if game.sfen is not None and game.sfen != sfen:
+                raise HttpsError(
+                    code=FunctionsErrorCode.DATA_LOSS,
+                    message="Game snapshot does not match its moves",
+                )
+            return game
+
+    def _play_player_move(self, game: Game, move: dict) -> dict:
+        """
+        Make the player's move on the board and the game object, if it is
+        legal. Get the move as it is stored.
+        """
+        try:
+            new_move = self.shogi_board.get_move(
+                move["from_square"], move["to_square"], move["promotion"]
+            )
+        except ValueError as error:
             raise HttpsError(
-                code=FunctionsErrorCode.NOT_FOUND,
-                message="Invalid game id",
+                code=FunctionsErrorCode.INVALID_ARGUMENT,
+                message=str(error),
+            ) from error
+        if not self.shogi_board.board.is_legal(new_move):
+            raise HttpsError(
+                code=FunctionsErrorCode.INVALID_ARGUMENT,
+                message="Illegal move",
             )
+        delta = self.shogi_board.push(new_move)
 
-        for move in game.moves:
-            self.shogi_board.make_move(
-                move["from_square"], move["to_square"], move["promotion"]
+        # Update game object
+        move = {
+            "from_square": move["from_square"],
+            "to_square": move["to_square"],
+            "promotion": move["promotion"],
+        }
+        game.moves.append(move)
+        self._update_game(game, delta)
+        return move
+
+    def _play_ai_move(self, game: Game) -> dict:
+        """Have the AI make a move on the board and the game object"""
+        with tracer.stage("ai.move"):
+            self.ai_service.setup_game(game)
+            new_move = self.ai_service.make_move()
+
+        # Update ShogiBoard instance
+        delta = self.shogi_board.push(new_move)
+
+        # Update game object
+        move = {
+            "from_square": move_origin(new_move),
+            "to_square": self._index_to_square(new_move.to_square),
+            "promotion": new_move.promotion,
+        }
+        game.moves.append(move)
+        self._update_game(game, delta)
+        return move
+
+    @staticmethod
+    def _check_not_pending(game: Game):
+        """The player has to wait while an AI move is queued"""
+        if game.ai_status == AI_PENDING:
+            raise HttpsError(
+                code=FunctionsErrorCode.FAILED_PRECONDITION,
+                message="The AI has not made its move yet",
+            )
+
+    @classmethod
+    def _check_player_to_move(cls, game: Game):
+        """
+        The player has to wait while an AI move is queued, and ask for it again
+        when it failed, before making a move
+        """
+        cls._check_not_pending(game)
+        if game.ai_status == AI_FAILED:
+            raise HttpsError(
+                code=FunctionsErrorCode.FAILED_PRECONDITION,
+                message="The AI could not make its move, ask for it again",
+            )
+
+    def _save_game(self, game: Game):
+        """Store the new moves and position of the game"""
+        try:
+            self._update_stored(game)
+        except ConcurrentUpdateError as error:
+            raise HttpsError(
+                code=FunctionsErrorCode.ABORTED,
+                message="The game was changed by another move, reload it",
+            ) from error
+
+    def _update_stored(self, game: Game):
+        """Write the new moves and position of the game to the repository"""
+        with tracer.stage("firestore.update") as stage:
+            self._trace_document(stage, game)
+            self.game_repository.update(game)
+
+    @staticmethod
+    def _position_update(game: Game, version: int | None, last_moves: list) -> dict:
+        """
+        Get the changed squares and hand counts of the game since the client's
+        version, its move count, with the side to move, the AI status and the
+        new moves. Clients with another version, or none, get the whole game
+        instead. The legal move map is not sent, clients fetch it once per
+        position with read_legal_moves.
+        """
+        delta = game.delta or {
+            "version": game.move_count,
+            "base_version": game.move_count,
+            "squares": {},
+            "hands": {},
+        }
+        if version is None or version != delta["base_version"]:
+            game_dict = game.to_dict(VERBOSE_FORMAT)
+            # The packed repetitions only restore the board on the server
+            del game_dict["repetitions"]
+            return {**game_dict, "last_moves": last_moves}
+
+        return {
+            "uid": game.uid,
+            **delta,
+            "move_count": game.move_count,
+            "turn": game.turn,
+            "ai_status": game.ai_status,
+            "last_moves": last_moves,
+        }
+
+    def _update_game(self, game: Game, delta: dict | None = None):
+        """
+        Copy the current board state onto the game object, or only the changes
+        of the last move when they are known
+        """
+        with tracer.stage("game.position"):
+            if delta is None:
+                game.board, game.pieces_in_hand = self.shogi_board.get_board()
+            else:
+                game.apply_delta(delta)
+            game.sfen, game.move_number, game.turn = self.shogi_board.get_snapshot()
+            game.repetitions = self.shogi_board.get_repetitions()
+
+    @staticmethod
+    def _trace_document(stage, game: Game):
+        """Add the move count and document size of the game to a traced stage"""
+        if tracer.enabled:
+            stage.set(
+                moves=game.move_count, document_bytes=payload_size(game.to_dict())
             )
-        return game
 
     @staticmethod
     def _index_to_square(index):
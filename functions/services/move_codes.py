@@ -0,0 +1,28 @@
+"""Compact 16 bit codes for moves"""
+
+import shogi
+
+# The lower 13 bits hold the action index 81 * from + to, where from is the
+# from square, or 81 + piece type - 1 for drops. Bit 13 marks promotions.
+INDEX_MASK = (1 << 13) - 1
+PROMOTION_BIT = 1 << 13
+
+
+def encode_move(move: shogi.Move) -> int:
+    """Get the 16 bit code of a move"""
+    if move.from_square is None:
+        from_index = 81 + move.drop_piece_type - 1
+    else:
+        from_index = move.from_square
+    code = 81 * from_index + move.to_square
+    if move.promotion:
+        code |= PROMOTION_BIT
+    return code
+
+
+def decode_move(code: int) -> shogi.Move:
+    """Get the move of a 16 bit code"""
+    from_index, to_square = divmod(code & INDEX_MASK, 81)
+    if from_index >= 81:
+        return shogi.Move(None, to_square, drop_piece_type=from_index - 81 + 1)
+    return shogi.Move(from_index, to_square, bool(code & PROMOTION_BIT))
@@ -0,0 +1,763 @@
+"""
+Array backed shogi position with a fast legal move generator, a drop-in for
+python-shogi's Board on the serving path.
+
+The board is kept twice: as a list of the 81 piece types, and as 81-bit
+bitboards per piece type and color in the layout of python-shogi, so the
+observation encoder reads both kinds of boards alike. Attacks come from
+precomputed step tables and rays. Legal moves are generated from the checkers
+and pinned pieces of the position, instead of making and unmaking every
+pseudo legal move, and in the same order as python-shogi.
+
+The rules are those of python-shogi, including its check for mate by a dropped
+pawn (uchifuzume): the king escapes when one of its squares is not attacked
+with the king still in place, or when a piece other than the king attacks the
+pawn. Zobrist hashes are python-shogi's, so the opening book and the position
+cache work with both boards.
+"""
+
+import collections
+
+import shogi
+from shogi import (
+    BISHOP,
+    BLACK,
+    GOLD,
+    KING,
+    KNIGHT,
+    LANCE,
+    NONE,
+    PAWN,
+    PIECE_PROMOTED,
+    PIECE_TYPES,
+    PROM_BISHOP,
+    PROM_KNIGHT,
+    PROM_LANCE,
+    PROM_PAWN,
+    PROM_ROOK,
+    PROM_SILVER,
+    ROOK,
+    SILVER,
+    STARTING_SFEN,
+    WHITE,
+    Move,
+    Piece,
+)
+
+BB_ALL = (1 << 81) - 1
+FILES = [sum(1 << (rank * 9 + file) for rank in range(9)) for file in range(9)]
+RANKS = [((1 << 9) - 1) << (rank * 9) for rank in range(9)]
+
+# Promotion zone of each color
+ZONES = [RANKS[0] | RANKS[1] | RANKS[2], RANKS[6] | RANKS[7] | RANKS[8]]
+PROMOTABLE = (PAWN, LANCE, KNIGHT, SILVER, BISHOP, ROOK)
+# Piece type of a piece when it is captured, promoted pieces are demoted
+CAPTURED_TYPES = [
+    PIECE_PROMOTED.index(piece_type) if piece_type >= PROM_PAWN else piece_type
+    for piece_type in range(len(PIECE_PROMOTED))
+]
+# Pieces that can be dropped, in the order python-shogi generates their drops
+DROP_TYPES = (PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK)
+GOLD_MOVERS = (GOLD, PROM_PAWN, PROM_LANCE, PROM_KNIGHT, PROM_SILVER)
+
+# Directions as (rank step, file step), north is towards rank a, where black
+# promotes
+NORTH, SOUTH, WEST, EAST, NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST = range(8)
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+OPPOSITE = [SOUTH, NORTH, EAST, WEST, SOUTH_EAST, SOUTH_WEST, NORTH_EAST, NORTH_WEST]
+ORTHOGONAL = (NORTH, SOUTH, WEST, EAST)
+DIAGONAL = (NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST)
+# The nearest blocker on a ray towards higher squares is its lowest bit
+INCREASING = [rank_step * 9 + file_step > 0 for rank_step, file_step in DIRECTIONS]
+
+
+def _steps(offsets: list[tuple[int, int]]) -> list[int]:
+    """Get the bitboard of the squares reached by the offsets, per square"""
+    table = []
+    for square in range(81):
+        rank, file = divmod(square, 9)
+        bitboard = 0
+        for rank_step, file_step in offsets:
+            if 0 <= rank + rank_step < 9 and 0 <= file + file_step < 9:
+                bitboard |= 1 << ((rank + rank_step) * 9 + file + file_step)
+        table.append(bitboard)
+    return table
+
+
+def _ray(square: int, direction: int) -> int:
+    """Get the squares from the square to the edge of the board, excluding it"""
+    rank_step, file_step = DIRECTIONS[direction]
+    rank, file = divmod(square, 9)
+    bitboard = 0
+    while 0 <= rank + rank_step < 9 and 0 <= file + file_step < 9:
+        rank, file = rank + rank_step, file + file_step
+        bitboard |= 1 << (rank * 9 + file)
+    return bitboard
+
+
+# RAYS[direction][square] are the squares in the direction of the square
+RAYS = [[_ray(square, direction) for square in range(81)] for direction in range(8)]
+
+# Step offsets of black pieces, white ones move the other way
+_KING_OFFSETS = DIRECTIONS
+_OFFSETS = {
+    PAWN: [(-1, 0)],
+    KNIGHT: [(-2, -1), (-2, 1)],
+    SILVER: [(-1, -1), (-1, 0), (-1, 1), (1, -1), (1, 1)],
+    GOLD: [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, 0)],
+    KING: _KING_OFFSETS,
+    PROM_BISHOP: _KING_OFFSETS,
+    PROM_ROOK: _KING_OFFSETS,
+}
+for _piece_type in GOLD_MOVERS:
+    _OFFSETS[_piece_type] = _OFFSETS[GOLD]
+
+# STEPS[color][piece type][square] are the squares a piece reaches in one step
+STEPS = [
+    [
+        _steps(
+            [
+                (rank_step if color == BLACK else -rank_step, file_step)
+                for rank_step, file_step in _OFFSETS.get(piece_type, [])
+            ]
+        )
+        for piece_type in range(PROM_ROOK + 1)
+    ]
+    for color in (BLACK, WHITE)
+]
+# SLIDES[color][piece type] are the directions a piece slides in
+SLIDES = [
+    [
+        {
+            LANCE: (NORTH if color == BLACK else SOUTH,),
+            BISHOP: DIAGONAL,
+            ROOK: ORTHOGONAL,
+            PROM_BISHOP: DIAGONAL,
+            PROM_ROOK: ORTHOGONAL,
+        }.get(piece_type, ())
+        for piece_type in range(PROM_ROOK + 1)
+    ]
+    for color in (BLACK, WHITE)
+]
+KING_STEPS = STEPS[BLACK][KING]
+DIAGONAL_RAYS = [
+    sum(RAYS[direction][square] for direction in DIAGONAL) for square in range(81)
+]
+ORTHOGONAL_RAYS = [
+    sum(RAYS[direction][square] for direction in ORTHOGONAL) for square in range(81)
+]
+
+# UNPROMOTED[color][piece type] are the squares a piece may stay unpromoted on
+UNPROMOTED = [[BB_ALL] * (PROM_ROOK + 1) for _ in (BLACK, WHITE)]
+for _color, _last, _second in ((BLACK, 0, 1), (WHITE, 8, 7)):
+    UNPROMOTED[_color][PAWN] = BB_ALL ^ RANKS[_last]
+    UNPROMOTED[_color][LANCE] = BB_ALL ^ RANKS[_last]
+    UNPROMOTED[_color][KNIGHT] = BB_ALL ^ RANKS[_last] ^ RANKS[_second]
+
+
+def _move_tables() -> (list[Move | None], list[Move | None], list[list[Move]]):
+    """
+    Get the shared move objects: moves and promotions indexed by 81 * from
+    + to, for the squares a piece can reach, and drops by piece type and to.
+    """
+    moves, promotions = [None] * 81 * 81, [None] * 81 * 81
+    for from_square in range(81):
+        targets = (
+            KING_STEPS[from_square]
+            | DIAGONAL_RAYS[from_square]
+            | ORTHOGONAL_RAYS[from_square]
+            | STEPS[BLACK][KNIGHT][from_square]
+            | STEPS[WHITE][KNIGHT][from_square]
+        )
+        while targets:
+            low = targets & -targets
+            to_square = low.bit_length() - 1
+            targets ^= low
+            moves[81 * from_square + to_square] = Move(from_square, to_square)
+            promotions[81 * from_square + to_square] = Move(
+                from_square, to_square, True
+            )
+    drops = [
+        (
+            [
+                Move(None, to_square, drop_piece_type=piece_type)
+                for to_square in range(81)
+            ]
+            if piece_type in DROP_TYPES
+            else None
+        )
+        for piece_type in range(KING)
+    ]
+    return moves, promotions, drops
+
+
+MOVES, PROMOTIONS, DROPS = _move_tables()
+
+# Shared pieces returned by piece_at, by color and piece type
+PIECES = [
+    [None] + [Piece(piece_type, color) for piece_type in PIECE_TYPES]
+    for color in (BLACK, WHITE)
+]
+
+# Zobrist keys of python-shogi
+ZOBRIST = shogi.DEFAULT_RANDOM_ARRAY
+ZOBRIST_WHITE = ZOBRIST[2268]
+
+
+def slide(square: int, direction: int, occupied: int) -> int:
+    """Get the squares a piece on the square slides to, up to the first blocker"""
+    ray = RAYS[direction][square]
+    blockers = ray & occupied
+    if not blockers:
+        return ray
+    if INCREASING[direction]:
+        blocker = (blockers & -blockers).bit_length() - 1
+    else:
+        blocker = blockers.bit_length() - 1
+    return ray ^ RAYS[direction][blocker]
+
+
+def attacks(piece_type: int, square: int, color: int, occupied: int) -> int:
+    """Get the squares a piece of the color attacks from the square"""
+    bitboard = STEPS[color][piece_type][square]
+    for direction in SLIDES[color][piece_type]:
+        bitboard |= slide(square, direction, occupied)
+    return bitboard
+
+
+def nearest(blockers: int, direction: int) -> int:
+    """Get the mask of the blocker nearest to the start of a ray in the direction"""
+    if INCREASING[direction]:
+        return blockers & -blockers
+    return 1 << (blockers.bit_length() - 1) if blockers else 0
+
+
+def line(square: int, other: int) -> int:
+    """
+    Get the squares from the square to the other one, including the other one
+    but not the square itself. Squares that are not aligned only get the other.
+    """
+    for direction in range(8):
+        if RAYS[direction][square] >> other & 1:
+            return RAYS[direction][square] ^ RAYS[direction][other]
+    return 1 << other
+
+
+class Position:
+    """
+    Shogi position with make and unmake of moves. Has the parts of the
+    python-shogi Board interface the game service, the environment and the
+    observation encoder use, and returns the same moves in the same order.
+    """
+
+    def __init__(self, sfen: str | None = None):
+        self.pieces: list[int] = []
+        self.piece_bb: list[int] = []
+        self.occupied: list[int] = []
+        self.pieces_in_hand: list[list[int]] = []
+        self.king_squares: list[int | None] = []
+        self.turn = BLACK
+        self.move_number = 1
+        self.move_stack: list[Move] = []
+        self.captured_piece_stack: list[int] = []
+        self.board_hash = 0
+        self.transpositions = collections.Counter()
+        self.set_sfen(sfen or STARTING_SFEN)
+
+    def clear(self):
+        """Remove every piece, and reset the move stack"""
+        self.pieces = [NONE] * 81
+        self.piece_bb = [0] * (PROM_ROOK + 1)
+        self.occupied = [0, 0]
+        # Index 8 only holds kings captured in illegal positions
+        self.pieces_in_hand = [[0] * (KING + 1), [0] * (KING + 1)]
+        self.king_squares = [None, None]
+        self.turn = BLACK
+        self.move_number = 1
+        self.move_stack = []
+        self.captured_piece_stack = []
+        self.board_hash = 0
+        self.transpositions = collections.Counter()
+
+    def reset(self):
+        """Restore the starting position"""
+        self.set_sfen(STARTING_SFEN)
+
+    def _put(self, square: int, piece_type: int, color: int):
+        """Put a piece on an empty square"""
+        mask = 1 << square
+        self.pieces[square] = piece_type
+        self.piece_bb[piece_type] |= mask
+        self.occupied[color] |= mask
+        self.board_hash ^= ZOBRIST[81 * (2 * piece_type - 2 + color) + square]
+        if piece_type == KING:
+            self.king_squares[color] = square
+
+    def _remove(self, square: int, piece_type: int, color: int):
+        """Remove the piece on the square"""
+        mask = 1 << square
+        self.pieces[square] = NONE
+        self.piece_bb[piece_type] ^= mask
+        self.occupied[color] ^= mask
+        self.board_hash ^= ZOBRIST[81 * (2 * piece_type - 2 + color) + square]
+        if piece_type == KING:
+            self.king_squares[color] = None
+
+    def piece_at(self, square: int) -> Piece | None:
+        """Get the piece on the square"""
+        piece_type = self.pieces[square]
+        if not piece_type:
+            return None
+        return PIECES[self.occupied[WHITE] >> square & 1][piece_type]
+
+    def piece_type_at(self, square: int) -> int:
+        """Get the type of the piece on the square"""
+        return self.pieces[square]
+
+    def zobrist_hash(self) -> int:
+        """Get the python-shogi Zobrist hash of the position"""
+        zobrist_hash = self.board_hash
+        if self.turn == WHITE:
+            zobrist_hash ^= ZOBRIST_WHITE
+        hand = self.pieces_in_hand[BLACK]
+        counts = (
+            hand[ROOK] * 35625
+            + hand[BISHOP] * 11875
+            + hand[GOLD] * 2375
+            + hand[SILVER] * 475
+            + hand[KNIGHT] * 95
+            + hand[LANCE] * 19
+            + hand[PAWN]
+        )
+        while counts:
+            low = counts & -counts
+            zobrist_hash ^= ZOBRIST[2268 + low.bit_length()]
+            counts ^= low
+        return zobrist_hash
+
+    def attackers(self, square: int, color: int, occupied: int, kings=True) -> int:
+        """
+        Get the pieces of the color that attack the square, with the occupied
+        squares specified, optionally leaving out the king.
+        """
+        bb = self.piece_bb
+        own = self.occupied[color]
+        other = color ^ 1
+        steps = STEPS[other]
+        found = (
+            steps[PAWN][square] & bb[PAWN]
+            | steps[KNIGHT][square] & bb[KNIGHT]
+            | steps[SILVER][square] & bb[SILVER]
+            | steps[GOLD][square]
+            & (
+                bb[GOLD]
+                | bb[PROM_PAWN]
+                | bb[PROM_LANCE]
+                | bb[PROM_KNIGHT]
+                | bb[PROM_SILVER]
+            )
+            | KING_STEPS[square]
+            & (bb[PROM_BISHOP] | bb[PROM_ROOK] | (bb[KING] if kings else 0))
+        ) & own
+        diagonal = (bb[BISHOP] | bb[PROM_BISHOP]) & own & DIAGONAL_RAYS[square]
+        if diagonal:
+            for direction in DIAGONAL:
+                found |= slide(square, direction, occupied) & diagonal
+        orthogonal = (bb[ROOK] | bb[PROM_ROOK]) & own & ORTHOGONAL_RAYS[square]
+        if orthogonal:
+            for direction in ORTHOGONAL:
+                found |= slide(square, direction, occupied) & orthogonal
+        lances = bb[LANCE] & own
+        if lances:
+            # Lances of the color slide towards the square from behind it
+            found |= slide(square, SLIDES[other][LANCE][0], occupied) & lances
+        return found
+
+    def _pinning_sliders(self, color: int) -> list[int]:
+        """
+        Get the enemy pieces that could pin a piece of the color to its king,
+        by direction from the king.
+        """
+        bb = self.piece_bb
+        enemies = self.occupied[color ^ 1]
+        diagonal = (bb[BISHOP] | bb[PROM_BISHOP]) & enemies
+        orthogonal = (bb[ROOK] | bb[PROM_ROOK]) & enemies
+        sliders = [
+            diagonal if direction in DIAGONAL else orthogonal for direction in range(8)
+        ]
+        # Enemy lances pin along the file they slide down towards the king
+        sliders[OPPOSITE[SLIDES[color ^ 1][LANCE][0]]] |= bb[LANCE] & enemies
+        return sliders
+
+    def _pins(self, king: int, color: int, occupied: int) -> dict[int, int]:
+        """
+        Get the pieces of the color pinned to its king, with the squares each
+        can move to without leaving the line to the pinning piece.
+        """
+        own = self.occupied[color]
+        pins = {}
+        for direction, sliders in enumerate(self._pinning_sliders(color)):
+            ray = RAYS[direction][king]
+            if not ray & sliders:
+                continue
+            first = nearest(ray & occupied, direction)
+            second = nearest((ray & occupied) ^ first, direction)
+            if first & own and second & sliders:
+                pinner = second.bit_length() - 1
+                pins[first.bit_length() - 1] = ray ^ RAYS[direction][pinner]
+        return pins
+
+    def _evasions(self) -> (bool, int, dict[int, int]):
+        """
+        Get whether the side to move is in double check, the squares its pieces
+        other than the king may move to, and its pinned pieces.
+        """
+        us = self.turn
+        own = self.occupied[us]
+        occupied = own | self.occupied[us ^ 1]
+        king = self.king_squares[us]
+        if king is None:
+            return False, BB_ALL ^ own, {}
+        targets = BB_ALL ^ own
+        checkers = self.attackers(king, us ^ 1, occupied)
+        if checkers & (checkers - 1):
+            return True, 0, {}
+        if checkers:
+            targets &= line(king, checkers.bit_length() - 1)
+        return False, targets, self._pins(king, us, occupied)
+
+    def _is_pawn_drop_mate(self, square: int) -> bool:
+        """
+        Whether dropping a pawn of the side to move on the square mates, as
+        python-shogi decides it.
+        """
+        us, them = self.turn, self.turn ^ 1
+        king = self.king_squares[them]
+        if king is None or not STEPS[us][PAWN][square] >> king & 1:
+            return False
+        occupied = self.occupied[us] | self.occupied[them] | 1 << square
+        escapes = KING_STEPS[king] & ~self.occupied[them]
+        while escapes:
+            low = escapes & -escapes
+            if not self.attackers(low.bit_length() - 1, us, occupied):
+                return False
+            escapes ^= low
+        return not self.attackers(square, them, occupied, kings=False)
+
+    def _is_safe_king_move(self, from_square: int, to_square: int) -> bool:
+        """Whether the king of the side to move is not attacked on the square"""
+        occupied = self.occupied[BLACK] | self.occupied[WHITE]
+        return not self.attackers(to_square, self.turn ^ 1, occupied ^ 1 << from_square)
+
+    def _pawn_files(self, color: int) -> int:
+        """Get the files with a pawn of the color"""
+        pawns = self.piece_bb[PAWN] & self.occupied[color]
+        files = 0
+        while pawns:
+            low = pawns & -pawns
+            files |= FILES[(low.bit_length() - 1) % 9]
+            pawns ^= low
+        return files
+
+    def _king_moves(self):
+        """Generate the moves of the king to squares it is not attacked on"""
+        own = self.occupied[self.turn]
+        kings = self.piece_bb[KING] & own
+        while kings:
+            origin = kings & -kings
+            kings ^= origin
+            from_square = origin.bit_length() - 1
+            destinations = KING_STEPS[from_square] & ~own
+            while destinations:
+                low = destinations & -destinations
+                destinations ^= low
+                to_square = low.bit_length() - 1
+                if self._is_safe_king_move(from_square, to_square):
+                    yield MOVES[81 * from_square + to_square]
+
+    def _piece_moves(self, piece_type: int, targets: int, pins: dict[int, int]):
+        """
+        Generate the moves of the pieces of the type, to the target squares
+        and along the line of their pin.
+        """
+        us = self.turn
+        movers = self.piece_bb[piece_type] & self.occupied[us]
+        occupied = self.occupied[BLACK] | self.occupied[WHITE]
+        unpromoted = UNPROMOTED[us][piece_type]
+        zone = ZONES[us] if piece_type in PROMOTABLE else 0
+        while movers:
+            origin = movers & -movers
+            movers ^= origin
+            from_square = origin.bit_length() - 1
+            destinations = (
+                attacks(piece_type, from_square, us, occupied)
+                & targets
+                & pins.get(from_square, BB_ALL)
+            )
+            while destinations:
+                low = destinations & -destinations
+                destinations ^= low
+                index = 81 * from_square + low.bit_length() - 1
+                if unpromoted & low:
+                    yield MOVES[index]
+                if zone & (origin | low):
+                    yield PROMOTIONS[index]
+
+    def _drops(self, targets: int):
+        """
+        Generate the drops to the empty target squares, without two pawns on
+        a file or mate by a dropped pawn.
+        """
+        us = self.turn
+        hand = self.pieces_in_hand[us]
+        empty = targets & ~(self.occupied[BLACK] | self.occupied[WHITE])
+        masks = {
+            piece_type: empty & UNPROMOTED[us][piece_type]
+            for piece_type in DROP_TYPES
+            if hand[piece_type]
+        }
+        if PAWN in masks:
+            masks[PAWN] &= ~self._pawn_files(us)
+        squares = 0
+        for mask in masks.values():
+            squares |= mask
+        while squares:
+            low = squares & -squares
+            squares ^= low
+            to_square = low.bit_length() - 1
+            for piece_type, mask in masks.items():
+                if mask & low and (
+                    piece_type != PAWN or not self._is_pawn_drop_mate(to_square)
+                ):
+                    yield DROPS[piece_type][to_square]
+
+    def generate_legal_moves(self):
+        """
+        Generate the legal moves: moves by piece type, from square and to
+        square, then drops by to square and piece type.
+        """
+        double_check, targets, pins = self._evasions()
+        for piece_type in PIECE_TYPES:
+            if piece_type == KING:
+                yield from self._king_moves()
+            elif not double_check:
+                yield from self._piece_moves(piece_type, targets, pins)
+        if not double_check:
+            yield from self._drops(targets)
+
+    @property
+    def legal_moves(self) -> list[Move]:
+        """Get the legal moves"""
+        return list(self.generate_legal_moves())
+
+    def _is_droppable(self, piece_type: int, to_square: int) -> bool:
+        """
+        Whether the piece can be dropped on the square, ignoring the king of
+        the side to move
+        """
+        us = self.turn
+        to_mask = 1 << to_square
+        occupied = self.occupied[BLACK] | self.occupied[WHITE]
+        if (
+            not self.pieces_in_hand[us][piece_type]
+            or occupied & to_mask
+            or not UNPROMOTED[us][piece_type] & to_mask
+        ):
+            return False
+        return piece_type != PAWN or not (
+            self.piece_bb[PAWN] & self.occupied[us] & FILES[to_square % 9]
+            or self._is_pawn_drop_mate(to_square)
+        )
+
+    def _is_pseudo_legal_move(self, move: Move) -> bool:
+        """
+        Whether a piece of the side to move can make the move, ignoring its
+        king
+        """
+        us = self.turn
+        piece_type = self.pieces[move.from_square]
+        from_mask, to_mask = 1 << move.from_square, 1 << move.to_square
+        if not piece_type or not self.occupied[us] & from_mask:
+            return False
+        if move.promotion:
+            allowed = piece_type in PROMOTABLE and ZONES[us] & (from_mask | to_mask)
+        else:
+            allowed = UNPROMOTED[us][piece_type] & to_mask
+        occupied = self.occupied[BLACK] | self.occupied[WHITE]
+        return bool(allowed) and bool(
+            attacks(piece_type, move.from_square, us, occupied) & to_mask
+        )
+
+    def is_legal(self, move: Move) -> bool:
+        """Whether the move is legal in the position"""
+        if not move or self.occupied[self.turn] >> move.to_square & 1:
+            return False
+        if move.from_square is None:
+            if not self._is_droppable(move.drop_piece_type, move.to_square):
+                return False
+        elif not self._is_pseudo_legal_move(move):
+            return False
+        elif self.pieces[move.from_square] == KING:
+            return self._is_safe_king_move(move.from_square, move.to_square)
+        double_check, targets, pins = self._evasions()
+        targets &= pins.get(move.from_square, BB_ALL)
+        return not double_check and bool(targets >> move.to_square & 1)
+
+    def is_check(self) -> bool:
+        """Whether the king of the side to move is attacked"""
+        king = self.king_squares[self.turn]
+        occupied = self.occupied[BLACK] | self.occupied[WHITE]
+        return king is not None and bool(self.attackers(king, self.turn ^ 1, occupied))
+
+    def is_checkmate(self) -> bool:
+        """Whether the side to move is checked and has no legal move"""
+        return self.is_check() and next(self.generate_legal_moves(), None) is None
+
+    def is_fourfold_repetition(self) -> bool:
+        """Whether the position occurred for the fourth time"""
+        return self.transpositions[self.zobrist_hash()] >= 4
+
+    def is_game_over(self) -> bool:
+        """Whether the side to move has no legal move, or the position repeated"""
+        if next(self.generate_legal_moves(), None) is None:
+            return True
+        return self.is_fourfold_repetition()
+
+    def push(self, move: Move):
+        """Make the move, which must be at least pseudo legal"""
+        self.move_number += 1
+        captured = self.pieces[move.to_square] if move else NONE
+        self.captured_piece_stack.append(captured)
+        self.move_stack.append(move)
+        if not move:
+            self.turn ^= 1
+            return
+
+        us = self.turn
+        if move.drop_piece_type:
+            piece_type = move.drop_piece_type
+            self.pieces_in_hand[us][piece_type] -= 1
+        else:
+            piece_type = self.pieces[move.from_square]
+            self._remove(move.from_square, piece_type, us)
+            if move.promotion:
+                piece_type = PIECE_PROMOTED[piece_type]
+        if captured:
+            self._remove(move.to_square, captured, us ^ 1)
+            self.pieces_in_hand[us][CAPTURED_TYPES[captured]] += 1
+        self._put(move.to_square, piece_type, us)
+
+        self.turn ^= 1
+        self.transpositions[self.zobrist_hash()] += 1
+
+    def pop(self) -> Move:
+        """Unmake the last move and get it"""
+        move = self.move_stack.pop()
+        self.transpositions[self.zobrist_hash()] -= 1
+        self.move_number -= 1
+        captured = self.captured_piece_stack.pop()
+        self.turn ^= 1
+        if not move:
+            return move
+
+        us = self.turn
+        piece_type = self.pieces[move.to_square]
+        self._remove(move.to_square, piece_type, us)
+        if move.promotion:
+            piece_type = PIECE_PROMOTED.index(piece_type)
+        if move.from_square is None:
+            self.pieces_in_hand[us][piece_type] += 1
+        else:
+            self._put(move.from_square, piece_type, us)
+        if captured:
+            self.pieces_in_hand[us][CAPTURED_TYPES[captured]] -= 1
+            self._put(move.to_square, captured, us ^ 1)
+        return move
+
+    def peek(self) -> Move:
+        """Get the last move"""
+        return self.move_stack[-1]
+
+    def sfen(self) -> str:
+        """Get the sfen of the position"""
+        rows = []
+        for rank in range(9):
+            row, empty = [], 0
+            for square in range(rank * 9, rank * 9 + 9):
+                piece = self.piece_at(square)
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row.append(str(empty))
+                    empty = 0
+                row.append(piece.symbol())
+            if empty:
+                row.append(str(empty))
+            rows.append("".join(row))
+
+        hands = []
+        for color in (BLACK, WHITE):
+            hand = self.pieces_in_hand[color]
+            for piece_type in reversed(DROP_TYPES):
+                if hand[piece_type] > 1:
+                    hands.append(str(hand[piece_type]))
+                if hand[piece_type]:
+                    hands.append(PIECES[color][piece_type].symbol())
+        return " ".join(
+            [
+                "/".join(rows),
+                "w" if self.turn == WHITE else "b",
+                "".join(hands) or "-",
+                str(self.move_number),
+            ]
+        )
+
+    def _set_board(self, rows: list[str], sfen: str):
+        """Put the pieces of the ranks of a sfen on the board"""
+        for rank, row in enumerate(rows):
+            file, prefix = 0, ""
+            for char in row:
+                if char in "123456789":
+                    file += int(char)
+                elif char == "+":
+                    prefix = "+"
+                else:
+                    piece = Piece.from_symbol(prefix + char)
+                    if file > 8:
+                        raise ValueError(f"Too many squares in sfen {sfen!r}")
+                    self._put(rank * 9 + file, piece.piece_type, piece.color)
+                    file, prefix = file + 1, ""
+            if file != 9 or prefix:
+                raise ValueError(f"Expected 9 squares per rank in sfen {sfen!r}")
+
+    def _set_hands(self, hands: str, sfen: str):
+        """Put the pieces in hand of a sfen in the hands"""
+        if hands == "-":
+            return
+        count = 0
+        for char in hands:
+            if char.isdigit():
+                count = 10 * count + int(char)
+                continue
+            piece = Piece.from_symbol(char)
+            if piece.piece_type not in DROP_TYPES:
+                raise ValueError(f"Invalid piece in hand in sfen {sfen!r}")
+            self.pieces_in_hand[piece.color][piece.piece_type] += count or 1
+            count = 0
+
+    def set_sfen(self, sfen: str):
+        """Set the position from a sfen, raising ValueError when it is invalid"""
+        parts = sfen.split()
+        if len(parts) != 4:
+            raise ValueError(f"Expected 4 parts in sfen {sfen!r}")
+        rows = parts[0].split("/")
+        if len(rows) != 9 or parts[1] not in ("b", "w") or int(parts[3]) < 0:
+            raise ValueError(f"Invalid sfen {sfen!r}")
+
+        self.clear()
+        self._set_board(rows, sfen)
+        self._set_hands(parts[2], sfen)
+        self.turn = WHITE if parts[1] == "w" else BLACK
+        self.move_number = int(parts[3]) or 1
+        self.transpositions = collections.Counter((self.zobrist_hash(),))
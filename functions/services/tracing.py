@@ -0,0 +1,169 @@
+"""
+Stage timing of requests. Stages are nested context managers that record their
+duration and fields such as ply counts and payload sizes. When the outermost
+stage of a request ends, the whole tree is written as one structured log entry,
+which Cloud Logging parses as JSON, and the stages can also be exported as
+OpenTelemetry spans. When tracing is off, stage returns one shared no-op
+context, so instrumented code pays little more than a function call.
+"""
+
+import contextlib
+import contextvars
+import functools
+import importlib
+import logging
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+
+from firebase_functions import logger as cloud_logger
+
+from config import OPENTELEMETRY, TRACING
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """A timed stage of a request, with its nested stages"""
+
+    name: str
+    fields: dict = field(default_factory=dict)
+    milliseconds: float = 0.0
+    stages: list["Stage"] = field(default_factory=list)
+
+    def set(self, **fields):
+        """Add fields to the stage"""
+        self.fields.update(fields)
+
+    def to_dict(self) -> dict:
+        """Get the stage as structured log fields"""
+        stage_dict = {
+            "name": self.name,
+            "ms": round(self.milliseconds, 3),
+            **self.fields,
+        }
+        if self.stages:
+            stage_dict["stages"] = [stage.to_dict() for stage in self.stages]
+        return stage_dict
+
+
+# pylint: disable-next=too-few-public-methods
+class _DisabledStage:
+    """Stand-in for a stage when tracing is off, ignoring all fields"""
+
+    def set(self, **fields):
+        """Ignore the fields"""
+
+
+_DISABLED = contextlib.nullcontext(_DisabledStage())
+_current: contextvars.ContextVar[Stage | None] = contextvars.ContextVar(
+    "stage", default=None
+)
+
+
+def payload_size(value: any) -> int:
+    """
+    Estimate the stored size in bytes of a document or field value, counting
+    strings and bytes by length and other scalars as 8 bytes.
+    """
+    if isinstance(value, dict):
+        return sum(len(key) + payload_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+class Tracer:
+    """
+    Records the stages of requests. Every finished request is logged and handed
+    to the listeners, which get its outermost stage.
+    """
+
+    def __init__(self, enabled: bool = TRACING, opentelemetry: bool = OPENTELEMETRY):
+        self.enabled = enabled
+        self.listeners: list[Callable[[Stage], None]] = []
+        self._otel_tracer = self._load_opentelemetry() if opentelemetry else None
+
+    def stage(self, name: str, **fields) -> contextlib.AbstractContextManager:
+        """
+        Time a stage of the current request. The context value is the Stage,
+        to add fields that are only known once the work is done.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return self._stage(name, fields)
+
+    def traced(self, name: str) -> Callable:
+        """Decorator that times every call of the function as a stage"""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextlib.contextmanager
+    def _stage(self, name: str, fields: dict) -> Iterator[Stage]:
+        """Record the stage, and emit the request when it is the outermost one"""
+        parent = _current.get()
+        stage = Stage(name, fields)
+        token = _current.set(stage)
+        span_context = (
+            self._otel_tracer.start_as_current_span(name)
+            if self._otel_tracer is not None
+            else contextlib.nullcontext()
+        )
+        start = time.perf_counter()
+        try:
+            with span_context as span:
+                try:
+                    yield stage
+                except BaseException as error:
+                    stage.set(error=type(error).__name__)
+                    raise
+                finally:
+                    stage.milliseconds = (time.perf_counter() - start) * 1000
+                    if span is not None:
+                        span.set_attributes(
+                            {
+                                key: value
+                                for key, value in stage.fields.items()
+                                if isinstance(value, (bool, int, float, str))
+                            }
+                        )
+        finally:
+            _current.reset(token)
+            if parent is not None:
+                parent.stages.append(stage)
+            else:
+                self._emit(stage)
+
+    def _emit(self, request: Stage):
+        """Log the stages of a finished request, and hand them to the listeners"""
+        cloud_logger.info(
+            f"{request.name} took {request.milliseconds:.1f}ms",
+            trace=request.to_dict(),
+        )
+        for listener in self.listeners:
+            listener(request)
+
+    @staticmethod
+    def _load_opentelemetry():
+        """Get an OpenTelemetry tracer, when the package is installed"""
+        try:
+            trace = importlib.import_module("opentelemetry.trace")
+        except ImportError:
+            logger.warning("opentelemetry is not installed, stages are only logged")
+            return None
+        return trace.get_tracer(__name__)
+
+
+# Process wide tracer used by the services
+tracer = Tracer()
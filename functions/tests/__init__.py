@@ -0,0 +1,4 @@
+"""
+Tests of the functions backend. Run them from the functions folder with
+`python -m pytest tests`.
+"""
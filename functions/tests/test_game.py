@@ -0,0 +1,177 @@
+"""
+Moves of the game service, with the in-memory repository in place of
+Firestore. AI moves are queued, so no model is loaded.
+"""
+
+import pytest
+import shogi
+from firebase_functions.https_fn import FunctionsErrorCode, HttpsError
+from google.cloud.firestore import DELETE_FIELD
+
+from benchmarks.fixtures import InMemoryGameRepository
+from repository.dataclasses.game import AI_FAILED, AI_PENDING, COMPACT_FORMAT, Game
+from repository.game_repository import GameRepository
+from services.board import NON_PROMOTION
+from services.game import GameService
+
+# Rooks moving back and forth, which repeats the starting position
+ROOK_SHUFFLE = [("2h", "3h"), ("8b", "7b"), ("3h", "2h"), ("7b", "8b")]
+
+
+def new_move(from_square: str, to_square: str, promotion: bool = False) -> dict:
+    """Get a move as the endpoints pass it"""
+    return {"from_square": from_square, "to_square": to_square, "promotion": promotion}
+
+
+@pytest.fixture(name="repository")
+def fixture_repository() -> InMemoryGameRepository:
+    """An empty in-memory repository"""
+    return InMemoryGameRepository()
+
+
+def service(repository: InMemoryGameRepository) -> GameService:
+    """Get a service for one request, as the container does"""
+    return GameService(None, repository, async_ai=True)
+
+
+def test_make_move(repository: InMemoryGameRepository):
+    """The move is stored, and the client gets the changed squares"""
+    uid = service(repository).create()
+    response = service(repository).make_move(uid, new_move("7g", "7f"), version=0)
+
+    assert response["squares"] == {"7g": None, "7f": "P"}
+    assert response["last_moves"] == [{**new_move("7g", "7f"), "ply": 1}]
+    stored = repository.documents[uid]
+    assert stored["move_count"] == 1
+    assert stored["turn"] == 1
+
+
+@pytest.mark.parametrize(
+    "from_square, to_square",
+    [("7g", "7e"), ("", "7f"), ("zz", "7f"), ("7g", ""), ("5e", "5d"), ("K*", "5e")],
+)
+def test_illegal_move(
+    repository: InMemoryGameRepository, from_square: str, to_square: str
+):
+    """An illegal or malformed move is refused, and the game is not changed"""
+    uid = service(repository).create()
+    stored = dict(repository.documents[uid])
+
+    with pytest.raises(HttpsError) as error:
+        service(repository).make_move(uid, new_move(from_square, to_square))
+    assert error.value.code == FunctionsErrorCode.INVALID_ARGUMENT
+    assert repository.documents[uid] == stored
+
+
+@pytest.mark.parametrize("ai_status", [AI_PENDING, AI_FAILED])
+@pytest.mark.parametrize("method", ["make_move", "play_turn"])
+def test_wait_for_ai(repository: InMemoryGameRepository, ai_status: str, method: str):
+    """The player can not move while the AI move is pending or failed"""
+    uid = service(repository).create()
+    service(repository).make_move(uid, new_move("7g", "7f"))
+    repository.set_ai_status(uid, ai_status)
+
+    with pytest.raises(HttpsError) as error:
+        getattr(service(repository), method)(uid, new_move("3c", "3d"))
+    assert error.value.code == FunctionsErrorCode.FAILED_PRECONDITION
+
+
+def test_retry_failed_ai_move(repository: InMemoryGameRepository):
+    """A failed AI move is queued again by ai_move"""
+    uid = service(repository).create()
+    response = service(repository).play_turn(uid, new_move("7g", "7f"))
+    assert response["ai_status"] == AI_PENDING
+
+    repository.set_ai_status(uid, AI_FAILED)
+    response = service(repository).ai_move(uid)
+    assert response["ai_status"] == AI_PENDING
+    assert repository.documents[uid]["ai_status"] == AI_PENDING
+
+
+# White to move and mated by the gold
+MATED_SFEN = "4k4/4G4/4P4/9/9/9/9/9/4K4 w - 1"
+
+
+@pytest.mark.parametrize("sfen", [None, MATED_SFEN])
+def test_ai_move_refused(repository: InMemoryGameRepository, sfen: str | None):
+    """An AI move is not queued when the player is to move or the game is over"""
+    game = Game(moves=[], board=None, pieces_in_hand=None)
+    game.sfen = sfen or shogi.STARTING_SFEN
+    repository.create(game)
+
+    with pytest.raises(HttpsError) as error:
+        service(repository).ai_move(game.uid)
+    assert error.value.code == FunctionsErrorCode.FAILED_PRECONDITION
+    assert repository.documents[game.uid]["ai_status"] is None
+
+
+def test_repetition_after_snapshot(repository: InMemoryGameRepository):
+    """Fourfold repetition is detected on a board restored from the snapshot"""
+    uid = service(repository).create()
+    for from_square, to_square in ROOK_SHUFFLE * 3:
+        service(repository).make_move(uid, new_move(from_square, to_square))
+
+    game_service = service(repository)
+    game = game_service._get_game(uid)
+    assert game.sfen is not None
+    assert game_service.shogi_board.board.is_fourfold_repetition()
+
+
+def test_repetitions_reset_by_pawn_move(repository: InMemoryGameRepository):
+    """Only the positions since the last pawn move are stored to count repetitions"""
+    uid = service(repository).create()
+    for from_square, to_square in ROOK_SHUFFLE:
+        service(repository).make_move(uid, new_move(from_square, to_square))
+    assert len(repository.get(uid).repetitions) == 8 * (len(ROOK_SHUFFLE) + 1)
+
+    service(repository).make_move(uid, new_move("7g", "7f"))
+    assert len(repository.get(uid).repetitions) == 8
+
+
+def test_update_writes_changed_fields(repository: InMemoryGameRepository):
+    """A move writes the new move and the changed fields, and drops stale ones"""
+    uid = service(repository).create()
+    repository.documents[uid]["legal_moves"] = {"7g": {"7f": 1}}
+    game_service = service(repository)
+    game = game_service._get_game(uid)
+    game_service._play_player_move(game, new_move("7g", "7f"))
+
+    fields = GameRepository.update_fields(game)
+    assert set(fields) == {
+        "moves",
+        "move_count",
+        "board",
+        "sfen",
+        "repetitions",
+        "move_number",
+        "turn",
+        "legal_moves",
+    }
+    assert fields["legal_moves"] is DELETE_FIELD
+    assert fields["moves"].values == [{**new_move("7g", "7f"), "ply": 1}]
+
+
+def test_compact_record():
+    """Compact records leave out what the sfen has, and read it back on load"""
+    repository = InMemoryGameRepository(COMPACT_FORMAT)
+    uid = service(repository).create()
+    for from_square, to_square in ROOK_SHUFFLE[:3]:
+        service(repository).make_move(uid, new_move(from_square, to_square))
+
+    document = repository.documents[uid]
+    assert "turn" not in document and "board" not in document
+    game = repository.get(uid)
+    assert (game.turn, game.move_number, game.move_count) == (1, 4, 3)
+    assert [move["to_square"] for move in game.moves] == ["3h", "7b", "2h"]
+    assert game.board[1][2] == "r" and game.pieces_in_hand == []
+
+
+def test_legal_move_map(repository: InMemoryGameRepository):
+    """The legal move map is fetched once per position, not sent with moves"""
+    uid = service(repository).create()
+    response = service(repository).make_move(uid, new_move("7g", "7f"), version=0)
+    assert "legal_moves" not in response
+
+    result = service(repository).get_legal_moves(uid)
+    assert result["move_count"] == 1
+    assert result["legal_moves"]["3c"] == {"3d": NON_PROMOTION}
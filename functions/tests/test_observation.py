@@ -0,0 +1,62 @@
+"""
+Parity of the observation encoder with the original per square implementation
+of ShogiEnv.get_observation, and of the packed position format with the planes.
+"""
+
+import numpy as np
+import pytest
+import shogi
+
+from benchmarks.observation import legacy_observation
+from benchmarks.positions import random_positions
+from services.ai.observation import (
+    BOARD_PLANES,
+    PACKED_BYTES,
+    ObservationEncoder,
+    unpack_observations,
+)
+
+
+@pytest.fixture(name="boards", scope="module")
+def fixture_boards() -> list[shogi.Board]:
+    """Random positions, many with pieces in hand, and the starting position"""
+    return random_positions(count=64, plies=60) + [shogi.Board()]
+
+
+def test_legacy_hand_planes(boards: list[shogi.Board]):
+    """Without hand planes the encoder matches the original one"""
+    encoder = ObservationEncoder(hand_planes=False)
+    batch = encoder.encode_batch(boards)
+    for board, batched in zip(boards, batch):
+        expected = legacy_observation(board)
+        assert np.array_equal(encoder.encode(board), expected), board.sfen()
+        assert np.array_equal(batched, expected), board.sfen()
+
+
+def test_hand_planes(boards: list[shogi.Board]):
+    """
+    With hand planes the board planes match the original encoder, and every
+    hand plane holds the number of pieces in hand
+    """
+    encoder = ObservationEncoder(hand_planes=True)
+    batch = encoder.encode_batch(boards)
+    for board, batched in zip(boards, batch):
+        actual = encoder.encode(board)
+        assert np.array_equal(actual, batched), board.sfen()
+        assert np.array_equal(
+            actual[:BOARD_PLANES], legacy_observation(board)[:BOARD_PLANES]
+        ), board.sfen()
+        for color in (shogi.BLACK, shogi.WHITE):
+            for piece_type in range(shogi.PAWN, shogi.ROOK + 1):
+                plane = actual[BOARD_PLANES + 2 * (piece_type - 1) + color]
+                assert plane.sum() == board.pieces_in_hand[color][piece_type]
+
+
+@pytest.mark.parametrize("hand_planes", [False, True])
+def test_unpack(boards: list[shogi.Board], hand_planes: bool):
+    """Unpacked positions match the planes of the encoder"""
+    encoder = ObservationEncoder(hand_planes=hand_planes)
+    packed = encoder.pack_batch(boards)
+    assert packed.shape == (len(boards), PACKED_BYTES)
+    unpacked = unpack_observations(packed, hand_planes=hand_planes).numpy()
+    assert np.array_equal(unpacked, encoder.encode_batch(boards))
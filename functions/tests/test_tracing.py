@@ -0,0 +1,143 @@
+"""
+Traced stages of every endpoint in main.py. The endpoints are called through
+their callable wrappers, with the in-memory repository in place of Firestore,
+and the stage names and nesting of every request are checked against the
+expected ones.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from firebase_functions.core import Change
+from firebase_functions.firestore_fn import Event
+from google.cloud.firestore_v1.base_document import DocumentSnapshot
+
+import main as endpoints
+from benchmarks.fixtures import InMemoryGameRepository, call
+from repository.dataclasses.game import AI_PENDING
+from services.container import ServiceContainer
+from services.tracing import Stage, Tracer, tracer
+
+LOAD = ["game.load", "game.load/firestore.get"]
+AI_MOVE = [
+    "ai.move",
+    "ai.move/ai.load",
+    "ai.move/ai.setup",
+    "ai.move/ai.choose",
+    "game.position",
+    "firestore.update",
+]
+
+# Stage paths every request of the endpoint must have, below its own stage
+EXPECTED_STAGES = {
+    "create_game": ["game.position", "firestore.set"],
+    "make_move": LOAD + ["game.position", "firestore.update"],
+    "read_legal_moves": LOAD,
+    "ai_move": LOAD + AI_MOVE,
+    "play_turn": LOAD + AI_MOVE,
+    "ai_move_worker": LOAD + AI_MOVE,
+}
+
+# Stages of a move the network chooses, below ai.choose
+NETWORK_STAGES = ["agent.mask", "agent.observation", "agent.forward"]
+
+
+def stage_paths(stage: Stage, prefix: str = "") -> list[tuple[str, Stage]]:
+    """Get every nested stage with its path below the request"""
+    paths = []
+    for child in stage.stages:
+        path = f"{prefix}{child.name}"
+        paths.append((path, child))
+        paths.extend(stage_paths(child, f"{path}/"))
+    return paths
+
+
+def updated_event(uid: str, game_dict: dict) -> Event:
+    """Get the event of an update of the game document"""
+    now = datetime.now(timezone.utc)
+    after = DocumentSnapshot(None, game_dict, True, now, now, now)
+    return Event(
+        specversion="1.0",
+        id="test",
+        source="test",
+        type="google.cloud.firestore.document.v1.updated",
+        time=now,
+        data=Change(before=None, after=after),
+        subject=f"documents/games/{uid}",
+        location="europe-west1",
+        project="shogiai",
+        database="(default)",
+        namespace="(default)",
+        document=f"games/{uid}",
+        params={"gameId": uid},
+    )
+
+
+@pytest.fixture(name="requests", scope="module")
+def fixture_requests() -> dict[str, Stage]:
+    """Call every endpoint of main.py once, and get its traced request"""
+    repository = InMemoryGameRepository()
+    container = endpoints.container
+    endpoints.container = ServiceContainer(endpoints.app, repository)
+    requests = []
+    tracer.listeners.append(requests.append)
+    tracer.enabled = True
+    try:
+        uid = call(endpoints.create_game, {})
+        move = {"uid": uid, "promotion": False}
+        call(endpoints.make_move, {**move, "from_square": "7g", "to_square": "7f"})
+        call(endpoints.read_legal_moves, {"uid": uid, "from_square": "3c"})
+        call(endpoints.ai_move, {"uid": uid})
+        call(endpoints.play_turn, {**move, "from_square": "2g", "to_square": "2f"})
+
+        repository.set_ai_status(uid, AI_PENDING)
+        event = updated_event(uid, repository.documents[uid])
+        endpoints.play_queued_ai_move(event)
+    finally:
+        tracer.enabled = False
+        tracer.listeners.remove(requests.append)
+        endpoints.container = container
+    return {request.name: request for request in requests}
+
+
+def test_every_endpoint_is_traced(requests: dict[str, Stage]):
+    """Every endpoint is one request, named after the endpoint"""
+    assert list(requests) == list(EXPECTED_STAGES)
+
+
+@pytest.mark.parametrize("endpoint", EXPECTED_STAGES)
+def test_stages(requests: dict[str, Stage], endpoint: str):
+    """The request has the stages of its endpoint, nested as expected"""
+    paths = dict(stage_paths(requests[endpoint]))
+    missing = [path for path in EXPECTED_STAGES[endpoint] if path not in paths]
+    assert not missing
+    assert all(stage.milliseconds >= 0 for stage in paths.values())
+
+    for path, stage in paths.items():
+        if stage.name != "ai.choose" or stage.fields.get("cached"):
+            continue
+        children = {child.name for child in stage.stages}
+        assert children in (set(NETWORK_STAGES), {"ai.search"}), path
+
+
+def test_disabled_stage():
+    """Without tracing no stages are recorded, and fields are ignored"""
+    requests = []
+    disabled = Tracer(enabled=False, opentelemetry=False)
+    disabled.listeners.append(requests.append)
+    with disabled.stage("request", ply=1) as stage:
+        stage.set(moves=2)
+    assert not requests
+
+
+def test_error_stage():
+    """A stage that raises is still emitted, with the error it raised"""
+    requests = []
+    enabled = Tracer(enabled=True, opentelemetry=False)
+    enabled.listeners.append(requests.append)
+    with pytest.raises(ValueError):
+        with enabled.stage("request"):
+            with enabled.stage("inner"):
+                raise ValueError
+    assert [stage.name for stage in requests[0].stages] == ["inner"]
+    assert requests[0].fields["error"] == "ValueError"
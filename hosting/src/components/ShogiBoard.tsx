@@ -19,7 +19,8 @@ function filterByCase(
 }
 
 export const ShogiBoard = () => {
-  const { currentGame, getLegalMoves, makeMove, aiMove } = useGame();
+  const { currentGame, getLegalMoveMap, playTurn, aiMove, aiToMove } =
+    useGame();
 
   const rows = 9;
   const cols = 9;
@@ -106,20 +107,33 @@ export const ShogiBoard = () => {
     setLegalMoves(emptyBoard);
   };
 
+  // The player's pieces can not be moved while the AI is to move
   const handleMakeMove = async (to_square: string) => {
+    if (aiToMove) return;
     if (selectedPiece !== null) {
-      await makeMove(selectedPiece, to_square);
+      await playTurn(selectedPiece, to_square);
       setSelectedPiece(null);
       setLegalMoves(emptyBoard);
     }
   };
 
   const handlePieceClick = async (from_square: string | null) => {
+    if (aiToMove) return;
     setSelectedPiece(from_square);
     setLegalMoves(emptyBoard);
-    const moves = await getLegalMoves(from_square);
-    console.log(moves);
-    if (moves !== undefined) setLegalMoves(moves);
+    const legalMoveMap = await getLegalMoveMap();
+    if (legalMoveMap === undefined) return;
+    const targets = (from_square && legalMoveMap[from_square]) || {};
+    setLegalMoves(
+      emptyBoard.map((cells, row) =>
+        cells.map((_, col) => {
+          const to_square = `${9 - col}${String.fromCharCode(
+            65 + row
+          ).toLowerCase()}`;
+          return to_square in targets ? to_square : null;
+        })
+      )
+    );
   };
 
   const renderBoard = () => {
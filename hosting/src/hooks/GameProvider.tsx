@@ -1,27 +1,156 @@
-import { doc, getDoc, getFirestore } from "firebase/firestore";
+import {
+  Bytes,
+  DocumentData,
+  doc,
+  getDoc,
+  getFirestore,
+  onSnapshot,
+} from "firebase/firestore";
 import { getFunctions, httpsCallable } from "firebase/functions";
-import { ReactNode, createContext, useState } from "react";
+import { ReactNode, createContext, useEffect, useRef, useState } from "react";
 
-interface Move {}
+interface Move {
+  from_square: string;
+  to_square: string;
+  promotion: boolean;
+  // Missing on moves stored before moves were appended to the game
+  ply?: number;
+}
+
+// Legal moves by from square, or piece and "*" for drops, and to square. The
+// value has bit 1 set when the move can be made without promotion, and bit 2
+// when it can be made with promotion.
+export type LegalMoveMap = {
+  [from_square: string]: { [to_square: string]: number };
+};
 
 interface Game {
   uid: string;
   moves: Move[];
   pieces_in_hand: string[];
   board: (string | null)[][];
+  move_count?: number;
+  // Pending while the AI worker has not replied yet in async mode, failed when
+  // it could not make its move, which is then asked for again with ai_move
+  ai_status?: "pending" | "failed" | null;
+  // Side to move, the player is black (0) and the AI white (1)
+  turn?: number;
+  // Snapshot of the position, the board of games stored with delta writes
+  sfen?: string;
+  // Only returned by the move endpoints
+  last_moves?: Move[];
+}
+
+// Changed squares and hand counts of the board between two versions of the
+// game, which are its move counts
+interface BoardDelta {
+  version: number;
+  base_version: number;
+  squares: { [square: string]: string | null };
+  hands: { [symbol: string]: number };
 }
 
+// Response of the move endpoints, the delta since the version the client sent,
+// or the whole game with a flat board when the server has another version
+type PositionUpdate = Omit<Game, "board" | "moves"> &
+  Partial<BoardDelta> & {
+    board?: [string | null];
+    moves?: Move[];
+  };
+
+// Version of the compact game record, with the moves packed in 16 bit codes
+// and the board stored as sfen only
+const COMPACT_FORMAT = 2;
+const INDEX_MASK = (1 << 13) - 1;
+const PROMOTION_BIT = 1 << 13;
+
+const squareName = (index: number) =>
+  `${9 - (index % 9)}${String.fromCharCode(97 + Math.floor(index / 9))}`;
+
+const squareIndex = (name: string) =>
+  (name.charCodeAt(1) - 97) * 9 + 9 - Number(name[0]);
+
+// Pieces in hand are listed by color and from rook to pawn, as in sfen
+const HAND_SYMBOLS = "RBGSNLPrbgsnlp";
+
+// Unpack the little endian move codes, 81 * from + to with drops from 81 on
+const unpackMoves = (data: Uint8Array): Move[] => {
+  const moves: Move[] = [];
+  for (let i = 0; i + 1 < data.length; i += 2) {
+    const code = data[i] | (data[i + 1] << 8);
+    const from = Math.floor((code & INDEX_MASK) / 81);
+    moves.push({
+      from_square: from < 81 ? squareName(from) : `${"PLNSGBR"[from - 81]}*`,
+      to_square: squareName((code & INDEX_MASK) % 81),
+      promotion: (code & PROMOTION_BIT) !== 0,
+      ply: i / 2 + 1,
+    });
+  }
+  return moves;
+};
+
+// Get the board and the pieces in hand of a sfen
+const parseSfen = (sfen: string) => {
+  const [placement, , hand] = sfen.split(" ");
+  const board = placement.split("/").map((rank) => {
+    const row: (string | null)[] = [];
+    let prefix = "";
+    for (const char of rank) {
+      if (char >= "1" && char <= "9") {
+        row.push(...Array(Number(char)).fill(null));
+      } else if (char === "+") {
+        prefix = char;
+      } else {
+        row.push(prefix + char);
+        prefix = "";
+      }
+    }
+    return row;
+  });
+  const pieces_in_hand: string[] = [];
+  let count = "";
+  for (const char of hand === "-" ? "" : hand) {
+    if (char >= "0" && char <= "9") {
+      count += char;
+    } else {
+      pieces_in_hand.push(...Array(Number(count || 1)).fill(char));
+      count = "";
+    }
+  }
+  return { board, pieces_in_hand };
+};
+
+// Get the board and the pieces in hand of the game after the changes of a delta
+const applyDelta = (game: Game, delta: BoardDelta) => {
+  const board = game.board.map((row) => [...row]);
+  for (const [square, symbol] of Object.entries(delta.squares)) {
+    const index = squareIndex(square);
+    board[Math.floor(index / 9)][index % 9] = symbol;
+  }
+  const counts: { [symbol: string]: number } = { ...delta.hands };
+  for (const symbol of game.pieces_in_hand) {
+    counts[symbol] = (counts[symbol] ?? 0) + 1;
+  }
+  const pieces_in_hand = [...HAND_SYMBOLS].flatMap((symbol) =>
+    Array(counts[symbol] ?? 0).fill(symbol)
+  );
+  return { board, pieces_in_hand };
+};
+
 export interface GameContextType {
   currentGame: Game | null;
   loading: boolean;
+  // Whether the player has to wait for the AI, as it is to move or its move is
+  // pending or failed
+  aiToMove: boolean;
   get: () => Promise<void>;
   getById: (uid: string) => Promise<void>;
   create: () => Promise<void>;
-  getLegalMoves: (
-    from_square: string | null
-  ) => Promise<(string | null)[][] | undefined>;
+  // Legal moves of the current position, fetched once per position
+  getLegalMoveMap: () => Promise<LegalMoveMap | undefined>;
   makeMove: (from_square: string, to_square: string) => Promise<void>;
   aiMove: () => Promise<void>;
+  playTurn: (from_square: string, to_square: string) => Promise<void>;
 }
 
 export const GameContext = createContext<GameContextType | undefined>(
@@ -49,17 +178,113 @@ export const GameProvider = ({ children }: Props) => {
     return result;
   };
 
+  // Get the position of a game document, from the board the client has when
+  // it is at the same version or the stored delta starts at its version
+  const toPosition = (gameData: DocumentData, current: Game | null) => {
+    const delta = gameData.delta as BoardDelta | undefined;
+    if (current !== null && current.uid === gameData.uid) {
+      if (
+        current.move_count !== undefined &&
+        current.move_count === gameData.move_count
+      ) {
+        return { board: current.board, pieces_in_hand: current.pieces_in_hand };
+      }
+      if (
+        delta?.version === gameData.move_count &&
+        delta.base_version === current.move_count
+      ) {
+        return applyDelta(current, delta);
+      }
+    }
+    if (gameData.format === COMPACT_FORMAT || gameData.board === undefined) {
+      return parseSfen(gameData.sfen);
+    }
+    return {
+      board: make_table(gameData.board),
+      pieces_in_hand: gameData.pieces_in_hand,
+    };
+  };
+
+  const toGame = (gameData: DocumentData, current: Game | null = null): Game => {
+    const compact = gameData.format === COMPACT_FORMAT;
+    const moves = compact
+      ? unpackMoves((gameData.moves as Bytes).toUint8Array())
+      : gameData.moves;
+    // Compact records leave the side to move to the sfen
+    const turn = compact
+      ? Number(gameData.sfen.split(" ")[1] === "w")
+      : gameData.turn;
+    return {
+      ...gameData,
+      ...toPosition(gameData, current),
+      moves,
+      turn,
+    } as Game;
+  };
+
   const _getById = async (uid: string): Promise<Game | null> => {
     const gameRef = doc(db, rootCollection, uid);
     const gameDoc = await getDoc(gameRef);
     if (gameDoc.exists()) {
-      const gameData = gameDoc.data();
-      gameData.board = make_table(gameData.board);
-      return gameData as Game;
+      return toGame(gameDoc.data());
     }
     return null;
   };
 
+  // Keep the newest state of the game, responses and snapshots can cross.
+  // The next state is made from the current one, or is null to keep it.
+  const updateGame = (next: (current: Game | null) => Game | null) => {
+    setCurrentGame((current) => {
+      const game = next(current);
+      return game === null ||
+        (current !== null &&
+          current.uid === game.uid &&
+          (current.move_count ?? 0) > (game.move_count ?? 0))
+        ? current
+        : game;
+    });
+  };
+
+  // Apply the response of a move endpoint. A delta that does not start at the
+  // current version is dropped, the snapshot listener brings the game then.
+  const applyUpdate = (update: PositionUpdate) => {
+    updateGame((current) => {
+      if (update.board !== undefined) {
+        return { ...update, board: make_table(update.board) } as Game;
+      }
+      if (
+        current === null ||
+        current.uid !== update.uid ||
+        current.move_count !== update.base_version
+      ) {
+        return null;
+      }
+      const fields = { ...update };
+      delete fields.squares;
+      delete fields.hands;
+      delete fields.version;
+      delete fields.base_version;
+      return {
+        ...current,
+        ...fields,
+        ...applyDelta(current, update as BoardDelta),
+        moves: [...current.moves, ...(update.last_moves ?? [])],
+      };
+    });
+  };
+
+  // Follow the game document, so moves written by the AI worker show up
+  useEffect(() => {
+    if (!currentGame?.uid) return;
+    const gameRef = doc(db, rootCollection, currentGame.uid);
+    return onSnapshot(gameRef, (gameDoc) => {
+      if (gameDoc.exists()) {
+        updateGame((current) => toGame(gameDoc.data(), current));
+      }
+    });
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [currentGame?.uid]);
+
   const get = async (): Promise<void> => {
     setLoading(true);
     try {
@@ -123,10 +348,49 @@ export const GameProvider = ({ children }: Props) => {
     setLoading(true);
     try {
       const Function = httpsCallable(functions, "ai_move");
-      await Function({
+      const response = await Function({
         uid: currentGame.uid,
+        version: currentGame.move_count,
       });
-      await getById(currentGame.uid);
+      applyUpdate(response.data as PositionUpdate);
+    } catch (e) {
+      console.error(e);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  // The move endpoints do not send the legal moves, so they are read once for
+  // each position the player selects a piece in
+  const legalMoveCache = useRef<{
+    uid: string;
+    move_count: number;
+    legal_moves: LegalMoveMap;
+  } | null>(null);
+
+  const getLegalMoveMap = async () => {
+    if (currentGame === null) return;
+    const cached = legalMoveCache.current;
+    if (
+      cached?.uid === currentGame.uid &&
+      cached.move_count === currentGame.move_count
+    ) {
+      return cached.legal_moves;
+    }
+    setLoading(true);
+    try {
+      const readLegalMoves = httpsCallable(functions, "read_legal_moves");
+      const response = await readLegalMoves({ uid: currentGame.uid });
+      const { move_count, legal_moves } = response.data as {
+        move_count: number;
+        legal_moves: LegalMoveMap;
+      };
+      legalMoveCache.current = {
+        uid: currentGame.uid,
+        move_count,
+        legal_moves,
+      };
+      return legal_moves;
     } catch (e) {
       console.error(e);
     } finally {
@@ -134,15 +398,21 @@ export const GameProvider = ({ children }: Props) => {
     }
   };
 
-  const getLegalMoves = async (from_square: string | null) => {
+  const makeMove = async (from_square: string, to_square: string) => {
+    if (currentGame === null) {
+      return;
+    }
     setLoading(true);
     try {
-      const getLegalMoves = httpsCallable(functions, "read_legal_moves");
-      const response = await getLegalMoves({
+      // The response has the changes of the board, so the game is not read again
+      const Function = httpsCallable(functions, "make_move");
+      const response = await Function({
         from_square,
-        uid: currentGame?.uid,
+        to_square,
+        uid: currentGame.uid,
+        version: currentGame.move_count,
       });
-      return response.data as (string | null)[][];
+      applyUpdate(response.data as PositionUpdate);
     } catch (e) {
       console.error(e);
     } finally {
@@ -150,19 +420,21 @@ export const GameProvider = ({ children }: Props) => {
     }
   };
 
-  const makeMove = async (from_square: string, to_square: string) => {
+  const playTurn = async (from_square: string, to_square: string) => {
     if (currentGame === null) {
       return;
     }
     setLoading(true);
     try {
-      const getLegalMoves = httpsCallable(functions, "make_move");
-      await getLegalMoves({
+      // The response has the changes of the board, so the game is not read again
+      const Function = httpsCallable(functions, "play_turn");
+      const response = await Function({
         from_square,
         to_square,
-        uid: currentGame?.uid,
+        uid: currentGame.uid,
+        version: currentGame.move_count,
       });
-      await getById(currentGame.uid);
+      applyUpdate(response.data as PositionUpdate);
     } catch (e) {
       console.error(e);
     } finally {
@@ -173,12 +445,16 @@ export const GameProvider = ({ children }: Props) => {
   const contextValue: GameContextType = {
     currentGame,
     loading,
+    aiToMove:
+      currentGame !== null &&
+      (currentGame.turn === 1 || Boolean(currentGame.ai_status)),
     get,
     getById,
     create,
-    getLegalMoves,
+    getLegalMoveMap,
     makeMove,
     aiMove,
+    playTurn,
   };
 
   return (
@@ -6,7 +6,7 @@ import { useEffect } from "react";
 import { Loading } from "../components/loading/Loading";
 
 export const Shogi = () => {
-  const { currentGame, get, create, loading } = useGame();
+  const { currentGame, get, create, aiMove, loading } = useGame();
 
   useEffect(() => {
     get();
@@ -31,6 +31,17 @@ export const Shogi = () => {
         </>
       )}
       {loading && <Loading description={"Game is loading"} />}
+      {!loading && currentGame?.ai_status === "pending" && (
+        <Loading description={"AI is thinking"} />
+      )}
+      {!loading && currentGame?.ai_status === "failed" && (
+        <div className="ai-failed">
+          <p>The AI could not make its move.</p>
+          <button className="retry-ai-button" onClick={aiMove}>
+            Retry AI move
+          </button>
+        </div>
+      )}
     </div>
   );
 };